@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Benchmarks run from the backend/ folder, e.g. `python -m benchmarks.get_latency`,
+# against the code in lambda/ and the in-process AWS stand-ins.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lambda"))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("DYNAMODB_TABLE_NAME", "chess-with-humans-benchmark")
+os.environ.setdefault("ARCHIVE_BUCKET", "chess-with-humans-benchmark-archive")
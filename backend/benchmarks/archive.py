@@ -0,0 +1,113 @@
+import argparse
+import contextlib
+import io
+import random
+import statistics
+import time
+
+import chess
+
+from . import common
+from chesswithhumans import chess_routes, utils
+from chesswithhumans.archive import ARCHIVE_BUCKET, archive_key, archive_stream_route
+from chesswithhumans.game_cache import game_cache
+from chesswithhumans.local_aws import FakeDynamo, FakeS3, item_size
+
+# Games played to their end through /move: the size of the game item before the
+# last move against the tombstone it shrinks to and the gzipped archive object,
+# the last move's latency against the moves before it, then /get from the
+# tombstone against /get, /history and /pgn of a game whose item is gone (read
+# back from the archive), and archiving expired games from stream records. The
+# last move also deletes the game's ply items.
+#
+#   python -m benchmarks.archive --latency-ms 5 --s3-latency-ms 20
+
+GAMES = 5
+EXPIRED = 50
+
+
+def finished_game_moves(seed):
+    rng = random.Random(seed)
+    board = chess.Board()
+    moves = []
+    while not board.is_game_over():
+        move = rng.choice(list(board.legal_moves))
+        board.push(move)
+        moves.append(move.uci())
+    return moves, board.outcome().termination.name.lower()
+
+
+def play(game_id, moves, first_ply=0):
+    timings = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for ply, move in enumerate(moves, first_ply):
+            password = common.PASSWORD_ONE if ply % 2 == 0 else common.PASSWORD_TWO
+            event = common.http_event("/move", {"game_id": game_id, "password": password, "move": move})
+            start = time.perf_counter()
+            assert chess_routes.make_move_route(event)["statusCode"] == 200
+            timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def timed_ms(fn, repeat=20):
+    return common.time_call(fn, repeat=repeat)["median_ms"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency-ms", type=float, default=5.0)
+    parser.add_argument("--s3-latency-ms", type=float, default=20.0)
+    args = parser.parse_args()
+
+    dynamo, _ = common.install_fakes(
+        dynamo=FakeDynamo(latency_seconds=args.latency_ms / 1000),
+        s3=FakeS3(latency_seconds=args.s3_latency_ms / 1000),
+    )
+    s3 = utils.s3.client
+    print(f"{args.latency_ms}ms per DynamoDB call, {args.s3_latency_ms}ms per S3 call")
+    print(
+        f"{'plies':>5} {'ending':<22} {'item':>7} {'tombstone':>10} {'archive':>8} "
+        f"{'move median':>12} {'last move':>10}"
+    )
+    for seed in range(GAMES):
+        moves, termination = finished_game_moves(seed)
+        game_id = common.new_game(dynamo)
+        timings = play(game_id, moves[:-1])
+        item_bytes = item_size(dynamo.items[("game", game_id)])
+        timings += play(game_id, moves[-1:], len(moves) - 1)
+        tombstone = dynamo.items[("game", game_id)]
+        assert tombstone["archived"]["BOOL"]
+        # the ply items went with the game
+        assert not any(key[0] == f"plies-{game_id}" for key in dynamo.items)
+        archive_bytes = len(s3.objects[(ARCHIVE_BUCKET, archive_key(game_id))])
+        print(
+            f"{len(moves):>5} {termination:<22} {item_bytes:>7} {item_size(tombstone):>10} {archive_bytes:>8} "
+            f"{statistics.median(timings[:-1]):>10.1f}ms {timings[-1]:>8.1f}ms"
+        )
+
+    get = common.http_event("/get", {"game_id": game_id, "password": common.PASSWORD_ONE})
+    history = common.http_event("/history", {"game_id": game_id, "password": common.PASSWORD_ONE})
+    pgn = common.http_event("/pgn", {"game_id": game_id, "password": common.PASSWORD_ONE})
+
+    def cold(route, event):
+        game_cache.invalidate(game_id)
+        assert route(event)["statusCode"] == 200
+
+    print(f"/get from the tombstone        {timed_ms(lambda: cold(chess_routes.get_game_route, get)):>7.1f}ms")
+    del dynamo.items[("game", game_id)]
+    print(f"/get from the archive          {timed_ms(lambda: cold(chess_routes.get_game_route, get)):>7.1f}ms")
+    print(f"/history from the archive      {timed_ms(lambda: cold(chess_routes.history_route, history)):>7.1f}ms")
+    print(f"/pgn from the archive          {timed_ms(lambda: cold(chess_routes.export_pgn_route, pgn)):>7.1f}ms")
+
+    records = []
+    for seed in range(EXPIRED):
+        expired_id = common.new_game(dynamo, common.random_game_moves(40, seed=seed))
+        records.append({"eventName": "REMOVE", "dynamodb": {"OldImage": dynamo.items.pop(("game", expired_id))}})
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        archive_stream_route({"Records": records})
+    print(f"{EXPIRED} expired games archived from the stream in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
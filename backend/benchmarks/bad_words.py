@@ -0,0 +1,91 @@
+import random
+import re
+import time
+
+from chesswithhumans import bad_words
+
+# The bundled single-pass matcher against the previous approach, one compiled
+# regex per word tried with re.match in turn, over the bundled list. They have to
+# judge every username the same, but for one intended difference: the single
+# pass leaves out the words with anything but letters and digits in them. The
+# username has all of that removed before matching, so the old regexes only
+# matched those words through the regex characters in them ("shi+" matched
+# "ship", "masterbat*" matched "masterba").
+
+USERNAMES = 2000
+
+
+def per_word_regexes(word_list):
+    # how bad_words.py used to compile the list
+    output = []
+    for bad_word in word_list:
+        for letter, pattern in (
+            ("e", "[e3]"),
+            ("g", "[g9]"),
+            ("i", "[i1]"),
+            ("o", "[o0]"),
+            ("s", "[s5]"),
+            ("t", "[t7]"),
+        ):
+            bad_word = bad_word.replace(letter, pattern)
+        output.append(re.compile(bad_word))
+    return output
+
+
+def has_bad_word_per_word(regexes, input_text):
+    input_text = re.sub(bad_words.SPECIAL_CHARS, "", input_text)
+    return any(re.match(bad_word, input_text) for bad_word in regexes)
+
+
+def intended_difference(word_list, regexes, username):
+    """Whether the old matcher only flagged the username through words the
+    single pass leaves out"""
+    input_text = re.sub(bad_words.SPECIAL_CHARS, "", username)
+    matched = [word for word, regex in zip(word_list, regexes) if re.match(regex, input_text)]
+    return bool(matched) and all(bad_words.SPECIAL_CHARS.search(word) for word in matched)
+
+
+def main():
+    word_list = bad_words.read_bad_word_list()
+    rng = random.Random(1)
+    usernames = []
+    for _ in range(USERNAMES):
+        name = "".join(rng.choices("abcdefghijklmnopqrstuvwxyz01357 _", k=rng.randint(4, 16)))
+        if rng.random() < 0.1:
+            name = rng.choice(word_list) + name
+        usernames.append(name)
+    # the words the single pass leaves out, as they would be typed
+    usernames += [word for word in word_list if bad_words.SPECIAL_CHARS.search(word)]
+
+    start = time.perf_counter()
+    regexes = per_word_regexes(word_list)
+    old_compile = time.perf_counter() - start
+    start = time.perf_counter()
+    old = [has_bad_word_per_word(regexes, name) for name in usernames]
+    old_check = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pattern = bad_words.compile_bad_words(word_list)
+    new_compile = time.perf_counter() - start
+    bad_words.bad_word_pattern = pattern
+    start = time.perf_counter()
+    new = [bad_words.has_bad_word(name) for name in usernames]
+    new_check = time.perf_counter() - start
+
+    differences = [name for name, a, b in zip(usernames, old, new) if a != b]
+    # only ever fewer usernames flagged, never more
+    unexplained = [
+        name
+        for name, a, b in zip(usernames, old, new)
+        if a != b and (b or not intended_difference(word_list, regexes, name))
+    ]
+    print(f"{len(word_list)} words, {len(usernames)} usernames, {sum(new)} flagged")
+    print(f"{'':<12} {'compile':>10} {'per username':>14}")
+    print(f"{'per word':<12} {old_compile * 1000:>8.1f}ms {old_check / len(usernames) * 1e6:>12.1f}us")
+    print(f"{'single pass':<12} {new_compile * 1000:>8.1f}ms {new_check / len(usernames) * 1e6:>12.1f}us")
+    print(f"{len(differences)} usernames judged differently, all through words with other characters in them")
+    assert not unexplained, f"judged differently: {unexplained}"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Cold start cost of each route in lambda_function.route: every sample is a
+# fresh python process that imports lambda_function (import time) and handles
+# one event (first invocation). The boto3 clients are still created on first
+# use like they would be on AWS, the stand-ins in local_aws.py answer the calls.
+# The code is staged the way the Lambda sees it: python-chess copied next to it
+# when it is not bundled already, and no __pycache__ folders.
+#
+#   python -m benchmarks.cold_start                    # the sources in lambda/
+#   python -m benchmarks.cold_start --code build/lambda  # the bundle from build-bundle.sh
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOCAL_AWS = os.path.join(BACKEND, "lambda", "chesswithhumans", "local_aws.py")
+STARTING_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+GAME_ID = "absent-topic-into"
+OPEN_GAME_ID = "tuna-orient-midnight"
+PASSWORD = "a" * 64
+
+
+def http(path, body):
+    return {"path": path, "httpMethod": "POST", "body": json.dumps(body)}
+
+
+def socket(route_key, body=None):
+    event = {"requestContext": {"routeKey": route_key, "connectionId": "cold-start-connection"}}
+    if body is not None:
+        event["body"] = json.dumps(body)
+    return event
+
+
+EVENTS = {
+    "/get": http("/get", {"game_id": GAME_ID, "password": PASSWORD}),
+    "/join": http("/join", {"game_id": OPEN_GAME_ID}),
+    "/create": http("/create", {}),
+    "/move": http("/move", {"game_id": GAME_ID, "password": PASSWORD, "move": "e2e4"}),
+    "/is-it-my-turn": http("/is-it-my-turn", {"game_id": GAME_ID, "password": PASSWORD}),
+    "$connect": socket("$connect"),
+    "$disconnect": socket("$disconnect"),
+    "register": socket("register", {"action": "register", "message": {"game_id": GAME_ID, "password": PASSWORD}}),
+    "$default": socket("$default", {"message": "hello"}),
+}
+
+# Runs in the fresh process, with the arguments sample() passes
+CHILD = """
+import contextlib, importlib.util, io, json, os, sys, time
+code_dir, local_aws_path, route_name, events, fen, game_id, open_game_id, password = sys.argv[1:]
+sys.path.insert(0, code_dir)
+start = time.perf_counter()
+import lambda_function
+imported = time.perf_counter()
+
+spec = importlib.util.spec_from_file_location("local_aws", local_aws_path)
+local_aws = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(local_aws)
+from chesswithhumans import utils
+
+def game(key2, joined):
+    item = {"key1": "game", "key2": key2, "player_one_password": password, "fen": fen, "moves": [],
+            "whose_turn": 1, "version": 1}
+    if joined:
+        item["player_two_password"] = "b" * 64
+    return utils.python_obj_to_dynamo_obj(item)
+
+fake_dynamo = local_aws.FakeDynamo()
+fake_dynamo.put_item(TableName="", Item=game(game_id, True))
+fake_dynamo.put_item(TableName="", Item=game(open_game_id, False))
+fake_apigw = local_aws.FakeApiGateway()
+fake_apigw.connections.add("cold-start-connection")
+
+def pay_for_client_then_use(client, fake):
+    factory = client.factory
+    def paying_factory():
+        factory()
+        return fake
+    client.factory = paying_factory
+
+pay_for_client_then_use(utils.dynamo, fake_dynamo)
+pay_for_client_then_use(utils.apigw, fake_apigw)
+event = json.loads(events)[route_name]
+invoked = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    result = lambda_function.lambda_handler(event, None)
+finished = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "first_invocation_ms": (finished - invoked) * 1000,
+    "status": result.get("statusCode"),
+}))
+"""
+
+
+def sample(code_dir, route_name):
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            CHILD,
+            code_dir,
+            LOCAL_AWS,
+            route_name,
+            json.dumps(EVENTS),
+            STARTING_FEN,
+            GAME_ID,
+            OPEN_GAME_ID,
+            PASSWORD,
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+        env={"AWS_DEFAULT_REGION": "us-east-1", **os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+    )
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def stage(code_dir, staging_dir):
+    ignore = shutil.ignore_patterns("__pycache__")
+    shutil.copytree(code_dir, staging_dir, ignore=ignore, dirs_exist_ok=True)
+    if not os.path.isdir(os.path.join(staging_dir, "chess")):
+        import chess
+
+        shutil.copytree(os.path.dirname(chess.__file__), os.path.join(staging_dir, "chess"), ignore=ignore)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--code", default=os.path.join(BACKEND, "lambda"))
+    parser.add_argument("--samples", type=int, default=5)
+    args = parser.parse_args()
+    staging_dir = tempfile.mkdtemp()
+    stage(args.code, staging_dir)
+    print(f"{'route':<16} {'import':>10} {'first call':>12} {'total':>10} {'status':>7}")
+    for route_name in EVENTS:
+        samples = [sample(staging_dir, route_name) for _ in range(args.samples)]
+        import_ms = statistics.median(s["import_ms"] for s in samples)
+        first_ms = statistics.median(s["first_invocation_ms"] for s in samples)
+        print(
+            f"{route_name:<16} {import_ms:>8.1f}ms {first_ms:>10.1f}ms {import_ms + first_ms:>8.1f}ms "
+            f"{samples[0]['status']:>7}"
+        )
+    shutil.rmtree(staging_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import json
+import random
+import statistics
+import time
+
+import chess
+
+from chesswithhumans import utils, words_ids
+from chesswithhumans.game_state import repetition_counts
+from chesswithhumans.local_aws import FakeDynamo, FakeApiGateway, FakeLambda, FakeS3
+from chesswithhumans.utils import python_obj_to_dynamo_obj
+
+PASSWORD_ONE = "a" * 64
+PASSWORD_TWO = "b" * 64
+
+
+def install_fakes(dynamo=None, apigw=None, lambda_client=None, s3=None):
+    import lambda_function
+
+    dynamo = dynamo or FakeDynamo()
+    apigw = apigw or FakeApiGateway()
+    utils.dynamo.use(dynamo)
+    utils.apigw.use(apigw)
+    # the function invoking itself (broadcasts to spectators) runs the handler here
+    utils.lambda_client.use(lambda_client or FakeLambda(lambda_function.lambda_handler))
+    utils.s3.use(s3 or FakeS3())
+    return dynamo, apigw
+
+
+def random_game_moves(plies, seed=0):
+    # random legal moves, starting over whenever the game ends before enough plies
+    rng = random.Random(seed)
+    while True:
+        board = chess.Board()
+        moves = []
+        while len(moves) < plies and not board.is_game_over():
+            move = rng.choice(list(board.legal_moves))
+            board.push(move)
+            moves.append(move.uci())
+        if len(moves) == plies:
+            return moves
+
+
+def new_game(dynamo, moves=()):
+    """Puts a joined game straight into the table, returns its game_id"""
+    board = chess.Board()
+    for move in moves:
+        board.push_uci(move)
+    game_id = words_ids.generate_id()
+    dynamo.put_item(
+        TableName="",
+        Item=python_obj_to_dynamo_obj(
+            {
+                "key1": "game",
+                "key2": game_id,
+                "player_one_username": "Player 1",
+                "player_one_password": PASSWORD_ONE,
+                "player_two_username": "Player 2",
+                "player_two_password": PASSWORD_TWO,
+                "fen": board.fen(),
+                "moves": list(moves),
+                "positions": repetition_counts(moves),
+                "whose_turn": 1 if board.turn == chess.WHITE else 2,
+                "version": 1 + len(moves),
+                "expiration": int(time.time()) + (7 * 24 * 60 * 60),
+            }
+        ),
+    )
+    return game_id
+
+
+def http_event(path, body):
+    return {"path": path, "httpMethod": "POST", "body": json.dumps(body)}
+
+
+def time_call(fn, repeat=200):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {
+        "median_ms": statistics.median(samples) * 1000,
+        "p95_ms": samples[int(len(samples) * 0.95) - 1] * 1000,
+    }
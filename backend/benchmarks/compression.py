@@ -0,0 +1,62 @@
+import base64
+import contextlib
+import gzip
+import io
+import json
+import timeit
+
+from . import common
+from chesswithhumans import chess_routes
+from chesswithhumans.utils import COMPRESSION_MIN_BYTES, compress
+
+# Response compression across representative bodies: the /get state early and
+# late in a game in both formats, and /create-batch answers. For each, the
+# bytes sent plain and gzipped, the time spent compressing at a few levels, and
+# what the smaller body saves on a slow phone connection.
+#
+#   python -m benchmarks.compression
+
+LEVELS = (1, 6, 9)
+# roughly a 2G connection, which a lot of KaiOS phones are on
+LINK_KBITS = 64
+
+
+def bodies(dynamo):
+    for plies in (0, 60, 150):
+        game_id = common.new_game(dynamo, common.random_game_moves(plies, seed=plies) if plies else [])
+        for wire_format in ("full", "compact"):
+            event = common.http_event(
+                "/get", {"game_id": game_id, "password": common.PASSWORD_ONE, "format": wire_format}
+            )
+            yield f"/get {plies} plies {wire_format}", chess_routes.get_game_route(event)["body"]
+    for count in (10, 200):
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = chess_routes.create_games_route(common.http_event("/create-batch", {"count": count}))
+        yield f"/create-batch {count}", response["body"]
+
+
+def main():
+    dynamo, _ = common.install_fakes()
+    print(f"compressed at {COMPRESSION_MIN_BYTES} bytes and up, saved time at {LINK_KBITS} kbit/s")
+    print(
+        f"{'body':<26} {'plain':>7} {'gzip':>7} {'base64':>7} "
+        + " ".join(f"{f'level {level}':>9}" for level in LEVELS)
+        + f" {'saved':>9}"
+    )
+    for name, body in bodies(dynamo):
+        compressed = compress(body, "gzip")
+        assert json.loads(gzip.decompress(compressed)) == json.loads(body)
+        timings = []
+        for level in LEVELS:
+            number = 200
+            timings.append(timeit.timeit(lambda: compress(body, "gzip", level), number=number) / number * 1e6)
+        saved_ms = (len(body) - len(compressed)) * 8 / LINK_KBITS
+        print(
+            f"{name:<26} {len(body):>7} {len(compressed):>7} {len(base64.b64encode(compressed)):>7} "
+            + " ".join(f"{timing:>7.1f}us" for timing in timings)
+            + f" {saved_ms:>7.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import contextlib
+import io
+import json
+import random
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import chess
+
+from . import common
+from chesswithhumans import chess_routes, web_socket_routes
+from chesswithhumans.connections import game_connections
+from chesswithhumans.local_aws import FakeDynamo
+from chesswithhumans.utils import dynamo_obj_to_python_obj, python_obj_to_dynamo_obj
+
+# Fires racing moves and WebSocket registrations at the same games and checks
+# that no write is lost: the stored moves replay to the stored FEN, the version
+# counts every move, exactly one of two racing moves wins, and every registered
+# connection ends up in the connection registry.
+
+GAMES = 20
+ROUNDS = 10
+
+
+def register_event(connection_id, game_id, password):
+    return {
+        "requestContext": {"routeKey": "register", "connectionId": connection_id},
+        "body": json.dumps({"action": "register", "message": {"game_id": game_id, "password": password}}),
+    }
+
+
+def play_game(game_id, apigw, seed):
+    rng = random.Random(seed)
+    board = chess.Board()
+    failures = []
+    registered = []
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        for round_number in range(ROUNDS):
+            if board.is_game_over():
+                break
+            password = common.PASSWORD_ONE if board.turn == chess.WHITE else common.PASSWORD_TWO
+            candidates = rng.sample(list(board.legal_moves), k=min(2, board.legal_moves.count()))
+            connections = {}
+            for player, player_password in ((1, common.PASSWORD_ONE), (2, common.PASSWORD_TWO)):
+                connections[player] = f"{game_id}-{player}-{round_number}"
+                apigw.connections.add(connections[player])
+            futures = [
+                pool.submit(
+                    chess_routes.make_move_route,
+                    common.http_event("/move", {"game_id": game_id, "password": password, "move": move.uci()}),
+                )
+                for move in candidates
+            ] + [
+                pool.submit(
+                    web_socket_routes.web_socket_route,
+                    register_event(connections[player], game_id, player_password),
+                    None,
+                )
+                for player, player_password in ((1, common.PASSWORD_ONE), (2, common.PASSWORD_TWO))
+            ]
+            results = [future.result() for future in futures]
+            move_results = results[: len(candidates)]
+            winners = [
+                json.loads(result["body"])["previous_move"] for result in move_results if result["statusCode"] == 200
+            ]
+            if len(winners) != 1:
+                failures.append(f"round {round_number}: {len(winners)} of {len(candidates)} racing moves won")
+                break
+            board.push_uci(winners[0])
+            registered += connections.items()
+    return board, registered, failures
+
+
+def main():
+    dynamo, apigw = common.install_fakes(dynamo=FakeDynamo(latency_seconds=0.002))
+    sys.setswitchinterval(0.0001)
+    game_ids = [common.new_game(dynamo) for _ in range(GAMES)]
+    failures = []
+    route_logs = io.StringIO()
+    with contextlib.redirect_stdout(route_logs), ThreadPoolExecutor(max_workers=GAMES) as pool:
+        outcomes = list(pool.map(play_game, game_ids, [apigw] * GAMES, range(GAMES)))
+    conflicts = route_logs.getvalue().count("changed while making move")
+    for game_id, (board, registered, game_failures) in zip(game_ids, outcomes):
+        failures += [f"{game_id} {failure}" for failure in game_failures]
+        item = dynamo_obj_to_python_obj(
+            dynamo.get_item(TableName="", Key=python_obj_to_dynamo_obj({"key1": "game", "key2": game_id}))["Item"]
+        )
+        replayed = chess.Board()
+        for move in item["moves"]:
+            replayed.push_uci(move)
+        if replayed.fen() != item["fen"] or item["fen"] != board.fen():
+            failures.append(f"{game_id} stored moves and FEN disagree")
+        if item["version"] != 1 + len(item["moves"]):
+            failures.append(f"{game_id} version {item['version']} after {len(item['moves'])} moves")
+        stored_connections = {connection_id: player for connection_id, player, _ in game_connections(game_id)}
+        for player, connection_id in registered:
+            if stored_connections.get(connection_id) != player:
+                failures.append(f"{game_id} lost connection {connection_id} of player {player}")
+    print(f"{GAMES} games x {ROUNDS} rounds of racing moves and registrations")
+    print(f"{conflicts} write conflicts retried")
+    print(f"{len(failures)} lost or conflicting writes")
+    for failure in failures:
+        print(f"  {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
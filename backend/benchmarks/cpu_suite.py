@@ -0,0 +1,132 @@
+import argparse
+import json
+import os
+import sys
+import timeit
+
+import chess
+
+from . import common
+from chesswithhumans import words_ids
+from chesswithhumans.chess_routes import build_game_output, new_game_item
+from chesswithhumans.game_state import (
+    apply_move,
+    build_pgn_string,
+    describe_board,
+    describe_status,
+    load_board,
+    parse_pgn_game,
+    pieces_of,
+)
+from chesswithhumans.utils import dynamo_obj_to_python_obj, format_response, python_obj_to_dynamo_obj
+
+# The pure CPU pieces of a request, without any DynamoDB or API Gateway calls:
+# replaying a PGN, building a board from the FEN snapshot, the pieces/legal_moves
+# output, playing a move, exporting the PGN, converting game items to and from
+# DynamoDB's format and encoding the response, at a few game lengths each.
+#
+#   python -m benchmarks.cpu_suite --save     # write the numbers to cpu_baselines.json
+#   python -m benchmarks.cpu_suite --compare  # flag anything slower than the baselines by --threshold
+#
+# The baselines are only comparable on the machine that saved them, save them
+# again before starting on an optimization. Runs on a busy machine wander by
+# 10-30% (hence the default threshold), a shared one wants --threshold 0.5.
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cpu_baselines.json")
+PLIES = (10, 100, 300)
+REPEAT = 7
+
+
+def game_item(plies):
+    """A game item the way make_move_route leaves it after the given number of plies"""
+    moves = common.random_game_moves(plies, seed=plies)
+    board = chess.Board()
+    item = new_game_item(words_ids.generate_id(), "Player 1", common.PASSWORD_ONE)
+    item.update(player_two_username="Player 2", player_two_password=common.PASSWORD_TWO, graveyard=[])
+    for move in moves:
+        piece_taken, graveyard_piece, en_passant = apply_move(board, move)
+        item.pop("piece_taken", None)
+        if piece_taken:
+            item["piece_taken"] = piece_taken
+            item["graveyard"].append(graveyard_piece)
+        item["en_passant"] = en_passant
+        item["previous_move"] = move
+    item.update(fen=board.fen(), moves=moves, whose_turn=1 if board.turn == chess.WHITE else 2, version=1 + plies)
+    return item, board
+
+
+def cases():
+    for plies in PLIES:
+        item, board = game_item(plies)
+        pgn_string = build_pgn_string(item["moves"])
+        dynamo_item = python_obj_to_dynamo_obj(item)
+        output = build_game_output(item["key2"], 1, board, item)
+        next_move = next(iter(board.legal_moves), None)
+        yield f"parse_pgn_game/{plies}", lambda pgn_string=pgn_string: parse_pgn_game(pgn_string).board()
+        yield f"load_board/{plies}", lambda item=item: load_board(item)
+        # computed, then from the position cache
+        yield f"describe_board/{plies}", lambda board=board: {"pieces": pieces_of(board), **describe_status(board)}
+        yield f"describe_board_cached/{plies}", lambda board=board: describe_board(board)
+        if next_move is not None:
+            yield f"apply_move/{plies}", lambda board=board, move=next_move.uci(): apply_move(
+                board.copy(stack=False), move
+            )
+        yield f"build_pgn_string/{plies}", lambda moves=item["moves"]: build_pgn_string(moves)
+        yield f"dynamo_obj_to_python_obj/{plies}", lambda dynamo_item=dynamo_item: dynamo_obj_to_python_obj(dynamo_item)
+        yield f"python_obj_to_dynamo_obj/{plies}", lambda item=item: python_obj_to_dynamo_obj(item)
+        yield f"format_response/{plies}", lambda output=output: format_response(None, 200, output)
+
+
+def measure(fn):
+    """Best of a few runs, in microseconds per call"""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=REPEAT, number=number)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--save", action="store_true", help="store the results as the new baselines")
+    parser.add_argument("--compare", action="store_true", help="compare against the stored baselines")
+    parser.add_argument("--threshold", type=float, default=0.25, help="slowdown that counts as a regression")
+    parser.add_argument("--only", default="", help="only run cases whose name starts with this")
+    args = parser.parse_args()
+
+    baselines = {}
+    if args.compare:
+        with open(BASELINES_PATH) as baselines_file:
+            baselines = json.load(baselines_file)
+    results = {}
+    regressions = []
+    print(f"{'case':<32} {'us/call':>10} {'baseline':>10} {'change':>8}")
+    for name, fn in cases():
+        if not name.startswith(args.only):
+            continue
+        results[name] = measure(fn)
+        line = f"{name:<32} {results[name]:>10.2f}"
+        if name in baselines:
+            change = results[name] / baselines[name] - 1
+            line += f" {baselines[name]:>10.2f} {change:>+7.1%}"
+            if change > args.threshold:
+                regressions.append(name)
+                line += "  REGRESSION"
+        print(line)
+    if args.save:
+        saved = {}
+        if os.path.exists(BASELINES_PATH):
+            with open(BASELINES_PATH) as baselines_file:
+                saved = json.load(baselines_file)
+        saved.update({name: round(value, 3) for name, value in results.items()})
+        with open(BASELINES_PATH, "w") as baselines_file:
+            json.dump(saved, baselines_file, indent=2, sort_keys=True)
+            baselines_file.write("\n")
+        print(f"saved {len(results)} baselines to {BASELINES_PATH}")
+    if regressions:
+        print(
+            f"{len(regressions)} slower than the baselines by more than {args.threshold:.0%}: {', '.join(regressions)}"
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
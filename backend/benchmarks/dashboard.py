@@ -0,0 +1,59 @@
+import argparse
+import json
+
+from . import common
+from chesswithhumans import chess_routes
+from chesswithhumans.game_cache import game_cache
+from chesswithhumans.local_aws import FakeDynamo
+
+# The play page refreshing a list of games: one /get per game against a single
+# /games request, with a cold game cache, simulated DynamoDB latency, and the
+# calls and read units each way costs.
+#
+#   python -m benchmarks.dashboard --games 20 --latency-ms 8 --throttle 0.05
+
+PLIES = 40
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=8.0)
+    parser.add_argument("--throttle", type=float, default=0.0)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    dynamo, _ = common.install_fakes(FakeDynamo(latency_seconds=args.latency_ms / 1000, seed=1))
+    game_ids = [common.new_game(dynamo, common.random_game_moves(PLIES, seed=seed)) for seed in range(args.games)]
+    games = [{"game_id": game_id, "password": common.PASSWORD_ONE} for game_id in game_ids]
+
+    def one_by_one():
+        for game in games:
+            game_cache.invalidate(game["game_id"])
+            chess_routes.get_game_route(common.http_event("/get", game))
+
+    def batched():
+        response = chess_routes.fetch_games_route(common.http_event("/games", {"games": games}))
+        summaries = json.loads(response["body"])["games"]
+        assert len(summaries) == len(games), summaries
+
+    print(f"{args.games} games of {PLIES} plies, {args.latency_ms}ms per DynamoDB call")
+    print(f"{'requests':<10} {'throttle':>8} {'median':>10} {'p95':>10} {'calls':>6} {'read units':>11}")
+    # a throttled get_item fails the /get outright, so only /games is run throttled
+    runs = [("/get each", one_by_one, 0.0), ("/games", batched, 0.0)]
+    if args.throttle:
+        runs.append(("/games", batched, args.throttle))
+    for name, fn, throttle in runs:
+        dynamo.throttle_rate = throttle
+        calls_before = sum(dynamo.calls.values())
+        units_before = dynamo.capacity()["read_units"]
+        timing = common.time_call(fn, repeat=args.repeat)
+        calls = (sum(dynamo.calls.values()) - calls_before) / args.repeat
+        units = (dynamo.capacity()["read_units"] - units_before) / args.repeat
+        print(
+            f"{name:<10} {throttle:>8} {timing['median_ms']:>8.1f}ms {timing['p95_ms']:>8.1f}ms {calls:>6.1f} {units:>11.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+from . import common
+from chesswithhumans.game_state import build_pgn_string
+from chesswithhumans.utils import python_obj_to_dynamo_obj
+from chesswithhumans import chess_routes, words_ids
+from chesswithhumans.game_cache import game_cache
+import chess
+
+# /get latency by game length, for items that only have the PGN (every read
+# replays the game) against items that carry the FEN snapshot, both with a cold
+# game cache, for the snapshot item served from a warm game cache, and for a
+# client that already has the latest version (answered "not modified"). A /get
+# without a delta does not read the moves, the FEN path has to stay flat as the
+# game grows: it fails if the longest game is FLAT_TOLERANCE times slower than
+# the shortest.
+
+PLIES = (10, 100, 300)
+FLAT_TOLERANCE = 1.5
+
+
+def game_item(game_id, moves, snapshot):
+    item = {
+        "key1": "game",
+        "key2": game_id,
+        "player_one_password": common.PASSWORD_ONE,
+        "player_two_password": common.PASSWORD_TWO,
+        "whose_turn": 1 if len(moves) % 2 == 0 else 2,
+    }
+    if snapshot:
+        board = chess.Board()
+        for move in moves:
+            board.push_uci(move)
+        item["fen"] = board.fen()
+        item["moves"] = moves
+    else:
+        item["pgn_string"] = build_pgn_string(moves)
+    return python_obj_to_dynamo_obj(item)
+
+
+def main():
+    dynamo, _ = common.install_fakes()
+    print(
+        f"{'plies':>6} {'pgn median':>12} {'fen median':>12} {'fen p95':>10} {'cached median':>14} "
+        f"{'not modified':>13}"
+    )
+    fen_medians = []
+    for plies in PLIES:
+        moves = common.random_game_moves(plies, seed=plies)
+        results = []
+        for snapshot in (False, True):
+            game_id = words_ids.generate_id()
+            dynamo.put_item(TableName="", Item=game_item(game_id, moves, snapshot))
+            event = common.http_event("/get", {"game_id": game_id, "password": common.PASSWORD_ONE})
+            response = chess_routes.get_game_route(event)
+            assert response["statusCode"] == 200, response
+
+            def cold_get():
+                game_cache.invalidate(game_id)
+                chess_routes.get_game_route(event)
+
+            # the first calls warm up the imports and the position cache
+            common.time_call(cold_get, repeat=20)
+            results.append(common.time_call(cold_get))
+        results.append(common.time_call(lambda: chess_routes.get_game_route(event)))
+        unchanged = common.http_event("/get", {"game_id": game_id, "password": common.PASSWORD_ONE, "version": 0})
+        assert "not_modified" in chess_routes.get_game_route(unchanged)["body"]
+        results.append(common.time_call(lambda: chess_routes.get_game_route(unchanged)))
+        fen_medians.append(results[1]["median_ms"])
+        print(
+            f"{plies:>6} {results[0]['median_ms']:>10.3f}ms {results[1]['median_ms']:>10.3f}ms "
+            f"{results[1]['p95_ms']:>8.3f}ms {results[2]['median_ms']:>12.3f}ms {results[3]['median_ms']:>11.3f}ms"
+        )
+    assert fen_medians[-1] <= fen_medians[0] * FLAT_TOLERANCE, f"/get grows with the game: {fen_medians}"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import contextlib
+import io
+import json
+
+import chess
+
+from . import common
+from chesswithhumans import chess_routes
+from chesswithhumans.game_state import build_pgn_string, replay_plies
+
+# Paging through a game's history at 100 and 300 plies: the last page of /history
+# served from the per-ply index, the same page the first time it is asked for on
+# a game from before the index (replayed, then written), and replaying the game
+# up to the page on every request. Then the PGN export in chunks from the index
+# against building the whole PGN with chess.pgn, and what the index adds to a
+# move in write units.
+
+PLIES = (100, 300)
+PAGE = 20
+
+
+def replayed_page(moves, first, last):
+    board = chess.Board()
+    for move in moves[: first - 1]:
+        board.push_uci(move)
+    return list(replay_plies(board, moves[first - 1 : last]))
+
+
+def played_game(dynamo, moves):
+    game_id = common.new_game(dynamo)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for ply, move in enumerate(moves):
+            password = common.PASSWORD_ONE if ply % 2 == 0 else common.PASSWORD_TWO
+            event = common.http_event("/move", {"game_id": game_id, "password": password, "move": move})
+            assert chess_routes.make_move_route(event)["statusCode"] == 200
+    return game_id
+
+
+def export_chunks(game_id):
+    chunks = []
+    next_ply = 1
+    while next_ply:
+        event = common.http_event("/pgn", {"game_id": game_id, "password": common.PASSWORD_ONE, "from_ply": next_ply})
+        output = json.loads(chess_routes.export_pgn_route(event)["body"])
+        chunks.append(output["pgn"])
+        next_ply = output.get("next_ply")
+    return chunks
+
+
+def main():
+    dynamo, _ = common.install_fakes()
+    print(f"{'plies':>5} {'last page':<22} {'median':>9} {'p95':>9}")
+    for plies in PLIES:
+        moves = common.random_game_moves(plies, seed=plies)
+        game_id = played_game(dynamo, moves)
+        first = plies - PAGE + 1
+        page = common.http_event(
+            "/history", {"game_id": game_id, "password": common.PASSWORD_ONE, "from_ply": first, "count": PAGE}
+        )
+        old_game_id = common.new_game(dynamo, moves)
+
+        def backfill():
+            for ply in range(first, plies + 1):
+                dynamo.items.pop((f"plies-{old_game_id}", str(ply).zfill(5)), None)
+            chess_routes.history_route(
+                common.http_event(
+                    "/history",
+                    {"game_id": old_game_id, "password": common.PASSWORD_ONE, "from_ply": first, "count": PAGE},
+                )
+            )
+
+        for name, fn in (
+            ("/history from index", lambda: chess_routes.history_route(page)),
+            ("/history backfilled", backfill),
+            ("replayed every time", lambda: replayed_page(moves, first, plies)),
+        ):
+            timing = common.time_call(fn)
+            print(f"{plies:>5} {name:<22} {timing['median_ms']:>7.3f}ms {timing['p95_ms']:>7.3f}ms")
+        chunks = export_chunks(game_id)
+        timing = common.time_call(lambda: export_chunks(game_id), repeat=50)
+        print(
+            f"{plies:>5} {f'/pgn in {len(chunks)} chunks':<22} {timing['median_ms']:>7.3f}ms {timing['p95_ms']:>7.3f}ms"
+        )
+        timing = common.time_call(lambda: build_pgn_string(moves), repeat=50)
+        print(f"{plies:>5} {'build_pgn_string':<22} {timing['median_ms']:>7.3f}ms {timing['p95_ms']:>7.3f}ms")
+
+    moves = common.random_game_moves(40, seed=1)
+    before = dynamo.capacity()["write_units"]
+    played_game(dynamo, moves)
+    per_move = (dynamo.capacity()["write_units"] - before) / len(moves)
+    ply_items = sum(1 for key in dynamo.items if key[0].startswith("plies-"))
+    print(f"write units per move with the index: {per_move:.2f} (1 of them the ply item), {ply_items} ply items")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import argparse
+import contextlib
+import io
+import json
+import random
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from . import common
+from chesswithhumans.local_aws import FakeDynamo, FakeApiGateway
+import lambda_function
+
+# Plays simulated games end to end through lambda_function.route(), many at a
+# time, against the in-process stand-ins: create, join, $connect + register for
+# both players, then per ply the waiting player asks /is-it-my-turn, the mover
+# sends /move and the other player reloads with /get. Reports latency
+# percentiles per route and the DynamoDB capacity the run would have consumed.
+#
+#   python -m benchmarks.load_test --games 2000 --latency-ms 5 --throttle 0.001
+
+
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+class Recorder:
+    def __init__(self):
+        self.timings = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def call(self, name, event):
+        start = time.perf_counter()
+        try:
+            result = lambda_function.route(event, None)
+        except Exception:
+            # lambda_handler would have answered with a 500
+            result = {"statusCode": 500, "body": "{}"}
+        self.timings[name].append(time.perf_counter() - start)
+        if result["statusCode"] not in (200, 204):
+            self.errors[name] += 1
+        return result
+
+
+def socket_event(route_key, connection_id, body=None):
+    event = {"requestContext": {"routeKey": route_key, "connectionId": connection_id}}
+    if body is not None:
+        event["body"] = json.dumps(body)
+    return event
+
+
+def play_game(recorder, apigw, plies, seed):
+    rng = random.Random(seed)
+    created = recorder.call("/create", common.http_event("/create", {}))
+    if created["statusCode"] != 200:
+        return 0
+    game_id = json.loads(created["body"])["game_id"]
+    passwords = {1: json.loads(created["body"])["player_one_password"]}
+    joined = recorder.call("/join", common.http_event("/join", {"game_id": game_id}))
+    if joined["statusCode"] != 200:
+        return 0
+    passwords[2] = json.loads(joined["body"])["player_two_password"]
+    for player, password in passwords.items():
+        connection_id = f"{game_id}-{player}"
+        apigw.connections.add(connection_id)
+        recorder.call("$connect", socket_event("$connect", connection_id))
+        recorder.call(
+            "register",
+            socket_event(
+                "register", connection_id, {"action": "register", "message": {"game_id": game_id, "password": password}}
+            ),
+        )
+    state = json.loads(
+        recorder.call("/get", common.http_event("/get", {"game_id": game_id, "password": passwords[1]}))["body"]
+    )
+    for ply in range(plies):
+        mover = state.get("whose_turn")
+        if not state.get("legal_moves") or mover not in passwords:
+            return ply
+        waiting = 2 if mover == 1 else 1
+        recorder.call(
+            "/is-it-my-turn", common.http_event("/is-it-my-turn", {"game_id": game_id, "password": passwords[waiting]})
+        )
+        move = rng.choice(state["legal_moves"])
+        moved = recorder.call(
+            "/move", common.http_event("/move", {"game_id": game_id, "password": passwords[mover], "move": move})
+        )
+        if moved["statusCode"] != 200:
+            return ply
+        reloaded = recorder.call(
+            "/get", common.http_event("/get", {"game_id": game_id, "password": passwords[waiting]})
+        )
+        state = json.loads(reloaded["body"]) if reloaded["statusCode"] == 200 else json.loads(moved["body"])
+    return plies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--plies", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=64)
+    parser.add_argument("--latency-ms", type=float, default=2.0, help="added to every DynamoDB and API Gateway call")
+    parser.add_argument("--jitter-ms", type=float, default=2.0)
+    parser.add_argument("--throttle", type=float, default=0.0, help="share of DynamoDB calls that get throttled")
+    args = parser.parse_args()
+
+    dynamo = FakeDynamo(
+        latency_seconds=args.latency_ms / 1000,
+        latency_jitter_seconds=args.jitter_ms / 1000,
+        throttle_rate=args.throttle,
+        seed=0,
+    )
+    apigw = FakeApiGateway(latency_seconds=args.latency_ms / 1000)
+    common.install_fakes(dynamo=dynamo, apigw=apigw)
+    recorder = Recorder()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()), ThreadPoolExecutor(max_workers=args.workers) as pool:
+        plies_played = sum(pool.map(lambda seed: play_game(recorder, apigw, args.plies, seed), range(args.games)))
+    elapsed = time.perf_counter() - start
+
+    calls = sum(len(samples) for samples in recorder.timings.values())
+    print(f"{args.games} games, {plies_played} plies, {calls} requests in {elapsed:.1f}s ({calls / elapsed:.0f} req/s)")
+    print(f"{'route':<16} {'requests':>9} {'errors':>7} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for name, samples in recorder.timings.items():
+        samples.sort()
+        print(
+            f"{name:<16} {len(samples):>9} {recorder.errors[name]:>7} "
+            + " ".join(f"{percentile(samples, fraction) * 1000:>7.2f}ms" for fraction in (0.5, 0.95, 0.99))
+        )
+    capacity = dynamo.capacity()
+    print(
+        f"DynamoDB: {capacity['read_units']:.0f} read units, {capacity['write_units']:.0f} write units "
+        f"({capacity['read_units'] / args.games:.1f} / {capacity['write_units'] / args.games:.1f} per game), "
+        f"{capacity['throttled']} throttled calls"
+    )
+    print("DynamoDB calls: " + ", ".join(f"{name} {count}" for name, count in sorted(capacity["calls"].items())))
+
+
+if __name__ == "__main__":
+    main()
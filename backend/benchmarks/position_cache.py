@@ -0,0 +1,87 @@
+import argparse
+import random
+import time
+
+import chess
+
+from chesswithhumans import game_state
+from chesswithhumans.position_cache import PositionCache
+
+# One warm container serving --games games: each opens with one of a few common
+# lines and goes on with random moves, and every ply is described the way /move
+# and the opponent's /get do it, once in each format.
+# The hit rate of the position cache by part of the game, and the time spent
+# describing boards with and without the cache.
+#
+#   python -m benchmarks.position_cache --games 200
+
+OPENINGS = (
+    "e2e4 e7e5 g1f3 b8c6 f1b5 a7a6",
+    "e2e4 e7e5 g1f3 b8c6 f1c4 f8c5",
+    "e2e4 c7c5 g1f3 d7d6 d2d4 c5d4",
+    "e2e4 e7e6 d2d4 d7d5",
+    "e2e4 c7c6 d2d4 d7d5",
+    "e2e4 d7d5 e4d5 d8d5",
+    "d2d4 d7d5 c2c4 e7e6",
+    "d2d4 g8f6 c2c4 g7g6",
+    "d2d4 d7d5 g1f3 g8f6",
+    "c2c4 e7e5 b1c3",
+)
+PLIES = 60
+PHASES = ((1, 4), (5, 10), (11, 20), (21, PLIES))
+
+
+def games(count, seed=0):
+    rng = random.Random(seed)
+    for _ in range(count):
+        board = chess.Board()
+        moves = rng.choice(OPENINGS).split()
+        for move in moves:
+            board.push_uci(move)
+        while len(moves) < PLIES and not board.is_game_over():
+            move = rng.choice(list(board.legal_moves))
+            board.push(move)
+            moves.append(move.uci())
+        yield moves
+
+
+def serve(all_games, cache):
+    game_state.position_cache = cache
+    hits = {phase: [0, 0] for phase in PHASES}
+    elapsed = 0.0
+    for moves in all_games:
+        board = chess.Board()
+        for ply, move in enumerate(moves, 1):
+            board.push_uci(move)
+            before = cache.hits
+            start = time.perf_counter()
+            game_state.describe_board(board)
+            game_state.describe_board_compact(board)
+            elapsed += time.perf_counter() - start
+            for phase in PHASES:
+                if phase[0] <= ply <= phase[1]:
+                    hits[phase][0] += cache.hits - before
+                    hits[phase][1] += 2
+    return hits, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", type=int, default=200)
+    args = parser.parse_args()
+
+    all_games = list(games(args.games))
+    plies = sum(len(moves) for moves in all_games)
+    print(f"{args.games} games, {plies} plies, described in both formats")
+    print(
+        f"{'cache':<12} {'time':>9} {'hit rate':>9} "
+        + " ".join(f"{f'ply {first}-{last}':>10}" for first, last in PHASES)
+    )
+    for name, cache in (("cache", PositionCache()), ("none", PositionCache(max_entries=0))):
+        hits, elapsed = serve(all_games, cache)
+        rates = " ".join(f"{hits[phase][0] / hits[phase][1]:>10.1%}" for phase in PHASES)
+        print(f"{name:<12} {elapsed * 1000:>7.0f}ms {cache.stats()['hit_rate']:>9.1%} {rates}")
+
+
+if __name__ == "__main__":
+    main()
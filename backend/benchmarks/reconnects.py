@@ -0,0 +1,217 @@
+import argparse
+import contextlib
+import io
+import json
+import random
+import statistics
+from collections import Counter
+
+from . import common
+from .load_test import socket_event
+from chesswithhumans import pacing
+from chesswithhumans.local_aws import FakeDynamo, FakeApiGateway
+import lambda_function
+
+# Games played second by second on a simulated clock by two play pages, through
+# lambda_function.route(), once with the page as it was (a one second timer
+# reconnecting the socket whenever it is closed and it is not your turn, the
+# socket closed after every move it brings) and once following the hints (see
+# chesswithhumans/pacing.py). Players think from 10 seconds to an hour a move (PACES),
+# API Gateway closes sockets idle for 10 minutes. Counts the invocations per
+# game and how long a player takes to find out the opponent moved, then the
+# invocations of a page left open for an hour after the game ended.
+#
+#   python -m benchmarks.reconnects --games 3 --plies 40
+
+PACES = (("blitz", 10), ("rapid", 60), ("casual", 300), ("daily", 3600))
+OPEN_AFTER_GAME_SECONDS = 3600
+FOOLS_MATE = "f2f3 e7e5 g2g4 d8h4"
+
+
+class Simulation:
+    def __init__(self, apigw):
+        self.apigw = apigw
+        self.now = 0
+        self.invocations = Counter()
+        self.clients = {}
+        self.connection_count = 0
+        self.last_move_at = 0
+        self.notice_delays = []
+
+    def call(self, name, event):
+        self.invocations[name] += 1
+        with contextlib.redirect_stdout(io.StringIO()):
+            return lambda_function.route(event, None)
+
+    def deliver(self):
+        while self.apigw.sent:
+            connection_id, data = self.apigw.sent.pop(0)
+            client = self.clients.get(connection_id)
+            if client is not None and client.connection_id == connection_id:
+                client.last_activity = self.now
+                client.on_message(json.loads(data))
+
+
+class Page:
+    """The play page, see website/s3/play/index.html"""
+
+    def __init__(self, sim, game_id, player_id, password, hinted, think_seconds, moves, rng):
+        self.sim = sim
+        self.game_id = game_id
+        self.player_id = player_id
+        self.password = password
+        self.hinted = hinted
+        self.think_seconds = think_seconds
+        self.moves = moves
+        self.rng = rng
+        self.connection_id = None
+        self.last_activity = 0
+        self.data = {}
+        self.hints = {"keep_open": False, "retry_after": 1}
+        self.next_connect_at = 0
+        self.move_at = None
+
+    def my_turn(self):
+        return self.data.get("whose_turn") == self.player_id
+
+    def apply(self, output):
+        if "whose_turn" in output:
+            noticed = not self.my_turn() and output["whose_turn"] == self.player_id
+            self.data = output
+            if noticed or (self.my_turn() and self.move_at is None):
+                self.sim.notice_delays.append(self.sim.now - self.sim.last_move_at)
+                self.move_at = self.sim.now + max(2, self.rng.expovariate(1 / self.think_seconds))
+        if self.hinted and output.get("hints"):
+            self.hints = output["hints"]
+
+    def reconnect_delay(self):
+        return min(900, self.hints["retry_after"] or 1) * self.rng.uniform(0.8, 1.2)
+
+    def get(self):
+        body = {"game_id": self.game_id, "password": self.password, "format": "compact"}
+        if "version" in self.data:
+            body["version"] = self.data["version"]
+        response = self.sim.call("/get", common.http_event("/get", body))
+        output = json.loads(response["body"])
+        if output.get("not_modified"):
+            if self.hinted:
+                self.hints = output["hints"]
+        else:
+            self.apply(output)
+
+    def connect(self):
+        self.sim.connection_count += 1
+        self.connection_id = f"{self.game_id}-{self.player_id}-{self.sim.connection_count}"
+        self.sim.clients[self.connection_id] = self
+        self.sim.apigw.connections.add(self.connection_id)
+        self.last_activity = self.sim.now
+        self.sim.call("$connect", socket_event("$connect", self.connection_id))
+        message = {"game_id": self.game_id, "password": self.password, "format": "compact"}
+        self.sim.call(
+            "register", socket_event("register", self.connection_id, {"action": "register", "message": message})
+        )
+
+    def close(self):
+        self.sim.apigw.connections.discard(self.connection_id)
+        self.sim.call("$disconnect", socket_event("$disconnect", self.connection_id))
+        self.connection_id = None
+        if self.hinted:
+            self.next_connect_at = self.sim.now + self.reconnect_delay()
+
+    def on_message(self, message):
+        if self.hinted and message.get("hints"):
+            self.hints = message["hints"]
+        if message["event"] != "move":
+            return
+        if "game" in message:
+            self.apply(message["game"])
+        else:
+            self.get()
+        if not (self.hinted and self.hints["keep_open"]):
+            self.close()
+
+    def tick(self):
+        if self.connection_id and self.sim.now - self.last_activity >= pacing.SOCKET_IDLE_SECONDS:
+            self.close()
+        if self.my_turn() and self.move_at is not None and self.sim.now >= self.move_at and self.moves:
+            body = {"game_id": self.game_id, "password": self.password, "move": self.moves.pop(0)}
+            body["format"] = "compact"
+            response = self.sim.call("/move", common.http_event("/move", body))
+            self.sim.last_move_at = self.sim.now
+            self.move_at = None
+            self.apply(json.loads(response["body"]))
+            if self.hinted and not self.connection_id:
+                self.next_connect_at = self.sim.now + self.reconnect_delay()
+        if self.connection_id or self.my_turn() or not self.data:
+            return
+        if self.hinted and (self.hints["retry_after"] is None or self.sim.now < self.next_connect_at):
+            return
+        self.connect()
+
+
+def play(dynamo, apigw, moves, think_seconds, hinted, seed, open_after=0):
+    """Plays the moves, then leaves both pages open open_after seconds, returns
+    the Simulation"""
+    sim = Simulation(apigw)
+    pacing.clock = lambda: sim.now
+    game_id = common.new_game(dynamo)
+    rng = random.Random(seed)
+    shared = list(moves)
+    pages = [
+        Page(sim, game_id, player_id, password, hinted, think_seconds, shared, rng)
+        for player_id, password in ((1, common.PASSWORD_ONE), (2, common.PASSWORD_TWO))
+    ]
+    for page in pages:
+        page.get()
+    end = None
+    while end is None or sim.now < end:
+        sim.now += 1
+        for page in pages:
+            page.tick()
+            sim.deliver()
+        if end is None and not shared:
+            end = sim.now + open_after
+    for page in pages:
+        if page.connection_id:
+            page.close()
+    return sim
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", type=int, default=3)
+    parser.add_argument("--plies", type=int, default=40)
+    args = parser.parse_args()
+
+    dynamo, apigw = common.install_fakes(dynamo=FakeDynamo(), apigw=FakeApiGateway())
+    print(f"{args.plies} plies a game, invocations per game and how long until a player sees the move")
+    print(
+        f"{'pace':<8} {'think':>6} {'page':<7} {'invocations':>11} {'sockets':>8} {'per move':>9} {'noticed p50':>12} {'p90':>6}"
+    )
+    for name, think_seconds in PACES:
+        for hinted in (False, True):
+            invocations = []
+            sockets = []
+            delays = []
+            for seed in range(args.games):
+                moves = common.random_game_moves(args.plies, seed=seed)
+                sim = play(dynamo, apigw, moves, think_seconds, hinted, seed)
+                invocations.append(sum(sim.invocations.values()))
+                sockets.append(sim.invocations["$connect"])
+                delays += sim.notice_delays
+            print(
+                f"{name:<8} {think_seconds:>5}s {'hinted' if hinted else 'before':<7} "
+                f"{statistics.mean(invocations):>11.0f} {statistics.mean(sockets):>8.0f} "
+                f"{statistics.mean(invocations) / args.plies:>9.1f} {statistics.median(delays):>11.0f}s "
+                f"{statistics.quantiles(delays, n=10)[-1]:>5.0f}s"
+            )
+
+    print(f"\npage left open {OPEN_AFTER_GAME_SECONDS // 60} minutes after a checkmate")
+    for hinted in (False, True):
+        sim = play(dynamo, apigw, FOOLS_MATE.split(), 10, hinted, 0, OPEN_AFTER_GAME_SECONDS)
+        counts = ", ".join(f"{route} {count}" for route, count in sorted(sim.invocations.items()))
+        print(f"{'hinted' if hinted else 'before':<7} {sum(sim.invocations.values()):>4} invocations ({counts})")
+
+
+if __name__ == "__main__":
+    main()
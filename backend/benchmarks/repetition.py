@@ -0,0 +1,130 @@
+import argparse
+import contextlib
+import io
+import json
+import random
+
+import chess
+
+from . import common
+from chesswithhumans import chess_routes
+from chesswithhumans.game_state import draw_status, load_board, position_hash, repetition_counts
+from chesswithhumans.local_aws import FakeDynamo, item_size
+
+# Long shuffling games played through /move: knights going back and forth until
+# the fivefold repetition ends the game, and quiet maneuvering (no capture, no
+# pawn move) until the 75-move rule does. At every ply the draws /move reports
+# from the counts on the item are checked against python-chess on a board with
+# the whole game on its stack. Then the time to tell the draws of a game from
+# its item, against replaying its moves to ask python-chess.
+#
+#   python -m benchmarks.repetition
+
+KNIGHT_SHUFFLE = "g1f3 g8f6 f3g1 f6g8"
+OPENING = "e2e4 e7e5 d2d3 d7d6 g2g3 g7g6 b2b3 b7b6"
+QUIET_PLIES = 120
+TIMED_PLIES = (100, 300, 600)
+FLAGS = ("is_threefold_repetition", "is_fivefold_repetition", "is_fifty_moves", "is_seventyfive_moves")
+
+
+def expected_flags(board):
+    return {
+        "is_threefold_repetition": board.is_repetition(3),
+        "is_fivefold_repetition": board.is_fivefold_repetition(),
+        "is_fifty_moves": board.is_fifty_moves(),
+        "is_seventyfive_moves": board.is_seventyfive_moves(),
+    }
+
+
+def shuffling_game(plies, quiet_plies, seed=0):
+    """Moves of a game opening the diagonals with pawns, then maneuvering quietly
+    with a pawn move every quiet_plies plies (never, with quiet_plies 0), going
+    back to the same position as little as it can and not ending before plies"""
+    rng = random.Random(seed)
+    board = chess.Board()
+    counts = {position_hash(board): 1}
+    moves = OPENING.split()
+    for move in moves:
+        board.push_uci(move)
+        counts[position_hash(board)] = counts.get(position_hash(board), 0) + 1
+    while len(moves) < plies:
+        pawn_move_due = bool(quiet_plies) and board.halfmove_clock >= quiet_plies
+        candidates = []
+        for move in board.legal_moves:
+            board.push(move)
+            if not (board.is_checkmate() or board.is_stalemate()):
+                # the kind of move that is due first, then the least seen position
+                wrong_kind = board.halfmove_clock == 0 if not pawn_move_due else board.halfmove_clock != 0
+                candidates.append((wrong_kind, counts.get(position_hash(board), 0), move))
+            board.pop()
+        best = min(candidates, key=lambda candidate: candidate[:2])[:2]
+        move = rng.choice([move for *rank, move in candidates if tuple(rank) == best])
+        board.push(move)
+        counts[position_hash(board)] = counts.get(position_hash(board), 0) + 1
+        moves.append(move.uci())
+    return moves
+
+
+def play_checked(dynamo, moves):
+    """Plays the moves through /move, checking the draws of every response, returns
+    the status code of the first move refused (None if all were played)"""
+    game_id = common.new_game(dynamo)
+    board = chess.Board()
+    for ply, move in enumerate(moves):
+        password = common.PASSWORD_ONE if ply % 2 == 0 else common.PASSWORD_TWO
+        event = common.http_event("/move", {"game_id": game_id, "password": password, "move": move})
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = chess_routes.make_move_route(event)
+        if response["statusCode"] != 200:
+            assert board.is_fivefold_repetition() or board.is_seventyfive_moves(), response
+            return ply, response["statusCode"], dynamo.items[("game", game_id)]
+        board.push_uci(move)
+        output = json.loads(response["body"])
+        reported = {flag: output.get(flag, False) for flag in FLAGS}
+        assert reported == expected_flags(board), (ply, reported, expected_flags(board))
+    return len(moves), None, dynamo.items[("game", game_id)]
+
+
+def from_item(item):
+    return draw_status(load_board(item), item["positions"])
+
+
+def from_replay(moves):
+    board = chess.Board()
+    for move in moves:
+        board.push_uci(move)
+    return expected_flags(board)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", type=int, default=5)
+    args = parser.parse_args()
+
+    dynamo, _ = common.install_fakes(dynamo=FakeDynamo())
+    games = [("knight shuffle", (KNIGHT_SHUFFLE.split() * 10))]
+    games += [(f"quiet {seed}", shuffling_game(180, 0, seed)) for seed in range(args.games)]
+    games += [(f"random {seed}", common.random_game_moves(300, seed=seed)) for seed in range(args.games)]
+    print(f"{'game':<18} {'plies':>6} {'ended by':<22} {'positions':>10} {'item':>7}")
+    for name, moves in games:
+        played, refused, item = play_checked(dynamo, moves)
+        ending = item.get("termination", {}).get("S") or ("refused " + str(refused) if refused else "still going")
+        positions = item.get("positions", {}).get("M", {})
+        print(f"{name:<18} {played:>6} {ending:<22} {len(positions):>10} {item_size(item):>7}")
+    print("draws reported by /move match python-chess at every ply")
+
+    print(f"\n{'plies':>6} {'from the item':>14} {'replayed':>10}")
+    for plies in TIMED_PLIES:
+        moves = shuffling_game(plies, QUIET_PLIES)
+        assert len(moves) == plies
+        board = chess.Board()
+        for move in moves:
+            board.push_uci(move)
+        item = {"fen": board.fen(), "positions": repetition_counts(moves)}
+        fast = common.time_call(lambda: from_item(item), repeat=200)["median_ms"]
+        slow = common.time_call(lambda: from_replay(moves), repeat=20)["median_ms"]
+        print(f"{plies:>6} {fast * 1000:>12.0f}us {slow:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+
+from . import common
+from chesswithhumans import chess_routes
+
+# Bytes on the wire for the game state at a few game lengths: the full /get
+# response, the compact format, and deltas from the version before the last
+# move (the usual case after a move) and from a few versions back.
+#
+# With node installed it also times what the play page does with a response:
+# JSON.parse (and reading the pieces out of the FEN), then the moves of a square
+# the way touchSquare asks for them, with the functions taken straight from
+# play/index.html.
+
+PLIES = (10, 40, 100)
+DELTA_BEHIND = (1, 4)
+PLAY_PAGE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "website",
+    "s3",
+    "play",
+    "index.html",
+)
+CLIENT_RUNS = 2000
+
+CLIENT = """
+const payloads = JSON.parse(require('fs').readFileSync(0, 'utf8'));
+let data = undefined;
+%s
+const squares = [];
+for (let file of 'abcdefgh') for (let rank of '12345678') squares.push(file + rank);
+const results = {};
+// the first pass warms up the JIT
+for (let pass = 0; pass < 2; pass++) for (let [name, body] of Object.entries(payloads)) {
+  let start = process.hrtime.bigint();
+  for (let run = 0; run < %d; run++) {
+    data = JSON.parse(body);
+    if (data.fen) {
+      data.pieces = piecesFromFen(data.fen);
+    }
+  }
+  const parse = Number(process.hrtime.bigint() - start) / %d / 1000;
+  start = process.hrtime.bigint();
+  for (let run = 0; run < %d; run++) {
+    for (let square of squares) {
+      legalMovesFrom(square);
+    }
+  }
+  results[name] = [parse, Number(process.hrtime.bigint() - start) / %d / 1000 / squares.length];
+}
+console.log(JSON.stringify(results));
+"""
+
+
+def get(game_id, **fields):
+    event = common.http_event("/get", {"game_id": game_id, "password": common.PASSWORD_ONE, **fields})
+    response = chess_routes.get_game_route(event)
+    assert response["statusCode"] == 200, response
+    return response["body"]
+
+
+def client_functions():
+    with open(PLAY_PAGE, encoding="utf-8") as play_page:
+        page = play_page.read()
+    return "\n".join(
+        re.search(r"^function %s\(.*?^}$" % name, page, re.MULTILINE | re.DOTALL).group(0)
+        for name in ("piecesFromFen", "isPawnOn", "legalMovesFrom")
+    )
+
+
+def client_parse_us(payloads):
+    script = CLIENT % ((client_functions(),) + (CLIENT_RUNS,) * 4)
+    output = subprocess.run(
+        ["node", "-e", script], input=json.dumps(payloads), capture_output=True, text=True, check=True
+    )
+    return json.loads(output.stdout)
+
+
+def main():
+    dynamo, _ = common.install_fakes()
+    columns = ["full", "compact"] + [f"delta -{behind}" for behind in DELTA_BEHIND]
+    print("bytes")
+    print(f"{'plies':>5} " + " ".join(f"{column:>10}" for column in columns))
+    payloads = {}
+    for plies in PLIES:
+        game_id = common.new_game(dynamo, common.random_game_moves(plies, seed=plies))
+        full = get(game_id)
+        compact = get(game_id, format="compact")
+        payloads[f"{plies} full"] = full
+        payloads[f"{plies} compact"] = compact
+        version = json.loads(full)["version"]
+        sizes = [len(full), len(compact)]
+        for behind in DELTA_BEHIND:
+            delta = get(game_id, delta_from=version - behind)
+            assert "changed" in json.loads(delta)
+            sizes.append(len(delta))
+        print(f"{plies:>5} " + " ".join(f"{size:>10}" for size in sizes))
+    if not shutil.which("node"):
+        print("node is not installed, skipping the client parse times")
+        return
+    timings = client_parse_us(payloads)
+    print("play page in node: JSON.parse (plus piecesFromFen), then legalMovesFrom per tapped square")
+    print(f"{'plies':>5} {'full parse':>12} {'compact parse':>14} {'full tap':>10} {'compact tap':>12}")
+    for plies in PLIES:
+        full, compact = timings[f"{plies} full"], timings[f"{plies} compact"]
+        print(f"{plies:>5} {full[0]:>10.1f}us {compact[0]:>12.1f}us {full[1]:>8.2f}us {compact[1]:>10.2f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import common
+from .load_test import percentile, socket_event
+from chesswithhumans import server
+from chesswithhumans.local_aws import FakeDynamo, FakeApiGateway
+import lambda_function
+
+# --games games played at once, --plies moves each, through the Lambda path and
+# through the self-hosted server (chesswithhumans/server.py): create, join, a
+# socket registered per player, then per ply the mover's /move and the move
+# pushed to the opponent's socket. Reports moves a second, the /move latency and
+# how long after the move was sent the opponent has it.
+#
+# The Lambda path calls lambda_handler from a thread per game, against the
+# DynamoDB stand-in and the API Gateway stand-in with --post-ms per post, plus
+# --gateway-ms per request for API Gateway in front of the function. It leaves
+# out cold starts and the containers not sharing a game cache. The server runs
+# in a process of its own, once with the same DynamoDB stand-in and once with
+# its memory store (--store memory), its clients talk HTTP and WebSocket to it
+# over loopback (on the same CPUs).
+#
+#   python -m benchmarks.server_throughput --games 200 --plies 20 --latency-ms 5
+
+LAMBDA_WORKERS = 256
+
+
+class PushRecorder(FakeApiGateway):
+    """Keeps when each connection was last posted to instead of what"""
+
+    def __init__(self, latency_seconds=0.0):
+        super().__init__(latency_seconds)
+        self.pushed_at = {}
+
+    def post_to_connection(self, ConnectionId, Data):
+        response = super().post_to_connection(ConnectionId, Data)
+        self.sent.clear()
+        self.pushed_at[ConnectionId] = time.perf_counter()
+        return response
+
+
+class Results:
+    def __init__(self):
+        self.moves = []
+        self.pushes = []
+        self.errors = 0
+        self.first_move = None
+        self.last_move = 0.0
+
+    def moved(self, start, took, pushed):
+        self.first_move = start if self.first_move is None else min(self.first_move, start)
+        self.last_move = max(self.last_move, start + max(took, pushed))
+        self.moves.append(took)
+        self.pushes.append(pushed)
+
+    def report(self, name):
+        # from the first move sent to the last one pushed, the games are set up before
+        elapsed = self.last_move - self.first_move
+        self.moves.sort()
+        self.pushes.sort()
+        print(
+            f"{name:<8} {len(self.moves):>6} {len(self.moves) / elapsed:>8.0f} "
+            + " ".join(
+                f"{percentile(samples, fraction) * 1000:>7.1f}ms"
+                for samples in (self.moves, self.pushes)
+                for fraction in (0.5, 0.99)
+            )
+            + f" {self.errors:>6}"
+        )
+
+
+def lambda_game(results, apigw, gateway_seconds, moves, seed):
+    def call(event):
+        time.sleep(gateway_seconds)
+        return lambda_function.lambda_handler(event, None)
+
+    created = json.loads(call(common.http_event("/create", {}))["body"])
+    game_id = created["game_id"]
+    joined = json.loads(call(common.http_event("/join", {"game_id": game_id}))["body"])
+    passwords = {1: created["player_one_password"], 2: joined["player_two_password"]}
+    for player, password in passwords.items():
+        connection_id = f"{game_id}-{player}"
+        apigw.connections.add(connection_id)
+        call(socket_event("$connect", connection_id))
+        message = {"game_id": game_id, "password": password, "format": "compact"}
+        call(socket_event("register", connection_id, {"action": "register", "message": message}))
+    for ply, move in enumerate(moves):
+        mover = 1 if ply % 2 == 0 else 2
+        opponent = f"{game_id}-{2 if mover == 1 else 1}"
+        start = time.perf_counter()
+        body = {"game_id": game_id, "password": passwords[mover], "move": move, "format": "compact"}
+        moved = call(common.http_event("/move", body))
+        took = time.perf_counter() - start
+        if moved["statusCode"] != 200 or apigw.pushed_at.get(opponent, 0) < start:
+            results.errors += 1
+            continue
+        # the post back out through API Gateway to the opponent
+        results.moved(start, took, apigw.pushed_at[opponent] + gateway_seconds - start)
+
+
+def run_lambda(args, games):
+    dynamo = FakeDynamo(latency_seconds=args.latency_ms / 1000)
+    apigw = PushRecorder(latency_seconds=args.post_ms / 1000)
+    common.install_fakes(dynamo=dynamo, apigw=apigw)
+    results = Results()
+    with contextlib.redirect_stdout(io.StringIO()), ThreadPoolExecutor(max_workers=LAMBDA_WORKERS) as pool:
+        for done in [
+            pool.submit(lambda_game, results, apigw, args.gateway_ms / 1000, moves, seed)
+            for seed, moves in enumerate(games)
+        ]:
+            done.result()
+    return results
+
+
+class Client:
+    """One keep-alive HTTP connection"""
+
+    def __init__(self, reader, writer, host):
+        self.reader = reader
+        self.writer = writer
+        self.host = host
+
+    async def post(self, path, body):
+        data = json.dumps(body).encode("utf-8")
+        self.writer.write(
+            f"POST {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n\r\n".encode("ascii") + data
+        )
+        status, headers = await read_head(self.reader)
+        body = await self.reader.readexactly(int(headers.get("content-length", 0)))
+        return status, json.loads(body) if body else None
+
+
+async def read_head(reader):
+    status_line, *lines = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+    headers = {}
+    for line in lines:
+        if line:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+    return int(status_line.split(" ")[1]), headers
+
+
+async def open_socket(host, port, game_id, password):
+    """A registered socket and a queue of the moves pushed to it"""
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(
+        f"GET / HTTP/1.1\r\nHost: {host}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+        f"Sec-WebSocket-Key: {os.urandom(16).hex()}\r\nSec-WebSocket-Version: 13\r\n\r\n".encode("ascii")
+    )
+    status, _ = await read_head(reader)
+    assert status == 101, status
+    message = {"action": "register", "message": {"game_id": game_id, "password": password, "format": "compact"}}
+    writer.write(server.encode_frame(server.OP_TEXT, json.dumps(message).encode("utf-8"), mask=os.urandom(4)))
+    pushed = asyncio.Queue()
+
+    async def receive():
+        with contextlib.suppress(asyncio.IncompleteReadError, ConnectionError):
+            while True:
+                _, opcode, payload = await server.read_frame(reader)
+                if opcode == server.OP_TEXT and json.loads(payload).get("event") == "move":
+                    pushed.put_nowait(time.perf_counter())
+
+    return writer, pushed, asyncio.create_task(receive())
+
+
+async def server_game(results, host, port, moves):
+    clients = []
+    for _ in range(2):
+        reader, writer = await asyncio.open_connection(host, port)
+        clients.append(Client(reader, writer, host))
+    _, created = await clients[0].post("/create", {})
+    game_id = created["game_id"]
+    _, joined = await clients[1].post("/join", {"game_id": game_id})
+    passwords = {1: created["player_one_password"], 2: joined["player_two_password"]}
+    sockets = {player: await open_socket(host, port, game_id, password) for player, password in passwords.items()}
+    # registered once the /get a registration sends back is answered
+    await asyncio.sleep(0.5)
+    for ply, move in enumerate(moves):
+        mover = 1 if ply % 2 == 0 else 2
+        pushed = sockets[2 if mover == 1 else 1][1]
+        start = time.perf_counter()
+        body = {"game_id": game_id, "password": passwords[mover], "move": move, "format": "compact"}
+        status, _ = await clients[mover - 1].post("/move", body)
+        took = time.perf_counter() - start
+        try:
+            pushed_at = await asyncio.wait_for(pushed.get(), 10)
+        except asyncio.TimeoutError:
+            pushed_at = None
+        if status != 200 or pushed_at is None:
+            results.errors += 1
+            continue
+        results.moved(start, took, pushed_at - start)
+    for writer, _, receiving in sockets.values():
+        writer.write(server.encode_frame(server.OP_CLOSE, b"\x03\xe8", mask=os.urandom(4)))
+        receiving.cancel()
+        writer.close()
+    for client in clients:
+        client.writer.close()
+
+
+async def play_server(games, host, port):
+    results = Results()
+    await asyncio.gather(*(server_game(results, host, port, moves) for moves in games))
+    return results
+
+
+def run_server(args, games, store):
+    command = [sys.executable, "-m", "benchmarks.server_throughput", "--serve", "--latency-ms", str(args.latency_ms)]
+    process = subprocess.Popen(
+        command + ["--", "--store", store, "--quiet", "--port", "0", "--workers", str(args.workers)],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        # Listening on http://127.0.0.1:<port>
+        address = process.stdout.readline().strip().rsplit("/", 1)[-1]
+        host, port = address.split(":")
+        return asyncio.run(play_server(games, host, int(port)))
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def serve(latency_ms, argv):
+    args = server.parse_args(argv)
+    dynamo = FakeDynamo(latency_seconds=latency_ms / 1000) if args.store == "dynamodb" else None
+    asyncio.run(server.serve(args, dynamo=dynamo))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", type=int, default=200)
+    parser.add_argument("--plies", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="per DynamoDB call, not the memory store")
+    parser.add_argument("--post-ms", type=float, default=20.0, help="per post to a connection, Lambda path")
+    parser.add_argument("--gateway-ms", type=float, default=10.0, help="API Gateway per request, Lambda path")
+    parser.add_argument("--workers", type=int, default=32, help="threads of the server")
+    parser.add_argument("--serve", action="store_true", help="run the server, for the benchmark itself")
+    args, server_argv = parser.parse_known_args()
+    if args.serve:
+        serve(args.latency_ms, [arg for arg in server_argv if arg != "--"])
+        return
+
+    games = [common.random_game_moves(args.plies, seed=seed) for seed in range(args.games)]
+    print(
+        f"{args.games} games at once, {args.plies} plies each, {args.latency_ms}ms per DynamoDB call, "
+        f"Lambda path with {args.gateway_ms}ms of API Gateway per request and {args.post_ms}ms per post"
+    )
+    print(
+        f"{'path':<8} {'moves':>6} {'moves/s':>8} {'/move p50':>9} {'p99':>9} {'push p50':>9} {'p99':>9} {'errors':>6}"
+    )
+    run_lambda(args, games).report("lambda")
+    run_server(args, games, "dynamodb").report("server")
+    run_server(args, games, "memory").report("memory")
+    print(f"{os.cpu_count()} CPUs shared by the server and its clients")
+
+
+if __name__ == "__main__":
+    main()
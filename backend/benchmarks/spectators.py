@@ -0,0 +1,93 @@
+import argparse
+import contextlib
+import io
+import statistics
+import time
+
+from . import common
+from chesswithhumans import chess_routes, connections
+from chesswithhumans.connections import SPECTATOR, register_connection
+from chesswithhumans.local_aws import FakeApiGateway, FakeLambda
+
+# Moves in a game with 0 to 1,000 spectators: the mover's /move latency, and how
+# long the broadcast takes to reach every spectator posting MAX_FANOUT_WORKERS at
+# a time, against posting one after the other (up to 100 spectators, it only gets
+# slower). One in twenty spectators has gone away and is removed on the way.
+# The broadcast invocation only starts once the move has answered, in Lambda it
+# runs in another sandbox and does not share a GIL with the mover.
+#
+#   python -m benchmarks.spectators --post-ms 10
+
+SPECTATORS = (0, 10, 100, 1000)
+SEQUENTIAL_UP_TO = 100
+MOVES = 6
+GONE_EVERY = 20
+
+
+def watch(apigw, game_id, count):
+    for index in range(count):
+        connection_id = f"{game_id}-spectator-{index}"
+        if index % GONE_EVERY:
+            apigw.connections.add(connection_id)
+        register_connection(connection_id, game_id, SPECTATOR, "compact" if index % 2 else "full")
+
+
+def play(game_id, moves, functions):
+    mover_ms = []
+    broadcast_ms = []
+    for ply, move in enumerate(moves):
+        password = common.PASSWORD_ONE if ply % 2 == 0 else common.PASSWORD_TWO
+        event = common.http_event("/move", {"game_id": game_id, "password": password, "move": move})
+        start = time.perf_counter()
+        response = chess_routes.make_move_route(event)
+        moved = time.perf_counter()
+        assert response["statusCode"] == 200, response
+        functions.wait()
+        mover_ms.append((moved - start) * 1000)
+        broadcast_ms.append((time.perf_counter() - moved) * 1000)
+    return mover_ms, broadcast_ms
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--post-ms", type=float, default=10.0)
+    args = parser.parse_args()
+
+    apigw = FakeApiGateway(latency_seconds=args.post_ms / 1000)
+    functions = FakeLambda(lambda event, context: connections.broadcast_route(event), deferred=True)
+    dynamo, _ = common.install_fakes(apigw=apigw, lambda_client=functions)
+    print(f"{args.post_ms}ms per post_to_connection, {connections.MAX_FANOUT_WORKERS} at a time")
+    print(
+        f"{'spectators':>10} {'move median':>12} {'broadcast':>10} {'one by one':>11} {'delivered':>10} {'pruned':>7}"
+    )
+    for count in SPECTATORS:
+        game_id = common.new_game(dynamo)
+        watch(apigw, game_id, count)
+        sent_before = len(apigw.sent)
+        with contextlib.redirect_stdout(io.StringIO()):
+            mover_ms, broadcast_ms = play(game_id, common.random_game_moves(MOVES, seed=count), functions)
+        delivered = len(apigw.sent) - sent_before
+        remaining = len(connections.game_connections(game_id, SPECTATOR))
+        expected = MOVES * (count - count // GONE_EVERY - (1 if count % GONE_EVERY else 0))
+        assert delivered == expected and remaining == count - (count + GONE_EVERY - 1) // GONE_EVERY, (
+            delivered,
+            remaining,
+        )
+        sequential = "-"
+        if 0 < count <= SEQUENTIAL_UP_TO:
+            workers = connections.MAX_FANOUT_WORKERS
+            connections.MAX_FANOUT_WORKERS = 1
+            messages = {"full": "{}", "compact": "{}"}
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                connections.broadcast(game_id, messages)
+            sequential = f"{(time.perf_counter() - start) * 1000:.0f}ms"
+            connections.MAX_FANOUT_WORKERS = workers
+        print(
+            f"{count:>10} {statistics.median(mover_ms):>10.1f}ms {statistics.median(broadcast_ms):>8.0f}ms "
+            f"{sequential:>11} {delivered:>10} {count - remaining:>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import json
+
+from . import common
+from chesswithhumans import chess_routes
+from chesswithhumans.game_cache import game_cache
+from chesswithhumans.local_aws import item_size
+
+# /is-it-my-turn against long games: the whole item read the way it used to be
+# (a cold fetch_game, cache emptied first) against the projected read, with
+# the read units DynamoDB would bill and the bytes it would send back.
+
+PLIES = (10, 100, 300)
+
+
+def full_read(game_id):
+    game_cache.invalidate(game_id)
+    return chess_routes.fetch_game(game_id)
+
+
+def main():
+    dynamo, _ = common.install_fakes()
+    print(f"{'plies':>5} {'read':<10} {'median':>9} {'p95':>9} {'read units':>11} {'bytes sent':>11}")
+    for plies in PLIES:
+        game_id = common.new_game(dynamo, common.random_game_moves(plies, seed=plies))
+        event = common.http_event("/is-it-my-turn", {"game_id": game_id, "password": common.PASSWORD_ONE})
+        key = {"key1": {"S": "game"}, "key2": {"S": game_id}}
+        for name, fn, projection in (
+            ("full", lambda: full_read(game_id), None),
+            ("projected", lambda: chess_routes.check_turn_route(event), chess_routes.TURN_PROJECTION),
+        ):
+            before = dynamo.capacity()["read_units"]
+            fn()
+            read_units = dynamo.capacity()["read_units"] - before
+            if projection:
+                sent = dynamo.get_item(TableName="", Key=key, ProjectionExpression=projection)["Item"]
+            else:
+                sent = dynamo.get_item(TableName="", Key=key)["Item"]
+            timing = common.time_call(fn)
+            print(
+                f"{plies:>5} {name:<10} {timing['median_ms']:>7.3f}ms {timing['p95_ms']:>7.3f}ms "
+                f"{read_units:>11.1f} {len(json.dumps(sent)):>11}"
+            )
+    print(f"item size at {PLIES[-1]} plies: {item_size(dynamo.items[('game', game_id)])} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import re
+import timeit
+
+from chesswithhumans import words_ids
+from chesswithhumans.input_validation import compile_schema, validate_schema
+from chesswithhumans.chess_routes import GET_GAME_SCHEMA, MAKE_MOVE_SCHEMA
+from chesswithhumans.web_socket_routes import REGISTER_SCHEMA
+
+# Request validation: the schema interpreter with the field validators as they
+# were (re.match on pattern strings), the interpreter with the precompiled field
+# validators, and the schemas compiled into closures.
+
+NUMBER = 20000
+
+
+def old_validator(pattern):
+    def validate(value):
+        if isinstance(value, str) and re.match(pattern, value):
+            return value
+        return None
+
+    return validate
+
+
+OLD_FIELDS = {
+    "validate_word_id": old_validator("[a-z]+\\-[a-z]+\\-[a-z]+"),
+    "validate_letter_id": old_validator("[a-zA-Z0-9]{32}"),
+    "validate_move": old_validator("[ -~]+"),
+}
+
+
+def old_fields_only(schema):
+    # the fields added since (version, format, ...) had no old validator, the
+    # three are compared on the ones that did
+    return {**schema, "fields": [field for field in schema["fields"] if field["type"].__name__ in OLD_FIELDS]}
+
+
+def with_old_fields(schema):
+    return {
+        "type": dict,
+        "fields": [{**field, "type": OLD_FIELDS[field["type"].__name__]} for field in schema["fields"]],
+    }
+
+
+def main():
+    body = {"game_id": words_ids.generate_id(), "password": "a" * 64, "move": "e2e4"}
+    print(f"{'schema':<10} {'interpreted, re.match':>22} {'interpreted':>12} {'compiled':>10}")
+    for name, schema in (("get", GET_GAME_SCHEMA), ("move", MAKE_MOVE_SCHEMA), ("register", REGISTER_SCHEMA)):
+        schema = old_fields_only(schema)
+        old_schema = with_old_fields(schema)
+        compiled = compile_schema(schema)
+        assert compiled(body) == validate_schema(body, schema) == validate_schema(body, old_schema)
+        timings = [
+            timeit.timeit(lambda: validate_schema(body, old_schema), number=NUMBER),
+            timeit.timeit(lambda: validate_schema(body, schema), number=NUMBER),
+            timeit.timeit(lambda: compiled(body), number=NUMBER),
+        ]
+        old, interpreted, fast = (timing / NUMBER * 1e6 for timing in timings)
+        print(f"{name:<10} {old:>20.2f}us {interpreted:>10.2f}us {fast:>8.2f}us")
+    trailing = {**body, "game_id": body["game_id"] + "-and-more!"}
+    before = validate_schema(trailing, with_old_fields(old_fields_only(GET_GAME_SCHEMA))) is not None
+    now = compile_schema(GET_GAME_SCHEMA)(trailing) is not None
+    print(f"trailing garbage in game_id accepted: before {before}, now {now}")
+
+
+if __name__ == "__main__":
+    main()
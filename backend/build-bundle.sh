@@ -0,0 +1,21 @@
+#!/bin/bash
+# Builds build/lambda/ from the same files release.sh zips: the lambda code
+# plus python-chess, compiled ahead of time to sourceless .pyc files so a cold
+# start does not compile anything, with everything the Lambda never imports
+# (caches, the local AWS stand-ins, the self-hosted server) left out.
+set -e
+PYTHON=${PYTHON:-.venv/bin/python}
+if [ ! -s lambda/chesswithhumans/bad_words_en.txt ]; then
+    echo "lambda/chesswithhumans/bad_words_en.txt is missing, run sh update-bad-words.sh and commit it" >&2
+    exit 1
+fi
+rm -rf build/lambda
+mkdir -p build/lambda
+cp -r lambda/. build/lambda/
+cp -r ${SITE_PACKAGES:-.venv/lib/python3.14/site-packages}/chess build/lambda/
+find build/lambda -name "__pycache__" -type d -prune -exec rm -r {} +
+find build/lambda \( -name "*.DS_Store" -o -name "*.test.py" -o -name "py.typed" \) -delete
+rm -f build/lambda/chesswithhumans/local_aws.py build/lambda/chesswithhumans/server.py
+# the Lambda has to run the same python version that compiled these
+$PYTHON -m compileall -q -b -o 2 build/lambda
+find build/lambda -name "*.py" -delete
@@ -0,0 +1,155 @@
+import gzip
+import json
+import os
+import time
+from decimal import Decimal
+from .utils import (
+    dynamo,
+    s3,
+    TABLE_NAME,
+    python_obj_to_dynamo_obj,
+    dynamo_obj_to_python_obj,
+)
+from .game_state import build_pgn_string, load_board, load_moves, termination_of
+from .move_history import delete_plies
+
+# Games that are over leave the table for an archive in S3 (ARCHIVE_BUCKET, no
+# archiving without it), one gzipped JSON object per game at games/<game_id>.json.gz
+# with a summary, the PGN and the game item as it was.
+#
+# A game that ends with a move is archived by that move, and its item shrinks to
+# a tombstone: everything but the moves, plus archived, result and termination,
+# which is all /get, /is-it-my-turn and the dashboard read. A game abandoned
+# until its expiration is archived from the DynamoDB stream when TTL removes the
+# item. Anything that needs the moves, or a game whose item is gone, is read
+# back from the archive. The game's ply items (move_history.py) go with it.
+
+ARCHIVE_BUCKET = os.environ.get("ARCHIVE_BUCKET")
+TOMBSTONE_DROPPED = ("moves", "pgn_string")
+
+
+def archive_key(game_id):
+    return f"games/{game_id}.json.gz"
+
+
+def _plain(value):
+    # numbers come out of DynamoDB as Decimal
+    if isinstance(value, Decimal):
+        return int(value) if value == int(value) else float(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def ending_of(board, positions=None):
+    """(termination, result) of the game, abandoned if it is not over"""
+    return termination_of(board, positions) or ("abandoned", "*")
+
+
+def write_archive(game_id, game_data, board):
+    termination, result = ending_of(board, game_data.get("positions"))
+    moves = load_moves(game_data)
+    white = game_data.get("player_one_username", "?")
+    black = game_data.get("player_two_username", "?")
+    game = {key: value for key, value in game_data.items() if key not in ("key1", "key2", "pgn_string")}
+    game.update(moves=moves, archived=True, result=result, termination=termination)
+    record = {
+        "game_id": game_id,
+        "summary": {
+            "white": white,
+            "black": black,
+            "result": result,
+            "termination": termination,
+            "plies": len(moves),
+            "fen": board.fen(),
+            "archived_at": int(time.time()),
+        },
+        "pgn": build_pgn_string(
+            moves, {"Event": "Chess with humans", "White": white, "Black": black, "Result": result}
+        ),
+        "game": game,
+    }
+    s3.put_object(
+        Bucket=ARCHIVE_BUCKET,
+        Key=archive_key(game_id),
+        Body=gzip.compress(json.dumps(record, default=_plain).encode("utf-8")),
+        ContentType="application/json",
+        ContentEncoding="gzip",
+    )
+    return record
+
+
+def read_archive(game_id):
+    """The archived record of the game, None if there is none"""
+    if not ARCHIVE_BUCKET:
+        return None
+    try:
+        response = s3.get_object(Bucket=ARCHIVE_BUCKET, Key=archive_key(game_id))
+    except s3.exceptions.NoSuchKey:
+        return None
+    return json.loads(gzip.decompress(response["Body"].read()))
+
+
+def archive_finished_game(game_id, game_data, board):
+    """Archives a game the last move just ended and shrinks its item to the
+    tombstone, returns the tombstone (None if the game changed in between, the
+    archived copy is then left for the next attempt to overwrite). The tombstone
+    is a version of its own, so a container that cached the game before it does
+    not keep serving it as live."""
+    record = write_archive(game_id, game_data, board)
+    game = record["game"]
+    try:
+        dynamo.update_item(
+            TableName=TABLE_NAME,
+            Key=python_obj_to_dynamo_obj({"key1": "game", "key2": game_id}),
+            UpdateExpression="SET archived = :archived, #result = :result, termination = :termination,"
+            " #version = :next_version REMOVE " + ", ".join(TOMBSTONE_DROPPED),
+            ConditionExpression="#version = :version",
+            ExpressionAttributeNames={"#version": "version", "#result": "result"},
+            ExpressionAttributeValues=python_obj_to_dynamo_obj(
+                {
+                    ":archived": True,
+                    ":result": game["result"],
+                    ":termination": game["termination"],
+                    ":version": game_data["version"],
+                    ":next_version": game_data["version"] + 1,
+                }
+            ),
+        )
+    except dynamo.exceptions.ConditionalCheckFailedException:
+        return None
+    delete_plies(game_id)
+    tombstone = {key: value for key, value in game_data.items() if key not in TOMBSTONE_DROPPED}
+    tombstone.update(
+        archived=True, result=game["result"], termination=game["termination"], version=game_data["version"] + 1
+    )
+    return tombstone
+
+
+def archive_stream_route(event):
+    """Archives the games TTL removed before they ended, from the table's stream
+    (needs OLD_IMAGE), and deletes the plies of every game removed. Tombstones
+    expiring are already archived."""
+    archived = 0
+    for record in event["Records"]:
+        if record.get("eventName") != "REMOVE":
+            continue
+        image = record.get("dynamodb", {}).get("OldImage")
+        if not image:
+            continue
+        game_data = dynamo_obj_to_python_obj(image)
+        if game_data.get("key1") != "game":
+            continue
+        delete_plies(game_data["key2"])
+        if game_data.get("archived") or not ARCHIVE_BUCKET:
+            continue
+        try:
+            board = load_board(game_data)
+            if not load_moves(game_data):
+                # nobody played, nothing worth keeping
+                continue
+        except:
+            print(f"Could not archive {game_data.get('key2')}, the game is not valid")
+            continue
+        write_archive(game_data["key2"], game_data, board)
+        archived += 1
+    print(f"Archived {archived} expired games")
+    return {"statusCode": 200, "body": f"Archived {archived} games"}
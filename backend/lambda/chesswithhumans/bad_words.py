@@ -1,45 +1,58 @@
-import urllib3
+import os
 import re
 
-http = urllib3.PoolManager()
+# The word list ships inside the package (update-bad-words.sh refreshes it,
+# build-bundle.sh makes sure it is there), nothing is downloaded at runtime.
+# All the words are compiled into one regex shaped like a trie, so checking a
+# username is a single pass over it instead of one re.match per word.
+BAD_WORDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bad_words_en.txt")
 
-bad_word_list = None
+bad_word_pattern = None
 SPECIAL_CHARS = re.compile(r"[^a-zA-Z0-9]")
-
-
-def fetch_bad_word_list():
-    output = []
-    uri = f"https://raw.githubusercontent.com/coffee-and-fun/google-profanity-words/refs/heads/main/data/en.txt"
-    response = http.request(
-        "GET",
-        uri,
-        headers={},
-    )
-    for line in response.data.splitlines():
-        bad_word = line.decode("utf-8").strip()
-        if "e" in bad_word:
-            bad_word = bad_word.replace("e", "[e3]")
-        if "g" in bad_word:
-            bad_word = bad_word.replace("g", "[g9]")
-        if "i" in bad_word:
-            bad_word = bad_word.replace("i", "[i1]")
-        if "o" in bad_word:
-            bad_word = bad_word.replace("o", "[o0]")
-        if "s" in bad_word:
-            bad_word = bad_word.replace("s", "[s5]")
-        if "t" in bad_word:
-            bad_word = bad_word.replace("t", "[t7]")
-        output.append(re.compile(bad_word))
-
-    return output
+# these letters of a word also match the digit that looks like them
+LEETSPEAK = {"e": "[e3]", "g": "[g9]", "i": "[i1]", "o": "[o0]", "s": "[s5]", "t": "[t7]"}
+
+
+def read_bad_word_list(path=BAD_WORDS_PATH):
+    # no list would let every username through, better to fail the request
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} is missing, run update-bad-words.sh")
+    with open(path, encoding="utf-8") as bad_words_file:
+        return [line.strip() for line in bad_words_file if line.strip()]
+
+
+def trie_regex(trie):
+    if "" in trie:
+        # a whole word ends here, anything after it does not matter
+        return ""
+    branches = [LEETSPEAK.get(char, re.escape(char)) + trie_regex(child) for char, child in sorted(trie.items())]
+    if len(branches) == 1:
+        return branches[0]
+    return "(?:" + "|".join(branches) + ")"
+
+
+def compile_bad_words(bad_words):
+    trie = {}
+    for bad_word in bad_words:
+        # the username has everything but letters and digits removed before
+        # matching, so a word with anything else in it could never match
+        if SPECIAL_CHARS.search(bad_word):
+            continue
+        node = trie
+        for char in bad_word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+    if not trie:
+        return re.compile(r"(?!)")
+    return re.compile(trie_regex(trie))
 
 
 def has_bad_word(input_text):
-    global bad_word_list
-    if not bad_word_list:
-        bad_word_list = fetch_bad_word_list()
+    global bad_word_pattern
+    if bad_word_pattern is None:
+        bad_word_pattern = compile_bad_words(read_bad_word_list())
     input_text = re.sub(SPECIAL_CHARS, "", input_text)
-    return any(re.match(bad_word, input_text) for bad_word in bad_word_list)
+    return bad_word_pattern.match(input_text) is not None
 
 
 if __name__ == "__main__":
@@ -3,25 +3,56 @@ from .utils import (
     format_response,
     parse_body,
     TABLE_NAME,
+    DOMAIN_NAME,
     python_obj_to_dynamo_obj,
     dynamo_obj_to_python_obj,
-    apigw,
     json,
 )
+from .connections import (
+    game_connections,
+    has_spectators,
+    post_to_connection,
+    queue_broadcast,
+    SPECTATOR,
+)
 from .input_validation import (
     validate_word_id,
     validate_letter_id,
     validate_username,
-    validate_schema,
+    compile_schema,
     validate_move,
+    validate_game_count,
+    validate_version,
+    validate_wire_format,
+    validate_history_count,
+    MAX_GAMES_PER_BATCH,
+    WIRE_FORMATS,
+)
+from .game_state import (
+    load_board,
+    load_moves,
+    describe_board,
+    describe_board_compact,
+    changed_squares,
+    apply_move,
+    ply_record,
+    pgn_movetext,
+    whose_turn_of,
+    count_position,
+    repetition_counts,
+    draw_status,
+    is_drawn,
+    termination_of,
 )
+from .move_history import ply_page, write_ply
+from .archive import ARCHIVE_BUCKET, archive_finished_game, read_archive
+from .game_cache import game_cache
+from .pacing import pacing_hints, time_move
 import time
 from . import bad_words
 from . import words_ids
 from . import letter_ids
-import io
 import chess
-import chess.pgn
 
 CREATE_GAME_SCHEMA = {
     "type": dict,
@@ -42,6 +73,11 @@ GET_GAME_SCHEMA = {
     "fields": [
         {"type": validate_word_id, "name": "game_id"},
         {"type": validate_letter_id, "name": "password"},
+        # the version of the game the client already has
+        {"type": validate_version, "name": "version", "optional": True},
+        # ask for only what changed since this version
+        {"type": validate_version, "name": "delta_from", "optional": True},
+        {"type": validate_wire_format, "name": "format", "optional": True},
     ],
 }
 MAKE_MOVE_SCHEMA = {
@@ -50,6 +86,8 @@ MAKE_MOVE_SCHEMA = {
         {"type": validate_word_id, "name": "game_id"},
         {"type": validate_letter_id, "name": "password"},
         {"type": validate_move, "name": "move"},
+        {"type": validate_version, "name": "delta_from", "optional": True},
+        {"type": validate_wire_format, "name": "format", "optional": True},
     ],
 }
 CHECK_TURN_SCHEMA = {
@@ -66,31 +104,208 @@ FETCH_GAME_SCHEMA = {
         {"type": validate_letter_id, "name": "password"},
     ],
 }
+FETCH_GAMES_SCHEMA = {
+    "type": dict,
+    "fields": [
+        {"type": list, "name": "games", "elements": FETCH_GAME_SCHEMA},
+    ],
+}
+HISTORY_SCHEMA = {
+    "type": dict,
+    "fields": [
+        {"type": validate_word_id, "name": "game_id"},
+        {"type": validate_letter_id, "name": "password"},
+        # 1 is the first move
+        {"type": validate_version, "name": "from_ply", "optional": True},
+        {"type": validate_history_count, "name": "count", "optional": True},
+    ],
+}
+EXPORT_PGN_SCHEMA = {
+    "type": dict,
+    "fields": [
+        {"type": validate_word_id, "name": "game_id"},
+        {"type": validate_letter_id, "name": "password"},
+        {"type": validate_version, "name": "from_ply", "optional": True},
+    ],
+}
+CREATE_GAMES_SCHEMA = {
+    "type": dict,
+    "fields": [
+        {"type": validate_game_count, "name": "count"},
+    ],
+}
+
+# compiled once here instead of interpreting the schemas on every request
+CREATE_GAME_VALIDATOR = compile_schema(CREATE_GAME_SCHEMA)
+JOIN_GAME_VALIDATOR = compile_schema(JOIN_GAME_SCHEMA)
+GET_GAME_VALIDATOR = compile_schema(GET_GAME_SCHEMA)
+MAKE_MOVE_VALIDATOR = compile_schema(MAKE_MOVE_SCHEMA)
+CHECK_TURN_VALIDATOR = compile_schema(CHECK_TURN_SCHEMA)
+FETCH_GAME_VALIDATOR = compile_schema(FETCH_GAME_SCHEMA)
+FETCH_GAMES_VALIDATOR = compile_schema(FETCH_GAMES_SCHEMA)
+CREATE_GAMES_VALIDATOR = compile_schema(CREATE_GAMES_SCHEMA)
+HISTORY_VALIDATOR = compile_schema(HISTORY_SCHEMA)
+EXPORT_PGN_VALIDATOR = compile_schema(EXPORT_PGN_SCHEMA)
+
+
+# Everything /get shows but the moves, which grow with every move, so a /get
+# takes as long at move 300 as at move 10. Only a delta needs the moves.
+GAME_PROJECTION = (
+    "player_one_password, player_two_password, fen, pgn_string, positions, graveyard, en_passant, previous_move,"
+    " piece_taken, whose_turn, moved_at, move_gap, #version, archived, #result, termination"
+)
+
+
+def fetch_game(game_id, version=None, with_moves=True):
+    """(game_data, board) of the game, or None if it does not exist. board is None
+    if the stored game cannot be loaded. Served from the warm-container cache when
+    the cached copy is still at the version in the table (pass version if it was
+    just read). Without with_moves, game_data has no "moves" (unless it is cached
+    with them)."""
+    key = python_obj_to_dynamo_obj({"key1": "game", "key2": game_id})
+
+    def read_version():
+        if version is not None:
+            return version
+        response = dynamo.get_item(
+            TableName=TABLE_NAME,
+            Key=key,
+            ProjectionExpression="#version",
+            ExpressionAttributeNames={"#version": "version"},
+        )
+        if "Item" not in response:
+            return None
+        return dynamo_obj_to_python_obj(response["Item"]).get("version", 0)
+
+    cached = game_cache.get(game_id, read_version, with_moves)
+    if cached:
+        return cached
+    if with_moves:
+        response = dynamo.get_item(TableName=TABLE_NAME, Key=key)
+    else:
+        response = dynamo.get_item(
+            TableName=TABLE_NAME,
+            Key=key,
+            ProjectionExpression=GAME_PROJECTION,
+            ExpressionAttributeNames={"#version": "version", "#result": "result"},
+        )
+    if "Item" not in response:
+        game_cache.invalidate(game_id)
+        return None
+    game_data = dynamo_obj_to_python_obj(response["Item"])
+    try:
+        board = load_board(game_data)
+    except:
+        board = None
+    game_cache.put(game_id, game_data, board, with_moves)
+    return game_data, board
+
+
+# A client that has an earlier version can ask for the squares that changed
+# since then instead of every piece (legal moves and flags are still all sent),
+# when it is not too far behind. The version goes up by one per move once the
+# game is joined, so the moves since a version are the last (version - base).
+MAX_DELTA_PLIES = 8
+
 
+def delta_moves(game_data, base_version):
+    """The moves played since base_version, or None if the client needs the full state"""
+    version = int(game_data.get("version", 0))
+    moves = game_data.get("moves")
+    behind = version - base_version
+    if base_version < 1 or moves is None or not 0 <= behind <= min(MAX_DELTA_PLIES, len(moves)):
+        return None
+    return moves[len(moves) - behind :]
 
-#    game = parse_pgn_game(game_owner_data["pgn_string"])
-def parse_pgn_game(pgn_string) -> chess.pgn.GameNode:
-    return chess.pgn.read_game(io.StringIO(pgn_string)).end()
+
+def build_game_output(game_id, player_id, board, game_data, wire_format="full"):
+    output = {
+        "game_id": game_id,
+        "player_id": player_id,
+        "version": int(game_data.get("version", 0)),
+    }
+    if wire_format == "compact":
+        output["format"] = "compact"
+        output.update(describe_board_compact(board))
+    else:
+        output.update(describe_board(board))
+    output.update(draw_status(board, game_data.get("positions")))
+    if "en_passant" in game_data:
+        output["en_passant"] = game_data["en_passant"]
+    if "previous_move" in game_data:
+        output["previous_move"] = game_data["previous_move"]
+    if "graveyard" in game_data:
+        output["graveyard"] = game_data["graveyard"]
+    if "piece_taken" in game_data:
+        output["piece_taken"] = game_data["piece_taken"]
+    if game_data.get("archived"):
+        output["archived"] = True
+        output["result"] = game_data["result"]
+        output["termination"] = game_data["termination"]
+    return output
+
+
+def delta_output(output, board, game_data, delta_from):
+    """The output of build_game_output with the squares changed since delta_from
+    instead of all the pieces, or unchanged if that is too far back (or compact,
+    the FEN is already smaller than a delta)"""
+    recent_moves = delta_moves(game_data, int(delta_from))
+    if recent_moves is None or "pieces" not in output:
+        return output
+    delta = {key: value for key, value in output.items() if key != "pieces"}
+    delta["delta_from"] = int(delta_from)
+    delta["changed"] = changed_squares(board, recent_moves)
+    return delta
+
+
+# A client that already has the game (reconnecting, or a /get after the move
+# push) sends its version, a projected read is enough to tell it nothing changed.
+VERSION_PROJECTION = "player_one_password, player_two_password, #version, whose_turn, moved_at, move_gap, archived"
 
 
 def get_game_route(event):
-    body = validate_schema(parse_body(event["body"]), GET_GAME_SCHEMA)
+    body = GET_GAME_VALIDATOR(parse_body(event["body"]))
     game_id = body["game_id"]
-    response = dynamo.get_item(
-        TableName=TABLE_NAME,
-        Key=python_obj_to_dynamo_obj({"key1": "game", "key2": game_id}),
-    )
-    if "Item" not in response:
-        return format_response(
-            event=event,
-            http_code=404,
-            body="Game ID not found in the database",
+    version = None
+    # a client asking for a delta already has delta_from
+    known_version = body.get("version", body.get("delta_from"))
+    if known_version is not None:
+        response = dynamo.get_item(
+            TableName=TABLE_NAME,
+            Key=python_obj_to_dynamo_obj({"key1": "game", "key2": game_id}),
+            ProjectionExpression=VERSION_PROJECTION,
+            ExpressionAttributeNames={"#version": "version"},
         )
+        if "Item" not in response:
+            return archived_game_response(event, body)
+        version_data = dynamo_obj_to_python_obj(response["Item"])
+        if body["password"] not in (version_data["player_one_password"], version_data.get("player_two_password")):
+            return format_response(
+                event=event,
+                http_code=401,
+                body="Player is not allowed to play",
+            )
+        version = int(version_data.get("version", 0))
+        if version == int(known_version):
+            player_id = 1 if version_data["player_one_password"] == body["password"] else 2
+            return format_response(
+                event=event,
+                http_code=200,
+                body={
+                    "game_id": game_id,
+                    "version": version,
+                    "not_modified": True,
+                    "hints": pacing_hints(version_data, player_id),
+                },
+            )
+    game = fetch_game(game_id, version, with_moves="delta_from" in body)
+    if game is None:
+        return archived_game_response(event, body)
     # If it is, check passwords
-    game_data = dynamo_obj_to_python_obj(response["Item"])
+    game_data, board = game
     if game_data["player_one_password"] == body["password"]:
         player_id = 1
-    elif game_data["player_two_password"] == body["password"]:
+    elif game_data.get("player_two_password") == body["password"]:
         player_id = 2
     else:
         return format_response(
@@ -98,44 +313,46 @@ def get_game_route(event):
             http_code=401,
             body="Player is not allowed to play",
         )
-    pieces = {}
-    legal_moves = []
-    try:
-        game_node: chess.pgn.GameNode = parse_pgn_game(game_data["pgn_string"])
-        pieceMap: dict[int, chess.Piece] = game_node.board().piece_map()
-        whose_turn: int = 1 if game_node.turn() else 2
-        for square, piece in pieceMap.items():
-            if piece.symbol() not in pieces:
-                pieces[piece.symbol()] = []
-            pieces[piece.symbol()].append(chess.square_name(square))
-        for move in game_node.board().legal_moves:
-            legal_moves.append(move.uci())
-    except:
+    if board is None:
         return format_response(
             event=event,
             http_code=500,
             body="This game is not valid, please start a new game and abandon this game",
         )
-    output = {
-        "game_id": game_id,
-        "whose_turn": whose_turn,
-        "pieces": pieces,
-        "legal_moves": legal_moves,
-        "player_id": player_id,
-        "is_check": game_node.board().is_check(),
-        "is_checkmate": game_node.board().is_checkmate(),
-        "is_stalemate": game_node.board().is_stalemate(),
-        # "is_fivefold_repetition": game_node.board().is_fivefold_repetition(),
-        # "is_seventyfive_moves": game_node.board().is_seventyfive_moves(),
-    }
-    if "en_passant" in game_data:
-        output["en_passant"] = game_data["en_passant"]
-    if "previous_move" in game_data:
-        output["previous_move"] = game_data["previous_move"]
-    if "graveyard" in game_data:
-        output["graveyard"] = game_data["graveyard"]
-    if "piece_taken" in game_data:
-        output["piece_taken"] = game_data["piece_taken"]
+    output = build_game_output(game_id, player_id, board, game_data, body.get("format", "full"))
+    output["hints"] = pacing_hints(game_data, player_id)
+    if "delta_from" in body:
+        output = delta_output(output, board, game_data, body["delta_from"])
+    return format_response(
+        event=event,
+        http_code=200,
+        body=output,
+    )
+
+
+def archived_game_response(event, body):
+    """/get of a game that is no longer in the table, read from the archive"""
+    record = read_archive(body["game_id"])
+    if record is None:
+        return format_response(
+            event=event,
+            http_code=404,
+            body="Game ID not found in the database",
+        )
+    game_data = record["game"]
+    if game_data["player_one_password"] == body["password"]:
+        player_id = 1
+    elif game_data.get("player_two_password") == body["password"]:
+        player_id = 2
+    else:
+        return format_response(
+            event=event,
+            http_code=401,
+            body="Player is not allowed to play",
+        )
+    board = load_board(game_data)
+    output = build_game_output(body["game_id"], player_id, board, game_data, body.get("format", "full"))
+    output["hints"] = pacing_hints(game_data, player_id)
     return format_response(
         event=event,
         http_code=200,
@@ -143,9 +360,33 @@ def get_game_route(event):
     )
 
 
+# words_ids.generate_id() has 21 billion IDs to pick from, a collision is rare,
+# several in a row means something else is wrong
+MAX_ID_ATTEMPTS = 5
+
+
+# a new game has been in its starting position once
+STARTING_POSITIONS = repetition_counts([])
+
+
+def new_game_item(game_id, player_one_username, player_one_password):
+    return {
+        "key1": "game",
+        "key2": game_id,
+        "player_one_username": player_one_username,
+        "player_one_password": player_one_password,
+        "fen": chess.STARTING_FEN,
+        "moves": [],
+        "positions": STARTING_POSITIONS,
+        "expiration": int(time.time()) + (7 * 24 * 60 * 60),
+        "whose_turn": int(1),
+        "version": 0,
+    }
+
+
 def create_game_route(event):
     # check if the ID for the join is in the database
-    body = validate_schema(parse_body(event["body"]), CREATE_GAME_SCHEMA)
+    body = CREATE_GAME_VALIDATOR(parse_body(event["body"]))
     player_one_username = 'Player 1' # body["player_one_username"]
     if bad_words.has_bad_word(player_one_username):
         return format_response(
@@ -156,26 +397,24 @@ def create_game_route(event):
         )
     # if its an acceptable username, create a new game and send back the invite link
     player_one_password = letter_ids.generate_id()
-    game_id = words_ids.generate_id()
-    # Initialize a game object
-    game = chess.pgn.Game()
-    exporter = chess.pgn.StringExporter(headers=False, variations=True, comments=False)
-    pgn_string = game.accept(exporter)
-    # Write it to the database
-    write_response = dynamo.put_item(
-        TableName=TABLE_NAME,
-        Item=python_obj_to_dynamo_obj(
-            {
-                "key1": "game",
-                "key2": game_id,
-                "player_one_username": player_one_username,
-                "player_one_password": player_one_password,
-                "pgn_string": pgn_string,
-                "expiration": int(time.time()) + (7 * 24 * 60 * 60),
-                "whose_turn": int(1),
-            }
-        ),
-    )
+    # Write it to the database, with a new ID on the off chance this one is taken
+    for _ in range(MAX_ID_ATTEMPTS):
+        game_id = words_ids.generate_id()
+        try:
+            write_response = dynamo.put_item(
+                TableName=TABLE_NAME,
+                Item=python_obj_to_dynamo_obj(new_game_item(game_id, player_one_username, player_one_password)),
+                ConditionExpression="attribute_not_exists(key2)",
+            )
+            break
+        except dynamo.exceptions.ConditionalCheckFailedException:
+            print(f"{game_id} is already taken, trying another game ID")
+    else:
+        return format_response(
+            event=event,
+            http_code=507,
+            body="Could not write to the database. Whatever you were trying to do, it did not happen.",
+        )
     if (
         "ResponseMetadata" not in write_response
         or "HTTPStatusCode" not in write_response["ResponseMetadata"]
@@ -198,8 +437,204 @@ def create_game_route(event):
     )
 
 
+# TransactWriteItems takes up to 100 writes, 25 keeps a chunk that has to be
+# retried small
+GAMES_PER_WRITE = 25
+MAX_CHUNK_ATTEMPTS = 5
+
+
+def invite_link(game_id):
+    if DOMAIN_NAME:
+        return f"https://{DOMAIN_NAME}/play/{game_id}"
+    return f"/play/{game_id}"
+
+
+def write_new_games(items, used_game_ids):
+    """Writes the new game items GAMES_PER_WRITE at a time, each one only if its
+    game ID is not taken yet. A taken ID is swapped for a fresh one and the chunk
+    is tried again. Returns the items that made it to the database."""
+    written = []
+    for start in range(0, len(items), GAMES_PER_WRITE):
+        chunk = items[start : start + GAMES_PER_WRITE]
+        for attempt in range(MAX_CHUNK_ATTEMPTS):
+            try:
+                dynamo.transact_write_items(
+                    TransactItems=[
+                        {
+                            "Put": {
+                                "TableName": TABLE_NAME,
+                                "Item": python_obj_to_dynamo_obj(item),
+                                "ConditionExpression": "attribute_not_exists(key2)",
+                            }
+                        }
+                        for item in chunk
+                    ]
+                )
+                written += chunk
+                break
+            except dynamo.exceptions.TransactionCanceledException as e:
+                reasons = e.response.get("CancellationReasons", [])
+                for item, reason in zip(chunk, reasons):
+                    if reason.get("Code") == "ConditionalCheckFailed":
+                        print(f"{item['key2']} is already taken, trying another game ID")
+                        item["key2"] = unused_game_id(used_game_ids)
+                # anything else (conflicts, throttling) gets a moment before trying again
+                time.sleep(0.05 * (2**attempt))
+        else:
+            return written
+    return written
+
+
+def unused_game_id(used_game_ids):
+    while True:
+        game_id = words_ids.generate_id()
+        if game_id not in used_game_ids:
+            used_game_ids.add(game_id)
+            return game_id
+
+
+def create_games_route(event):
+    body = CREATE_GAMES_VALIDATOR(parse_body(event["body"]))
+    if not body:
+        return format_response(
+            event=event,
+            http_code=400,
+            body=f"Please ask for between 1 and {MAX_GAMES_PER_BATCH} games",
+        )
+    player_one_username = "Player 1"
+    used_game_ids = set()
+    items = [
+        new_game_item(unused_game_id(used_game_ids), player_one_username, letter_ids.generate_id())
+        for _ in range(body["count"])
+    ]
+    written = write_new_games(items, used_game_ids)
+    games = [
+        {
+            "game_id": item["key2"],
+            "player_one_username": player_one_username,
+            "player_one_password": item["player_one_password"],
+            "invite_link": invite_link(item["key2"]),
+        }
+        for item in written
+    ]
+    if len(written) != len(items):
+        return format_response(
+            event=event,
+            http_code=507,
+            body={
+                "message": f"Could only create {len(written)} of the {len(items)} games, the ones below are ready.",
+                "games": games,
+            },
+        )
+    return format_response(
+        event=event,
+        http_code=200,
+        body={"games": games},
+    )
+
+
+# /games answers for every game in the play page's list in one request: one
+# BatchGetItem per KEYS_PER_BATCH games, reading only what a summary needs.
+MAX_GAMES_PER_FETCH = 100
+KEYS_PER_BATCH = 100
+MAX_BATCH_ATTEMPTS = 5
+SUMMARY_PROJECTION = (
+    "key2, player_one_password, player_two_password, fen, pgn_string, whose_turn, previous_move, #version,"
+    " archived, #result, termination"
+)
+
+
+def batch_get_games(game_ids):
+    """{game_id: game_data} of the games that exist. Keys DynamoDB leaves
+    unprocessed (throttling) are asked for again with backoff, the ones still
+    unprocessed after that are returned as the second value."""
+    found = {}
+    unprocessed = []
+    for start in range(0, len(game_ids), KEYS_PER_BATCH):
+        request = {
+            TABLE_NAME: {
+                "Keys": [
+                    python_obj_to_dynamo_obj({"key1": "game", "key2": game_id})
+                    for game_id in game_ids[start : start + KEYS_PER_BATCH]
+                ],
+                "ProjectionExpression": SUMMARY_PROJECTION,
+                "ExpressionAttributeNames": {"#version": "version", "#result": "result"},
+            }
+        }
+        for attempt in range(MAX_BATCH_ATTEMPTS):
+            if attempt:
+                time.sleep(0.05 * (2 ** (attempt - 1)))
+            response = dynamo.batch_get_item(RequestItems=request)
+            for item in response.get("Responses", {}).get(TABLE_NAME, []):
+                game_data = dynamo_obj_to_python_obj(item)
+                found[game_data["key2"]] = game_data
+            request = response.get("UnprocessedKeys")
+            if not request:
+                break
+        else:
+            unprocessed += [dynamo_obj_to_python_obj(key)["key2"] for key in request[TABLE_NAME]["Keys"]]
+    return found, unprocessed
+
+
+def game_summary(game_id, password, game_data):
+    if game_data["player_one_password"] == password:
+        player_id = 1
+    elif game_data.get("player_two_password") == password:
+        player_id = 2
+    else:
+        return {"game_id": game_id, "error": "Player is not allowed to play"}
+    try:
+        board = load_board(game_data)
+    except:
+        return {"game_id": game_id, "error": "This game is not valid"}
+    summary = {
+        "game_id": game_id,
+        "player_id": player_id,
+        "version": int(game_data.get("version", 0)),
+        "joined": "player_two_password" in game_data,
+        "whose_turn": whose_turn_of(board),
+        "is_check": board.is_check(),
+        "is_checkmate": board.is_checkmate(),
+        "is_stalemate": board.is_stalemate(),
+    }
+    if "previous_move" in game_data:
+        summary["previous_move"] = game_data["previous_move"]
+    if game_data.get("archived"):
+        summary["archived"] = True
+        summary["result"] = game_data["result"]
+        summary["termination"] = game_data["termination"]
+    return summary
+
+
+def fetch_games_route(event):
+    body = FETCH_GAMES_VALIDATOR(parse_body(event["body"]))
+    if not body or len(body["games"]) > MAX_GAMES_PER_FETCH:
+        return format_response(
+            event=event,
+            http_code=400,
+            body=f"Please ask for between 1 and {MAX_GAMES_PER_FETCH} games",
+        )
+    # the same game twice in one BatchGetItem is an error
+    game_ids = list(dict.fromkeys(game["game_id"] for game in body["games"]))
+    found, unprocessed = batch_get_games(game_ids)
+    summaries = []
+    for game in body["games"]:
+        game_id = game["game_id"]
+        if game_id in found:
+            summaries.append(game_summary(game_id, game["password"], found[game_id]))
+        elif game_id in unprocessed:
+            summaries.append({"game_id": game_id, "error": "Could not read this game right now, please try again"})
+        else:
+            summaries.append({"game_id": game_id, "error": "Game ID not found in the database"})
+    return format_response(
+        event=event,
+        http_code=200,
+        body={"games": summaries},
+    )
+
+
 def join_game_route(event):
-    body = validate_schema(parse_body(event["body"]), JOIN_GAME_SCHEMA)
+    body = JOIN_GAME_VALIDATOR(parse_body(event["body"]))
     player_two_username = 'Player 2' # body["player_two_username"]
     if bad_words.has_bad_word(player_two_username):
         return format_response(
@@ -229,13 +664,30 @@ def join_game_route(event):
             body="Someone has already joined",
         )
     player_two_password = letter_ids.generate_id()
-    game_data["player_two_username"] = player_two_username
-    game_data["player_two_password"] = player_two_password
-    # Write it to the database
-    write_response = dynamo.put_item(
-        TableName=TABLE_NAME,
-        Item=python_obj_to_dynamo_obj(game_data),
-    )
+    # Write only the new attributes, and only if nobody joined in the meantime
+    try:
+        write_response = dynamo.update_item(
+            TableName=TABLE_NAME,
+            Key=python_obj_to_dynamo_obj({"key1": "game", "key2": game_id}),
+            UpdateExpression="SET player_two_username = :username, player_two_password = :password, "
+            "#version = if_not_exists(#version, :zero) + :one",
+            ConditionExpression="attribute_exists(key2) AND attribute_not_exists(player_two_password)",
+            ExpressionAttributeNames={"#version": "version"},
+            ExpressionAttributeValues=python_obj_to_dynamo_obj(
+                {
+                    ":username": player_two_username,
+                    ":password": player_two_password,
+                    ":zero": 0,
+                    ":one": 1,
+                }
+            ),
+        )
+    except dynamo.exceptions.ConditionalCheckFailedException:
+        return format_response(
+            event=event,
+            http_code=400,
+            body="Someone has already joined",
+        )
     if (
         "ResponseMetadata" not in write_response
         or "HTTPStatusCode" not in write_response["ResponseMetadata"]
@@ -246,6 +698,7 @@ def join_game_route(event):
             http_code=507,
             body="Could not write to the database. Whatever you were trying to do, it did not happen.",
         )
+    game_cache.invalidate(game_id)
     # Return the 2nd player ID and the current gameboard
     return format_response(
         event=event,
@@ -258,78 +711,165 @@ def join_game_route(event):
     )
 
 
-def make_move_route(event):
-    body = validate_schema(parse_body(event["body"]), MAKE_MOVE_SCHEMA)
-    game_id = body["game_id"]
-    response = dynamo.get_item(
+def write_move(game_id, previous_data, game_data):
+    """Writes only the attributes a move changes, on the condition that nobody else
+    wrote a move since previous_data was read"""
+    names = {"#version": "version"}
+    values = {
+        ":fen": game_data["fen"],
+        ":expiration": game_data["expiration"],
+        ":whose_turn": game_data["whose_turn"],
+        ":next_version": game_data["version"],
+        ":previous_move": game_data["previous_move"],
+        ":en_passant": game_data["en_passant"],
+        ":graveyard": game_data["graveyard"],
+        ":positions": game_data["positions"],
+        ":moved_at": game_data["moved_at"],
+    }
+    set_parts = [
+        "fen = :fen",
+        "expiration = :expiration",
+        "whose_turn = :whose_turn",
+        "#version = :next_version",
+        "previous_move = :previous_move",
+        "en_passant = :en_passant",
+        "graveyard = :graveyard",
+        "positions = :positions",
+        "moved_at = :moved_at",
+    ]
+    # connection ids used to live on the game item, they are in the registry now
+    remove_parts = ["player_one_connection_id", "player_two_connection_id"]
+    if "moves" in previous_data:
+        set_parts.append("moves = list_append(moves, :move)")
+        values[":move"] = game_data["moves"][-1:]
+    else:
+        # older item, this move writes its snapshot for the first time
+        set_parts.append("moves = :moves")
+        values[":moves"] = game_data["moves"]
+        remove_parts.append("pgn_string")
+    if "move_gap" in game_data:
+        set_parts.append("move_gap = :move_gap")
+        values[":move_gap"] = game_data["move_gap"]
+    if "piece_taken" in game_data:
+        set_parts.append("piece_taken = :piece_taken")
+        values[":piece_taken"] = game_data["piece_taken"]
+    else:
+        remove_parts.append("piece_taken")
+    if "version" in previous_data:
+        condition = "#version = :version"
+        values[":version"] = previous_data["version"]
+    else:
+        condition = "attribute_not_exists(#version)"
+    update_expression = "SET " + ", ".join(set_parts)
+    if remove_parts:
+        update_expression += " REMOVE " + ", ".join(remove_parts)
+    return dynamo.update_item(
         TableName=TABLE_NAME,
         Key=python_obj_to_dynamo_obj({"key1": "game", "key2": game_id}),
+        UpdateExpression=update_expression,
+        ConditionExpression=condition,
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=python_obj_to_dynamo_obj(values),
     )
-    if "Item" not in response:
-        return format_response(
-            event=event,
-            http_code=404,
-            body="Game ID not found in the database",
-        )
-    # If it is, check passwords
-    game_data = dynamo_obj_to_python_obj(response["Item"])
-    if game_data["player_one_password"] == body["password"]:
-        player_id = 1
-    elif game_data["player_two_password"] == body["password"]:
-        player_id = 2
-    else:
-        return format_response(
-            event=event,
-            http_code=401,
-            body="Player is not allowed to play",
-        )
+
+
+# A move only conflicts with another write to the same game, which is rare, so
+# it is retried from a fresh read a couple of times before giving up.
+MAX_MOVE_ATTEMPTS = 3
+
+
+def make_move_route(event):
+    body = MAKE_MOVE_VALIDATOR(parse_body(event["body"]))
+    game_id = body["game_id"]
     move = body["move"]
-    graveyard = game_data.get("graveyard", [])
-    en_passant = False
-    piece_taken = None
-    try:
-        previous_node: chess.pgn.GameNode = parse_pgn_game(game_data["pgn_string"])
-        whose_turn: int = 1 if previous_node.turn() else 2
-        if whose_turn != player_id:
+    for attempt in range(MAX_MOVE_ATTEMPTS):
+        response = dynamo.get_item(
+            TableName=TABLE_NAME,
+            Key=python_obj_to_dynamo_obj({"key1": "game", "key2": game_id}),
+            ConsistentRead=True,
+        )
+        if "Item" not in response:
+            return format_response(
+                event=event,
+                http_code=404,
+                body="Game ID not found in the database",
+            )
+        # If it is, check passwords
+        previous_data = dynamo_obj_to_python_obj(response["Item"])
+        if previous_data["player_one_password"] == body["password"]:
+            player_id = 1
+        elif previous_data.get("player_two_password") == body["password"]:
+            player_id = 2
+        else:
+            return format_response(
+                event=event,
+                http_code=401,
+                body="Player is not allowed to play",
+            )
+        if previous_data.get("archived"):
+            return format_response(
+                event=event,
+                http_code=400,
+                body="This game is over",
+            )
+        try:
+            board = load_board(previous_data)
+            moves = load_moves(previous_data)
+            positions = previous_data.get("positions") or repetition_counts(moves)
+        except:
+            return format_response(
+                event=event,
+                http_code=500,
+                body="This game is not valid, please start a new game and abandon this game",
+            )
+        if whose_turn_of(board) != player_id:
             return format_response(
                 event=event,
                 http_code=500,
                 body="It is not your turn",
             )
-        game_node = previous_node.add_variation(chess.Move.from_uci(move))
-        if previous_node.board().is_capture(game_node.move):
-            piece_location = game_node.move.to_square
-            if previous_node.board().is_en_passant(game_node.move):
-                en_passant = True
-                file = chess.square_file(game_node.move.to_square)
-                rank = chess.square_rank(game_node.move.from_square)
-                piece_location = file + (8 * rank)
-            piece: str = previous_node.board().piece_at(piece_location).symbol()
-            piece_taken = { piece: [ chess.square_name(piece_location) ] }
-            graveyard.append(piece)
-    except:
+        if is_drawn(board, positions):
+            return format_response(
+                event=event,
+                http_code=400,
+                body="This game is over",
+            )
+        try:
+            piece_taken, graveyard_piece, en_passant = apply_move(board, move)
+        except ValueError:
+            return format_response(
+                event=event,
+                http_code=400,
+                body="That move is not allowed",
+            )
+        game_data = dict(previous_data)
+        game_data.pop("pgn_string", None)
+        game_data.pop("player_one_connection_id", None)
+        game_data.pop("player_two_connection_id", None)
+        game_data.pop("piece_taken", None)
+        game_data["graveyard"] = previous_data.get("graveyard", []) + ([graveyard_piece] if graveyard_piece else [])
+        game_data["fen"] = board.fen()
+        game_data["moves"] = moves + [move]
+        game_data["positions"] = count_position(positions, board)
+        game_data["expiration"] = int(time.time()) + (7 * 24 * 60 * 60)
+        game_data["whose_turn"] = whose_turn_of(board)
+        game_data["version"] = previous_data.get("version", 0) + 1
+        game_data["previous_move"] = move
+        game_data["en_passant"] = en_passant
+        time_move(previous_data, game_data)
+        if piece_taken:
+            game_data["piece_taken"] = piece_taken
+        try:
+            write_response = write_move(game_id, previous_data, game_data)
+            break
+        except dynamo.exceptions.ConditionalCheckFailedException:
+            print(f"{game_id} changed while making move {move}, attempt {attempt + 1}")
+    else:
         return format_response(
             event=event,
-            http_code=500,
-            body="This game is not valid, please start a new game and abandon this game",
+            http_code=409,
+            body="The game changed while making your move, please try again",
         )
-    # Initialize a game object
-    exporter = chess.pgn.StringExporter(headers=False, variations=True, comments=False)
-    pgn_string = game_node.game().accept(exporter)
-    game_data["pgn_string"] = pgn_string
-    game_data["expiration"] = int(time.time()) + (7 * 24 * 60 * 60)
-    game_data["whose_turn"] = 1 if whose_turn == 2 else 2
-    game_data["previous_move"] = move
-    game_data["en_passant"] = en_passant
-    game_data["graveyard"] = graveyard
-    game_data.pop("piece_taken", None)
-    if piece_taken:
-        game_data["piece_taken"] = piece_taken
-    # Write it to the database
-    write_response = dynamo.put_item(
-        TableName=TABLE_NAME,
-        Item=python_obj_to_dynamo_obj(game_data),
-    )
     if (
         "ResponseMetadata" not in write_response
         or "HTTPStatusCode" not in write_response["ResponseMetadata"]
@@ -340,61 +880,130 @@ def make_move_route(event):
             http_code=507,
             body="Could not write to the database. Whatever you were trying to do, it did not happen.",
         )
-    pieces = {}
-    legal_moves = []
+    # the history index, see move_history.py
     try:
-        game_node: chess.pgn.GameNode = parse_pgn_game(game_data["pgn_string"])
-        pieceMap: dict[int, chess.Piece] = game_node.board().piece_map()
-        whose_turn: int = 1 if game_node.turn() else 2
-        for square, piece in pieceMap.items():
-            if piece.symbol() not in pieces:
-                pieces[piece.symbol()] = []
-            pieces[piece.symbol()].append(chess.square_name(square))
-        for move in game_node.board().legal_moves:
-            legal_moves.append(move.uci())
-    except:
-        return format_response(
-            event=event,
-            http_code=500,
-            body="This game is not valid, please start a new game and abandon this game",
+        write_ply(game_id, len(game_data["moves"]), ply_record(board, piece_taken), game_data["expiration"])
+    except Exception as error:
+        # the move is in, /history replays the ply the first time it is asked for
+        print(f"Could not index ply {len(game_data['moves'])} of {game_id}: {error!r}")
+    game_cache.put(game_id, game_data, board)
+    # the game as the players see it, over if this move ended it even before it is
+    # archived below (or from the stream when it expires, if that fails)
+    shown_data = game_data
+    ending = ARCHIVE_BUCKET and termination_of(board, game_data["positions"])
+    if ending:
+        termination, result = ending
+        shown_data = {**game_data, "archived": True, "result": result, "termination": termination}
+    opponent_id = 2 if player_id == 1 else 1
+    opponent_connections = [
+        (connection_id, wire_format)
+        for connection_id, connection_player_id, wire_format in game_connections(game_id)
+        if connection_player_id == opponent_id
+    ]
+    # built once per format, for this response and for the opponent's sockets
+    response_format = body.get("format", "full")
+    push_formats = {wire_format for _, wire_format in opponent_connections}
+    outputs = {
+        wire_format: build_game_output(game_id, player_id, board, shown_data, wire_format)
+        for wire_format in push_formats | {response_format}
+    }
+    # the opponent gets the same state /get would give them, so they do not have to ask for it
+    opponent_hints = pacing_hints(shown_data, opponent_id)
+    messages = {
+        wire_format: json.dumps(
+            {"event": "move", "game": {**outputs[wire_format], "player_id": opponent_id, "hints": opponent_hints}}
         )
-    connection_id = None
-    if player_id == 1 and 'player_two_connection_id' in game_data:
-        connection_id = game_data['player_two_connection_id']
-    elif player_id == 2 and 'player_one_connection_id' in game_data:
-        connection_id = game_data['player_one_connection_id']
-    if connection_id:
+        for wire_format in push_formats
+    }
+    for connection_id, wire_format in opponent_connections:
         print(f"Writing message to {connection_id}")
-        try:
-            apigw.post_to_connection(
-                ConnectionId=connection_id,
-                Data=json.dumps({"event": "move"})
-            )
-        except apigw.exceptions.GoneException as e:
-            print(f"{connection_id} no longer active, not sending any messages")
-    else:
+        post_to_connection(connection_id, messages[wire_format], game_id)
+    if not opponent_connections:
         print("Not sending any messages")
+    # spectators do not know which format the others asked for, every format goes
+    # to the broadcast, which posts them without holding up this response
+    if has_spectators(game_id):
+        for wire_format in WIRE_FORMATS:
+            if wire_format not in outputs:
+                outputs[wire_format] = build_game_output(game_id, player_id, board, shown_data, wire_format)
+        queue_broadcast(
+            game_id,
+            {
+                wire_format: json.dumps({"event": "move", "game": {**outputs[wire_format], "player_id": SPECTATOR}})
+                for wire_format in WIRE_FORMATS
+            },
+        )
+    output = {**outputs[response_format], "hints": pacing_hints(shown_data, player_id)}
+    if "delta_from" in body:
+        output = delta_output(output, board, shown_data, body["delta_from"])
+    if ending:
+        # after the push, the opponent does not wait on S3, see archive.py
+        try:
+            tombstone = archive_finished_game(game_id, game_data, board)
+        except Exception as error:
+            # the move is in, the stream archives the game when it expires
+            print(f"Could not archive {game_id}: {error!r}")
+            tombstone = None
+        if tombstone:
+            game_cache.put(game_id, tombstone, board)
+    return format_response(
+        event=event,
+        http_code=200,
+        body=output,
+    )
+
+
+def fetch_player_game(event, body):
+    """(game_data, board, None) of the game in the request, or (None, None, the
+    error response) if it is not there or the password is not a player's. The
+    moves of an archived game are read back from the archive."""
+    game = fetch_game(body["game_id"])
+    if game is None or (game[0].get("archived") and "moves" not in game[0]):
+        record = read_archive(body["game_id"])
+        if record:
+            game = record["game"], load_board(record["game"])
+    if game is None:
+        return None, None, format_response(event=event, http_code=404, body="Game ID not found in the database")
+    game_data, board = game
+    if body["password"] not in (game_data["player_one_password"], game_data.get("player_two_password")):
+        return None, None, format_response(event=event, http_code=401, body="Player is not allowed to play")
+    if board is None:
+        return (
+            None,
+            None,
+            format_response(
+                event=event,
+                http_code=500,
+                body="This game is not valid, please start a new game and abandon this game",
+            ),
+        )
+    return game_data, board, None
+
+
+# /history pages through the moves played so far, with the position after each,
+# from the per-ply index instead of replaying the game
+HISTORY_PLIES = 20
+
 
+def history_route(event):
+    body = HISTORY_VALIDATOR(parse_body(event["body"]))
+    game_data, board, error = fetch_player_game(event, body)
+    if error:
+        return error
+    moves = load_moves(game_data)
+    first = max(1, int(body.get("from_ply", "1")))
+    last = min(len(moves), first + body.get("count", HISTORY_PLIES) - 1)
     output = {
-        "game_id": game_id,
-        "whose_turn": whose_turn,
-        "pieces": pieces,
-        "legal_moves": legal_moves,
-        "player_id": player_id,
-        "is_check": game_node.board().is_check(),
-        "is_checkmate": game_node.board().is_checkmate(),
-        "is_stalemate": game_node.board().is_stalemate(),
-        # "is_fivefold_repetition": game_node.board().is_fivefold_repetition(),
-        # "is_seventyfive_moves": game_node.board().is_seventyfive_moves(),
+        "game_id": body["game_id"],
+        "total_plies": len(moves),
+        "plies": (
+            ply_page(body["game_id"], moves, first, last, game_data["expiration"], not game_data.get("archived"))
+            if first <= last
+            else []
+        ),
     }
-    if "en_passant" in game_data:
-        output["en_passant"] = game_data["en_passant"]
-    if "previous_move" in game_data:
-        output["previous_move"] = game_data["previous_move"]
-    if "graveyard" in game_data:
-        output["graveyard"] = game_data["graveyard"]
-    if piece_taken:
-        output["piece_taken"] = piece_taken
+    if last < len(moves):
+        output["next_ply"] = last + 1
     return format_response(
         event=event,
         http_code=200,
@@ -402,12 +1011,83 @@ def make_move_route(event):
     )
 
 
+# /pgn sends the PGN of a long game in chunks of PGN_CHUNK_PLIES plies, written
+# from the SAN in the index, the client asks for next_ply until there is none
+# and puts the chunks together as they are
+PGN_CHUNK_PLIES = 200
+
+
+def pgn_tag(name, value):
+    value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return f'[{name} "{value}"]\n'
+
+
+def export_pgn_route(event):
+    body = EXPORT_PGN_VALIDATOR(parse_body(event["body"]))
+    game_data, board, error = fetch_player_game(event, body)
+    if error:
+        return error
+    moves = load_moves(game_data)
+    # a board loaded from the FEN has no history, it does not see a fivefold repetition
+    result = game_data["result"] if game_data.get("archived") else board.result()
+    first = max(1, int(body.get("from_ply", "1")))
+    last = min(len(moves), first + PGN_CHUNK_PLIES - 1)
+    chunk = ""
+    if first == 1:
+        chunk += pgn_tag("Event", "Chess with humans")
+        chunk += pgn_tag("White", game_data.get("player_one_username", "?"))
+        chunk += pgn_tag("Black", game_data.get("player_two_username", "?"))
+        chunk += pgn_tag("Result", result)
+        chunk += "\n"
+    if first <= last:
+        page = ply_page(body["game_id"], moves, first, last, game_data["expiration"], not game_data.get("archived"))
+        chunk += " ".join(pgn_movetext(page, first))
+        chunk += " "
+    output = {"game_id": body["game_id"], "pgn": chunk}
+    if last < len(moves):
+        output["next_ply"] = last + 1
+    else:
+        output["pgn"] += result + "\n"
+    return format_response(
+        event=event,
+        http_code=200,
+        body=output,
+    )
+
+
+# /is-it-my-turn is polled, it only reads the attributes it needs instead of the
+# whole game (DynamoDB still bills the read on the whole item, but it does not
+# have to send or deserialize the moves and graveyard). Items from before
+# whose_turn was stored are loaded once and get it written back.
+TURN_PROJECTION = "player_one_password, player_two_password, whose_turn, moved_at, move_gap, archived"
+
+
+def backfill_whose_turn(game_id):
+    game = fetch_game(game_id, with_moves=False)
+    if game is None or game[1] is None:
+        return None
+    whose_turn = whose_turn_of(game[1])
+    try:
+        dynamo.update_item(
+            TableName=TABLE_NAME,
+            Key=python_obj_to_dynamo_obj({"key1": "game", "key2": game_id}),
+            UpdateExpression="SET whose_turn = :whose_turn",
+            ConditionExpression="attribute_exists(key2) AND attribute_not_exists(whose_turn)",
+            ExpressionAttributeValues=python_obj_to_dynamo_obj({":whose_turn": whose_turn}),
+        )
+    except dynamo.exceptions.ConditionalCheckFailedException:
+        # a move wrote it first, which is just as good
+        pass
+    return whose_turn
+
+
 def check_turn_route(event):
-    body = validate_schema(parse_body(event["body"]), CHECK_TURN_SCHEMA)
+    body = CHECK_TURN_VALIDATOR(parse_body(event["body"]))
     game_id = body["game_id"]
     response = dynamo.get_item(
         TableName=TABLE_NAME,
         Key=python_obj_to_dynamo_obj({"key1": "game", "key2": game_id}),
+        ProjectionExpression=TURN_PROJECTION,
     )
     if "Item" not in response:
         return format_response(
@@ -419,7 +1099,7 @@ def check_turn_route(event):
     game_data = dynamo_obj_to_python_obj(response["Item"])
     if game_data["player_one_password"] == body["password"]:
         player_id = 1
-    elif game_data["player_two_password"] == body["password"]:
+    elif game_data.get("player_two_password") == body["password"]:
         player_id = 2
     else:
         return format_response(
@@ -430,19 +1110,25 @@ def check_turn_route(event):
     if "whose_turn" in game_data:
         whose_turn = game_data["whose_turn"]
     else:
-        try:
-            game_node: chess.pgn.GameNode = parse_pgn_game(game_data["pgn_string"])
-            whose_turn: int = 1 if game_node.turn() else 2
-        except:
-            return format_response(
-                event=event,
-                http_code=500,
-                body="This game is not valid, please start a new game and abandon this game",
-            )
+        whose_turn = backfill_whose_turn(game_id)
+    if whose_turn is None:
+        return format_response(
+            event=event,
+            http_code=500,
+            body="This game is not valid, please start a new game and abandon this game",
+        )
+    if whose_turn == player_id:
+        return format_response(event=event, http_code=200, body={})
+    # when asking again is worth it, see pacing.py
+    retry_after = pacing_hints({**game_data, "whose_turn": whose_turn}, player_id)["retry_after"]
+    headers = None
+    if retry_after is not None:
+        headers = {"Retry-After": str(retry_after), "Access-Control-Expose-Headers": "x-csrf-token, Retry-After"}
     return format_response(
         event=event,
-        http_code=200 if whose_turn == player_id else 204,
+        http_code=204,
         body={},
+        headers=headers,
     )
 
 
@@ -0,0 +1,173 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .utils import (
+    dynamo,
+    TABLE_NAME,
+    FUNCTION_NAME,
+    python_obj_to_dynamo_obj,
+    dynamo_obj_to_python_obj,
+    apigw,
+    lambda_client,
+)
+
+# WebSocket connections live in their own items instead of on the game item:
+#   key1 "connection",            key2 connection_id -> which game it registered for
+#   key1 "connections-<game_id>", key2 connection_id -> one per registered socket
+# so a game's sockets are a single query, and a dead socket can be dropped
+# without touching the game.
+#
+# Spectators register with player_id 0 and are kept apart from the players:
+#   key1 "spectators-<game_id>",  key2 connection_id
+# so a move only queries the players' sockets, however many people watch.
+
+# API Gateway closes WebSockets after 2 hours anyway
+CONNECTION_TTL_SECONDS = 2 * 60 * 60
+SPECTATOR = 0
+# post_to_connection is a blocking HTTPS call, a broadcast makes this many at once
+MAX_FANOUT_WORKERS = int(os.environ.get("MAX_FANOUT_WORKERS", "32"))
+
+
+def game_connections_key(game_id, player_id=None):
+    if player_id == SPECTATOR:
+        return f"spectators-{game_id}"
+    return f"connections-{game_id}"
+
+
+def add_connection(connection_id):
+    dynamo.put_item(
+        TableName=TABLE_NAME,
+        Item=python_obj_to_dynamo_obj(
+            {
+                "key1": "connection",
+                "key2": connection_id,
+                "expiration": int(time.time()) + CONNECTION_TTL_SECONDS,
+            }
+        ),
+    )
+
+
+def register_connection(connection_id, game_id, player_id, wire_format="full"):
+    expiration = int(time.time()) + CONNECTION_TTL_SECONDS
+    dynamo.put_item(
+        TableName=TABLE_NAME,
+        Item=python_obj_to_dynamo_obj(
+            {
+                "key1": "connection",
+                "key2": connection_id,
+                "game_id": game_id,
+                "player_id": player_id,
+                "expiration": expiration,
+            }
+        ),
+    )
+    return dynamo.put_item(
+        TableName=TABLE_NAME,
+        Item=python_obj_to_dynamo_obj(
+            {
+                "key1": game_connections_key(game_id, player_id),
+                "key2": connection_id,
+                "player_id": player_id,
+                # the format the move pushes are sent in
+                "wire_format": wire_format,
+                "expiration": expiration,
+            }
+        ),
+    )
+
+
+def remove_connection(connection_id, game_id=None, player_id=None):
+    if game_id is None:
+        response = dynamo.get_item(
+            TableName=TABLE_NAME,
+            Key=python_obj_to_dynamo_obj({"key1": "connection", "key2": connection_id}),
+        )
+        connection = dynamo_obj_to_python_obj(response.get("Item", {}))
+        game_id = connection.get("game_id")
+        player_id = connection.get("player_id")
+    dynamo.delete_item(
+        TableName=TABLE_NAME,
+        Key=python_obj_to_dynamo_obj({"key1": "connection", "key2": connection_id}),
+    )
+    if game_id:
+        dynamo.delete_item(
+            TableName=TABLE_NAME,
+            Key=python_obj_to_dynamo_obj({"key1": game_connections_key(game_id, player_id), "key2": connection_id}),
+        )
+
+
+def game_connections(game_id, player_id=None):
+    """[(connection_id, player_id, wire_format)] of every socket registered for the
+    game by its players, or by its spectators with player_id=SPECTATOR"""
+    output = []
+    query = {
+        "TableName": TABLE_NAME,
+        "KeyConditionExpression": "key1 = :key1",
+        "ExpressionAttributeValues": python_obj_to_dynamo_obj({":key1": game_connections_key(game_id, player_id)}),
+    }
+    while True:
+        response = dynamo.query(**query)
+        for item in response.get("Items", []):
+            connection = dynamo_obj_to_python_obj(item)
+            output.append((connection["key2"], int(connection["player_id"]), connection.get("wire_format", "full")))
+        if "LastEvaluatedKey" not in response:
+            return output
+        query["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def has_spectators(game_id):
+    response = dynamo.query(
+        TableName=TABLE_NAME,
+        KeyConditionExpression="key1 = :key1",
+        ExpressionAttributeValues=python_obj_to_dynamo_obj({":key1": game_connections_key(game_id, SPECTATOR)}),
+        ProjectionExpression="key2",
+        Limit=1,
+    )
+    return bool(response.get("Items"))
+
+
+def post_to_connection(connection_id, data, game_id=None, player_id=None):
+    """Sends data to the socket, returns False and forgets the socket if it is gone"""
+    try:
+        apigw.post_to_connection(ConnectionId=connection_id, Data=data)
+        return True
+    except apigw.exceptions.GoneException:
+        print(f"{connection_id} no longer active, removing it")
+        remove_connection(connection_id, game_id, player_id)
+        return False
+
+
+# A move reaches the spectators from a second, asynchronous invocation of this
+# function, so the mover's request does not wait for them.
+def queue_broadcast(game_id, messages):
+    """messages is the message to send in each wire format"""
+    lambda_client.invoke(
+        FunctionName=FUNCTION_NAME,
+        InvocationType="Event",
+        Payload=json.dumps({"broadcast": {"game_id": game_id, "messages": messages}}),
+    )
+
+
+def broadcast(game_id, messages):
+    """Posts to every spectator of the game at once, MAX_FANOUT_WORKERS at a time,
+    returns how many were sent and how many sockets were gone (and removed)"""
+    spectators = game_connections(game_id, SPECTATOR)
+    if not spectators:
+        return 0, 0
+    with ThreadPoolExecutor(max_workers=min(MAX_FANOUT_WORKERS, len(spectators))) as pool:
+        results = list(
+            pool.map(
+                lambda spectator: post_to_connection(spectator[0], messages[spectator[2]], game_id, SPECTATOR),
+                spectators,
+            )
+        )
+    sent = sum(results)
+    return sent, len(results) - sent
+
+
+def broadcast_route(event):
+    game_id = event["broadcast"]["game_id"]
+    sent, gone = broadcast(game_id, event["broadcast"]["messages"])
+    print(f"Broadcast to {sent} spectators of {game_id}, {gone} were gone")
+    return {"statusCode": 200, "body": f"Broadcast to {sent} spectators"}
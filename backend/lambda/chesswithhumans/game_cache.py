@@ -0,0 +1,94 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Lives in module scope, so it survives between invocations of a warm Lambda
+# container. Entries are only trusted after checking their version against the
+# table (make_move_route and join_game_route bump it), the TTL just bounds how
+# long an idle game holds on to memory: a hit starts it again, so the oldest
+# entries are the first to expire, and every put drops the expired ones from
+# the front. A game read without its moves (/get reads them only for a delta)
+# is cached as such, and is a miss for anything that needs them. Locked for the
+# worker threads of server.py, never around read_version(), which goes to the
+# table.
+
+GAME_CACHE_SIZE = int(os.environ.get("GAME_CACHE_SIZE", "256"))
+GAME_CACHE_TTL_SECONDS = float(os.environ.get("GAME_CACHE_TTL_SECONDS", "300"))
+
+
+class GameCache:
+    def __init__(self, max_entries=GAME_CACHE_SIZE, ttl_seconds=GAME_CACHE_TTL_SECONDS, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def get(self, game_id, read_version, with_moves=True):
+        """Returns (game_data, board) if the cached copy is still at the version
+        read_version() reports, read_version is only called when there is a copy"""
+        with self.lock:
+            entry = self.entries.get(game_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            entry_version, game_data, board, expires_at, has_moves = entry
+            if expires_at < self.clock():
+                del self.entries[game_id]
+                self.evictions += 1
+                self.misses += 1
+                return None
+            if with_moves and not has_moves:
+                self.misses += 1
+                return None
+        version = read_version()
+        with self.lock:
+            # another thread may have replaced the entry in the meantime
+            current = self.entries.get(game_id) is entry
+            if version != entry_version:
+                if current:
+                    del self.entries[game_id]
+                self.stale += 1
+                self.misses += 1
+                return None
+            if current:
+                self.entries[game_id] = (*entry[:3], self.clock() + self.ttl_seconds, has_moves)
+                self.entries.move_to_end(game_id)
+            self.hits += 1
+        return game_data, board
+
+    def put(self, game_id, game_data, board, with_moves=True):
+        with self.lock:
+            now = self.clock()
+            self.entries[game_id] = (game_data.get("version", 0), game_data, board, now + self.ttl_seconds, with_moves)
+            self.entries.move_to_end(game_id)
+            while self.entries and next(iter(self.entries.values()))[3] < now:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, game_id):
+        with self.lock:
+            self.entries.pop(game_id, None)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            }
+
+
+game_cache = GameCache()
@@ -0,0 +1,282 @@
+import hashlib
+import io
+import chess
+
+from chesswithhumans.instrumentation import timed
+from chesswithhumans.position_cache import position_cache
+
+# Every game item carries a "fen" snapshot of the current position plus the
+# list of "moves" played so far (UCI). The routes build the board straight from
+# the FEN, the PGN is only rebuilt when someone wants to export the game, or
+# replayed once to recover an older item that was written before the snapshot,
+# so chess.pgn is only imported for those.
+
+
+def parse_pgn_game(pgn_string) -> "chess.pgn.GameNode":
+    import chess.pgn
+
+    return chess.pgn.read_game(io.StringIO(pgn_string)).end()
+
+
+@timed("load_board")
+def load_board(game_data) -> chess.Board:
+    if "fen" in game_data:
+        return chess.Board(game_data["fen"])
+    # older item, replay the PGN one time, the next move will write the snapshot
+    return parse_pgn_game(game_data["pgn_string"]).board()
+
+
+def load_moves(game_data) -> list[str]:
+    if "moves" in game_data:
+        return list(game_data["moves"])
+    import chess.pgn
+
+    game = chess.pgn.read_game(io.StringIO(game_data["pgn_string"]))
+    return [move.uci() for move in game.mainline_moves()]
+
+
+@timed("pgn_export")
+def build_pgn_string(moves, headers=None) -> str:
+    import chess.pgn
+
+    game = chess.pgn.Game()
+    node = game
+    for move in moves:
+        node = node.add_variation(chess.Move.from_uci(move))
+    if headers:
+        game.headers.update(headers)
+    exporter = chess.pgn.StringExporter(headers=bool(headers), variations=True, comments=False)
+    return game.accept(exporter)
+
+
+def whose_turn_of(board: chess.Board) -> int:
+    return 1 if board.turn == chess.WHITE else 2
+
+
+def pieces_of(board: chess.Board) -> dict:
+    pieces = {}
+    for square, piece in board.piece_map().items():
+        symbol = piece.symbol()
+        if symbol not in pieces:
+            pieces[symbol] = []
+        pieces[symbol].append(chess.square_name(square))
+    return pieces
+
+
+@timed("legal_moves")
+def describe_status(board: chess.Board) -> dict:
+    return {
+        "whose_turn": whose_turn_of(board),
+        "legal_moves": [move.uci() for move in board.legal_moves],
+        "is_check": board.is_check(),
+        "is_checkmate": board.is_checkmate(),
+        "is_stalemate": board.is_stalemate(),
+    }
+
+
+def position_key(board: chess.Board) -> tuple:
+    """Equal for positions with the same pieces, side to move, castling rights and
+    en passant capture, whatever the move counters (the same thing python-chess
+    compares for repetitions). Much quicker than the EPD, which is built square
+    by square."""
+    return (
+        board.pawns,
+        board.knights,
+        board.bishops,
+        board.rooks,
+        board.queens,
+        board.kings,
+        board.occupied_co[chess.WHITE],
+        board.occupied_co[chess.BLACK],
+        board.turn,
+        board.clean_castling_rights(),
+        board.ep_square if board.has_legal_en_passant() else None,
+    )
+
+
+# A board built from the FEN has no move stack, so python-chess cannot tell
+# repetitions from it, and replaying the moves on every request is too slow for
+# long games. The game item keeps "positions" instead, {position_hash: times it
+# was on the board}, counted move by move. Only the positions since the last
+# capture or pawn move are kept, the ones before it cannot come back. The
+# halfmove clock for the 50 and 75-move rules is already in the FEN.
+
+
+def position_hash(board: chess.Board) -> str:
+    # the same from one container to the next, unlike hash()
+    return hashlib.blake2b(repr(position_key(board)).encode(), digest_size=8).hexdigest()
+
+
+def count_position(positions, board: chess.Board) -> dict:
+    """The positions counts with the board's position counted once more"""
+    positions = {} if board.halfmove_clock == 0 else dict(positions)
+    key = position_hash(board)
+    positions[key] = positions.get(key, 0) + 1
+    return positions
+
+
+def repetition_counts(moves) -> dict:
+    """The positions counts of a game, replayed from its moves (for items from
+    before the counts were kept)"""
+    board = chess.Board()
+    positions = count_position({}, board)
+    for move in moves:
+        board.push_uci(move)
+        positions = count_position(positions, board)
+    return positions
+
+
+def draw_status(board: chess.Board, positions) -> dict:
+    """The repetition and move-count draws the position is at, only the ones that
+    hold so the output does not grow. Without the counts (older item, until its
+    next move) only the move counts are told."""
+    status = {}
+    if positions:
+        count = positions.get(position_hash(board), 0)
+        if count >= 3:
+            status["is_threefold_repetition"] = True
+        if count >= 5:
+            status["is_fivefold_repetition"] = True
+    # both need a legal move, the clock is checked first
+    if board.halfmove_clock >= 100 and board.is_fifty_moves():
+        status["is_fifty_moves"] = True
+        if board.is_seventyfive_moves():
+            status["is_seventyfive_moves"] = True
+    return status
+
+
+def is_drawn(board: chess.Board, positions) -> bool:
+    """Whether the game ended in one of the draws that need no claim"""
+    return board.is_seventyfive_moves() or positions.get(position_hash(board), 0) >= 5
+
+
+def termination_of(board: chess.Board, positions) -> tuple | None:
+    """(termination, result) of a game that is over, None if it is not"""
+    outcome = board.outcome()
+    if outcome is not None:
+        return outcome.termination.name.lower(), outcome.result()
+    if positions and positions.get(position_hash(board), 0) >= 5:
+        return "fivefold_repetition", "1/2-1/2"
+    return None
+
+
+def describe_board(board: chess.Board) -> dict:
+    return position_cache.get(
+        (position_key(board), "full"), lambda: {"pieces": pieces_of(board), **describe_status(board)}
+    )
+
+
+def pack_legal_moves(board: chess.Board) -> dict:
+    """{from square: the squares it can go to, run together}. A promotion is listed
+    once, the client offers the four pieces when a pawn reaches the last rank."""
+    packed = {}
+    for move in board.legal_moves:
+        if move.promotion not in (None, chess.QUEEN):
+            continue
+        from_square = chess.SQUARE_NAMES[move.from_square]
+        packed[from_square] = packed.get(from_square, "") + chess.SQUARE_NAMES[move.to_square]
+    return packed
+
+
+@timed("legal_moves")
+def describe_status_compact(board: chess.Board) -> dict:
+    return {
+        "whose_turn": whose_turn_of(board),
+        "moves_from": pack_legal_moves(board),
+        "is_check": board.is_check(),
+        "is_checkmate": board.is_checkmate(),
+        "is_stalemate": board.is_stalemate(),
+    }
+
+
+def describe_board_compact(board: chess.Board) -> dict:
+    # the move counters in the FEN are not part of the cached position
+    return {
+        "fen": board.fen(),
+        **position_cache.get((position_key(board), "compact"), lambda: describe_status_compact(board)),
+    }
+
+
+# the rook's squares when a king castles
+CASTLING_ROOKS = {
+    "e1g1": ("h1", "f1"),
+    "e1c1": ("a1", "d1"),
+    "e8g8": ("h8", "f8"),
+    "e8c8": ("a8", "d8"),
+}
+
+
+def touched_squares(uci_move) -> set:
+    """Squares the move can have changed, worked out from the move alone: a few
+    more than it really changed is fine, their content is read from the board"""
+    from_square = uci_move[0:2]
+    to_square = uci_move[2:4]
+    squares = {from_square, to_square, *CASTLING_ROOKS.get(uci_move, ())}
+    # a pawn taking en passant removes the pawn beside it
+    if from_square[0] != to_square[0] and (from_square[1], to_square[1]) in (("5", "6"), ("4", "3")):
+        squares.add(to_square[0] + from_square[1])
+    return squares
+
+
+def changed_squares(board: chess.Board, moves) -> dict:
+    """{square: piece symbol, or None if it is empty now} for every square the moves touched"""
+    changed = {}
+    for move in moves:
+        for square_name in touched_squares(move):
+            piece = board.piece_at(chess.parse_square(square_name))
+            changed[square_name] = piece.symbol() if piece else None
+    return changed
+
+
+@timed("apply_move")
+def apply_move(board: chess.Board, uci_move):
+    """Plays the move on the board in place, returns (piece_taken, graveyard_piece, en_passant)"""
+    move = chess.Move.from_uci(uci_move)
+    if move not in board.legal_moves:
+        raise ValueError(f"{uci_move} is not a legal move")
+    en_passant = False
+    piece_taken = None
+    graveyard_piece = None
+    if board.is_capture(move):
+        piece_location = move.to_square
+        if board.is_en_passant(move):
+            en_passant = True
+            file = chess.square_file(move.to_square)
+            rank = chess.square_rank(move.from_square)
+            piece_location = file + (8 * rank)
+        graveyard_piece = board.piece_at(piece_location).symbol()
+        piece_taken = {graveyard_piece: [chess.square_name(piece_location)]}
+    board.push(move)
+    return piece_taken, graveyard_piece, en_passant
+
+
+def ply_record(board: chess.Board, piece_taken=None) -> dict:
+    """What the history keeps of the move just played on the board: SAN, UCI and
+    the FEN it led to, plus what it captured"""
+    move = board.pop()
+    san = board.san(move)
+    board.push(move)
+    record = {"san": san, "uci": move.uci(), "fen": board.fen()}
+    if piece_taken:
+        record["piece_taken"] = piece_taken
+    return record
+
+
+def replay_plies(board: chess.Board, moves):
+    """ply_record of each move played from the board's position, the board ends up
+    after the last of them"""
+    for uci_move in moves:
+        piece_taken, _, _ = apply_move(board, uci_move)
+        yield ply_record(board, piece_taken)
+
+
+def pgn_movetext(records, first_ply=1):
+    """The PGN tokens ("1.", "e4", "e5", ...) of consecutive ply_records, the first
+    one being ply first_ply"""
+    for ply, record in enumerate(records, first_ply):
+        if ply % 2 == 1:
+            yield f"{(ply + 1) // 2}."
+        elif ply == first_ply:
+            # starts in the middle of a move, PGN numbers black's half on its own
+            yield f"{ply // 2}..."
+        yield record["san"]
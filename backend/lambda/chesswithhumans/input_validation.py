@@ -1,37 +1,90 @@
 import re
+from . import words_ids
+from .instrumentation import timed
 
-FLOAT_REGEX = "^[\\-]{0,1}\\d*[\\.]{0,1}\\d+$"
-WORD_ID_REGEX = "[a-z]+\\-[a-z]+\\-[a-z]+"
-LETTER_ID_REGEX = "[a-zA-Z0-9]{32}"
-ASCII_REGEX = "[\u0020-\u007e]+"
+# Compiled once, and matched against the whole value, a prefix is not enough
+FLOAT_REGEX = re.compile("[\\-]{0,1}\\d*[\\.]{0,1}\\d+")
+WORD_ID_REGEX = re.compile("([a-z]+)\\-([a-z]+)\\-([a-z]+)")
+# letter_ids.generate_id() makes 64 letters, the pattern always allowed 32 or more
+LETTER_ID_REGEX = re.compile("[a-zA-Z0-9]{32,64}")
+ASCII_REGEX = re.compile("[\u0020-\u007e]+")
+WORDS = frozenset(words_ids.words)
 
 
 def validate_move(value):
-    if isinstance(value, str) and re.match(ASCII_REGEX, value):
+    if isinstance(value, str) and ASCII_REGEX.fullmatch(value):
         return value
     return None
 
 
 def validate_word_id(value):
-    if isinstance(value, str) and re.match(WORD_ID_REGEX, value):
+    if not isinstance(value, str):
+        return None
+    match = WORD_ID_REGEX.fullmatch(value)
+    if match and all(word in WORDS for word in match.groups()):
         return value
     return None
 
 
 def validate_username(value):
-    if isinstance(value, str) and re.match(ASCII_REGEX, value):
+    if isinstance(value, str) and ASCII_REGEX.fullmatch(value):
         return value
     return None
 
 
 def validate_letter_id(value):
-    if isinstance(value, str) and re.match(LETTER_ID_REGEX, value):
+    if isinstance(value, str) and LETTER_ID_REGEX.fullmatch(value):
+        return value
+    return None
+
+
+MAX_GAMES_PER_BATCH = 200
+
+
+def validate_game_count(value):
+    if isinstance(value, int) and not isinstance(value, bool) and 1 <= value <= MAX_GAMES_PER_BATCH:
+        return value
+    return None
+
+
+MAX_HISTORY_PLIES = 100
+
+
+def validate_history_count(value):
+    if isinstance(value, int) and not isinstance(value, bool) and 1 <= value <= MAX_HISTORY_PLIES:
+        return value
+    return None
+
+
+def validate_version(value):
+    # returned as a string like validate_decimal does, version 0 would read as invalid
+    if isinstance(value, int) and not isinstance(value, bool) and value >= 0:
+        return str(value)
+    if isinstance(value, str) and value.isdigit() and len(value) <= 9:
+        return value
+    return None
+
+
+# full: pieces by symbol and UCI legal moves, compact: the FEN and legal moves
+# packed by the square they start from
+WIRE_FORMATS = ("full", "compact")
+
+
+def validate_wire_format(value):
+    if value in WIRE_FORMATS:
+        return value
+    return None
+
+
+def validate_true(value):
+    # a flag that is only ever sent as true
+    if value is True:
         return value
     return None
 
 
 def validate_decimal(value):
-    if isinstance(value, str) and re.match(FLOAT_REGEX, value):
+    if isinstance(value, str) and FLOAT_REGEX.fullmatch(value):
         return value
     elif isinstance(value, float):
         return str(value)
@@ -94,6 +147,55 @@ def validate_schema(value, schema):
     return None
 
 
+def compile_schema(schema):
+    """Turns a schema into a function that returns what validate_schema(value, schema)
+    would, without walking the schema dicts on every request"""
+    return timed("validate")(_compile_schema(schema))
+
+
+def _compile_schema(schema):
+    if schema["type"] == list:
+        validate_element = _compile_schema(schema["elements"])
+
+        def validate_list(value):
+            if not isinstance(value, list):
+                return None
+            output = []
+            for value_item in value:
+                result = validate_element(value_item)
+                if not result:
+                    return None
+                output.append(result)
+            return output
+
+        return validate_list
+    if schema["type"] == dict:
+        fields = tuple(
+            (field["name"], bool(field.get("optional")), _compile_schema(field)) for field in schema["fields"]
+        )
+
+        def validate_dict(value):
+            if not isinstance(value, dict):
+                return None
+            output = {}
+            for name, optional, validate_field in fields:
+                if name not in value:
+                    if optional:
+                        continue
+                    return None
+                result = validate_field(value[name])
+                if not result:
+                    return None
+                output[name] = result
+            return output
+
+        return validate_dict
+    if callable(schema["type"]):
+        validate_value = schema["type"]
+        return lambda value: validate_value(value) or None
+    return lambda value: None
+
+
 LOCATION_SHARING_SCHEMA = {
     "type": dict,
     "fields": [
@@ -0,0 +1,114 @@
+import json
+import os
+import random
+import time
+from contextvars import ContextVar
+from functools import wraps
+
+# Per-phase timings of an invocation (parse body, validate, each DynamoDB and
+# API Gateway call, board loading, legal moves, serializing), printed as one
+# CloudWatch embedded metric format line for a sample of the invocations, so
+# CloudWatch turns them into metrics per route without any extra API call.
+# Invocations that are not sampled only pay for a ContextVar lookup per phase.
+#
+# see https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/CloudWatch_Embedded_Metric_Format_Specification.html
+TIMING_SAMPLE_RATE = float(os.environ.get("TIMING_SAMPLE_RATE", "0.05"))
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "ChessWithHumans")
+
+_current = ContextVar("invocation_timings", default=None)
+
+
+class Timings:
+    def __init__(self, route_name):
+        self.route_name = route_name
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.values = {}
+
+    def add(self, phase_name, seconds):
+        self.phases[phase_name] = self.phases.get(phase_name, 0) + seconds * 1000
+
+
+def route_name_of(event):
+    if "broadcast" in event:
+        return "broadcast"
+    if "Records" in event:
+        return "stream"
+    if "requestContext" in event and "routeKey" in event["requestContext"]:
+        return event["requestContext"]["routeKey"]
+    return event.get("path") or "unknown"
+
+
+def start_invocation(event, sample_rate=None):
+    """Starts measuring this invocation if it is sampled, returns the token finish_invocation needs"""
+    if sample_rate is None:
+        sample_rate = TIMING_SAMPLE_RATE
+    if sample_rate <= 0 or random.random() >= sample_rate:
+        return _current.set(None)
+    timings = Timings(route_name_of(event))
+    body = event.get("body")
+    timings.values["request_bytes"] = len(body) if isinstance(body, str) else 0
+    return _current.set(timings)
+
+
+def is_sampled():
+    return _current.get() is not None
+
+
+def timed(phase_name):
+    """Decorator adding the time spent in the function to the given phase"""
+
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            timings = _current.get()
+            if timings is None:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                timings.add(phase_name, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def unit_of(metric_name):
+    if metric_name.endswith("_ms"):
+        return "Milliseconds"
+    if metric_name.endswith("_bytes"):
+        return "Bytes"
+    return "Count"
+
+
+def finish_invocation(token, result=None, **properties):
+    timings = _current.get()
+    _current.reset(token)
+    if timings is None:
+        return None
+    total_ms = (time.perf_counter() - timings.start) * 1000
+    metrics = {"total_ms": round(total_ms, 3)}
+    metrics.update({f"{name}_ms": round(value, 3) for name, value in timings.phases.items()})
+    metrics.update(timings.values)
+    if isinstance(result, dict):
+        metrics["response_bytes"] = len(result.get("body") or "")
+        properties.setdefault("status", result.get("statusCode"))
+    line = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [["route"]],
+                    "Metrics": [{"Name": name, "Unit": unit_of(name)} for name in metrics],
+                }
+            ],
+        },
+        "route": timings.route_name,
+        **metrics,
+        **properties,
+    }
+    print(json.dumps(line))
+    return line
@@ -0,0 +1,829 @@
+import copy
+import io
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from functools import cache
+
+# In-process stand-ins for the DynamoDB, API Gateway management, Lambda and S3
+# clients in utils.py, so the routes can be exercised (benchmarks, local runs)
+# without AWS. They only understand the calls the routes actually make. All but
+# FakeLambda can add latency to every call, FakeDynamo can also throttle a share
+# of the calls and keeps count of the capacity units DynamoDB would have charged.
+# MemoryTable is the table of the self-hosted server (server.py --store memory),
+# none of that, just the items.
+
+
+class ClientError(Exception):
+    def __init__(self, code, message=""):
+        super().__init__(f"{code}: {message}")
+        self.response = {"Error": {"Code": code, "Message": message}}
+
+
+class _ConditionalCheckFailedException(ClientError):
+    def __init__(self):
+        super().__init__("ConditionalCheckFailedException", "The conditional request failed")
+
+
+class _TransactionCanceledException(ClientError):
+    def __init__(self, reasons):
+        super().__init__("TransactionCanceledException", "Transaction cancelled")
+        self.response["CancellationReasons"] = reasons
+
+
+class _ProvisionedThroughputExceededException(ClientError):
+    def __init__(self):
+        super().__init__("ProvisionedThroughputExceededException", "Throttled by the stand-in")
+
+
+class _DynamoExceptions:
+    ConditionalCheckFailedException = _ConditionalCheckFailedException
+    TransactionCanceledException = _TransactionCanceledException
+    ProvisionedThroughputExceededException = _ProvisionedThroughputExceededException
+
+
+@cache
+def _dynamo_types():
+    # imported on first use like in utils.py, so cold start measurements stay honest
+    from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+    return TypeDeserializer(), TypeSerializer()
+
+
+def _deserialize(value):
+    return _dynamo_types()[0].deserialize(value)
+
+
+def _serialize(value):
+    return _dynamo_types()[1].serialize(value)
+
+
+_MISSING = object()
+
+
+def _value_size(value):
+    ((kind, data),) = value.items()
+    if kind == "S":
+        return len(data.encode("utf-8"))
+    if kind == "B":
+        return len(data)
+    if kind == "N":
+        return len(data.lstrip("-").replace(".", "").lstrip("0")) // 2 + 1
+    if kind in ("BOOL", "NULL"):
+        return 1
+    if kind == "L":
+        return 3 + sum(_value_size(element) + 1 for element in data)
+    if kind == "M":
+        return 3 + sum(len(name.encode("utf-8")) + _value_size(element) + 1 for name, element in data.items())
+    return sum(_value_size({kind[0]: element}) for element in data)
+
+
+def item_size(item):
+    """Bytes DynamoDB would bill for the item, close enough for capacity estimates"""
+    return sum(len(name.encode("utf-8")) + _value_size(value) for name, value in item.items())
+
+
+def _split_top_level(text, separator=","):
+    parts, depth, current = [], 0, ""
+    for char in text:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        if char == separator and depth == 0:
+            parts.append(current.strip())
+            current = ""
+        else:
+            current += char
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+class _Expression:
+    """Just enough of the DynamoDB expression language for what the routes send"""
+
+    def __init__(self, item, names, values):
+        self.item = item
+        self.names = names or {}
+        self.values = {k: _deserialize(v) for k, v in (values or {}).items()}
+
+    def path(self, text):
+        return [self.names.get(part, part) for part in text.strip().split(".")]
+
+    def lookup(self, path):
+        value = self.item
+        for part in path:
+            if not isinstance(value, dict) or part not in value:
+                return _MISSING
+            value = value[part]
+        return value
+
+    def assign(self, path, value):
+        target = self.item
+        for part in path[:-1]:
+            target = target[part]
+        target[path[-1]] = value
+
+    def remove(self, path):
+        target = self.lookup(path[:-1]) if len(path) > 1 else self.item
+        if isinstance(target, dict):
+            target.pop(path[-1], None)
+
+    def operand(self, text):
+        text = text.strip()
+        for operator in ("+", "-"):
+            parts = _split_top_level(text, operator)
+            if len(parts) == 2:
+                left, right = self.operand(parts[0]), self.operand(parts[1])
+                return left + right if operator == "+" else left - right
+        match = re.fullmatch(r"(\w+)\((.*)\)", text)
+        if match:
+            function, arguments = match.group(1), _split_top_level(match.group(2))
+            if function == "if_not_exists":
+                value = self.lookup(self.path(arguments[0]))
+                return self.operand(arguments[1]) if value is _MISSING else value
+            if function == "list_append":
+                return list(self.operand(arguments[0])) + list(self.operand(arguments[1]))
+            if function == "size":
+                return len(self.operand(arguments[0]))
+            raise ValueError(f"Unsupported function {function}")
+        if text.startswith(":"):
+            return copy.deepcopy(self.values[text])
+        return self.lookup(self.path(text))
+
+    def update(self, expression):
+        clauses = re.split(r"\b(SET|REMOVE|ADD)\b", expression)
+        for keyword, body in zip(clauses[1::2], clauses[2::2]):
+            for action in _split_top_level(body):
+                if keyword == "SET":
+                    target, value = action.split("=", 1)
+                    self.assign(self.path(target), self.operand(value))
+                elif keyword == "REMOVE":
+                    self.remove(self.path(action))
+                elif keyword == "ADD":
+                    target, value = action.split()
+                    current = self.lookup(self.path(target))
+                    self.assign(self.path(target), (0 if current is _MISSING else current) + self.operand(value))
+
+    def condition(self, expression):
+        if not expression:
+            return True
+        return any(
+            all(self.comparison(part) for part in re.split(r"\s+AND\s+", alternative))
+            for alternative in re.split(r"\s+OR\s+", expression)
+        )
+
+    def comparison(self, text):
+        text = text.strip()
+        negate = text.startswith("NOT ")
+        if negate:
+            text = text[4:].strip()
+        match = re.fullmatch(r"attribute_(not_)?exists\((.*)\)", text)
+        if match:
+            exists = self.lookup(self.path(match.group(2))) is not _MISSING
+            result = not exists if match.group(1) else exists
+        else:
+            left, operator, right = re.fullmatch(r"(.+?)\s*(<>|<=|>=|=|<|>)\s*(.+)", text).groups()
+            left, right = self.operand(left), self.operand(right)
+            if left is _MISSING or right is _MISSING:
+                result = operator == "<>"
+            else:
+                result = {
+                    "=": left == right,
+                    "<>": left != right,
+                    "<": left < right,
+                    "<=": left <= right,
+                    ">": left > right,
+                    ">=": left >= right,
+                }[operator]
+        return not result if negate else result
+
+
+def _key_condition(expression, values):
+    """(partition key, test of a sort key) of a KeyConditionExpression"""
+    python_values = {k: _deserialize(v) for k, v in values.items()}
+    partition, _, sort_condition = expression.partition(" AND ")
+    partition_key = python_values[partition.split("=")[1].strip()]
+    sort_condition = sort_condition.strip()
+
+    def sort_key_matches(sort_key):
+        if not sort_condition:
+            return True
+        match = re.fullmatch(r"key2\s+BETWEEN\s+(:\w+)\s+AND\s+(:\w+)", sort_condition)
+        if match:
+            return python_values[match.group(1)] <= sort_key <= python_values[match.group(2)]
+        match = re.fullmatch(r"begins_with\(key2,\s*(:\w+)\)", sort_condition)
+        if match:
+            return sort_key.startswith(python_values[match.group(1)])
+        operator, value = re.fullmatch(r"key2\s*(<=|>=|=|<|>)\s*(:\w+)", sort_condition).groups()
+        return _Expression({"key2": sort_key}, None, values).comparison(f"key2 {operator} {value}")
+
+    return partition_key, sort_key_matches
+
+
+def _query_page(sort_keys, scan_index_forward, limit, exclusive_start_key):
+    """The sort keys of the page a query asks for, and whether there are more"""
+    sort_keys = sorted(sort_keys, reverse=not scan_index_forward)
+    if exclusive_start_key:
+        start = exclusive_start_key["key2"]["S"]
+        sort_keys = [key for key in sort_keys if (key > start) == scan_index_forward and key != start]
+    page = sort_keys[:limit] if limit else sort_keys
+    return page, bool(limit and len(sort_keys) > limit)
+
+
+class _Table:
+    exceptions = _DynamoExceptions
+
+    @staticmethod
+    def _to_python(item):
+        return {k: _deserialize(v) for k, v in item.items()}
+
+    @staticmethod
+    def _to_dynamo(item):
+        return {k: _serialize(v) for k, v in item.items()}
+
+    @staticmethod
+    def _key(key):
+        return key["key1"]["S"], key["key2"]["S"]
+
+    @staticmethod
+    def _ok(**kwargs):
+        return {"ResponseMetadata": {"HTTPStatusCode": 200}, **kwargs}
+
+    @staticmethod
+    def _project(item, projection, names):
+        attributes = [attribute.strip() for attribute in projection.split(",")]
+        attributes = [(names or {}).get(attribute, attribute) for attribute in attributes]
+        return {k: v for k, v in item.items() if k in attributes}
+
+
+class FakeDynamo(_Table):
+    def __init__(self, latency_seconds=0.0, latency_jitter_seconds=0.0, throttle_rate=0.0, seed=None):
+        self.items = {}
+        self.latency_seconds = latency_seconds
+        self.latency_jitter_seconds = latency_jitter_seconds
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.throttled = 0
+        self.read_units = 0.0
+        self.write_units = 0.0
+
+    def _wait(self, operation, throttle=True):
+        delay = self.latency_seconds + self.random.uniform(0, self.latency_jitter_seconds)
+        if delay:
+            time.sleep(delay)
+        with self.lock:
+            self.calls[operation] += 1
+            if throttle and self.throttle_rate and self.random.random() < self.throttle_rate:
+                self.throttled += 1
+                raise _ProvisionedThroughputExceededException()
+
+    def _read(self, size, consistent):
+        # 4 KB per read unit, eventually consistent reads cost half
+        self.read_units += max(1, math.ceil(size / 4096)) * (1.0 if consistent else 0.5)
+
+    def _write(self, *items, factor=1):
+        # 1 KB per write unit, an update pays for the bigger of before and after
+        size = max(item_size(item) if item else 0 for item in items)
+        self.write_units += max(1, math.ceil(size / 1024)) * factor
+
+    def capacity(self):
+        return {
+            "read_units": self.read_units,
+            "write_units": self.write_units,
+            "calls": dict(self.calls),
+            "throttled": self.throttled,
+        }
+
+    def get_item(
+        self,
+        TableName,
+        Key,
+        ProjectionExpression=None,
+        ExpressionAttributeNames=None,
+        ConsistentRead=False,
+        **kwargs,
+    ):
+        self._wait("get_item")
+        with self.lock:
+            item = self.items.get(self._key(Key))
+            # a projection does not make the read any cheaper, the whole item is billed
+            self._read(item_size(item) if item else 0, ConsistentRead)
+            if item is None:
+                return self._ok()
+            if ProjectionExpression:
+                item = self._project(item, ProjectionExpression, ExpressionAttributeNames)
+            return self._ok(Item=copy.deepcopy(item))
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        """Throttling here leaves keys in UnprocessedKeys instead of failing the call,
+        like DynamoDB does when only part of a batch is throttled"""
+        self._wait("batch_get_item", throttle=False)
+        responses = {}
+        unprocessed = {}
+        with self.lock:
+            for table_name, request in RequestItems.items():
+                keys = [self._key(key) for key in request["Keys"]]
+                if len(keys) > 100 or len(set(keys)) != len(keys):
+                    raise ClientError("ValidationException", "Too many items requested, or duplicate keys")
+                responses[table_name] = []
+                for key, dynamo_key in zip(keys, request["Keys"]):
+                    if self.throttle_rate and self.random.random() < self.throttle_rate:
+                        self.throttled += 1
+                        unprocessed.setdefault(table_name, {**request, "Keys": []})["Keys"].append(dynamo_key)
+                        continue
+                    item = self.items.get(key)
+                    self._read(item_size(item) if item else 0, request.get("ConsistentRead", False))
+                    if item is None:
+                        continue
+                    if request.get("ProjectionExpression"):
+                        item = self._project(
+                            item, request["ProjectionExpression"], request.get("ExpressionAttributeNames")
+                        )
+                    responses[table_name].append(copy.deepcopy(item))
+        return self._ok(Responses=responses, UnprocessedKeys=unprocessed)
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        """Puts and deletes, throttled ones are left in UnprocessedItems"""
+        self._wait("batch_write_item", throttle=False)
+        unprocessed = {}
+        with self.lock:
+            for table_name, requests in RequestItems.items():
+                if len(requests) > 25:
+                    raise ClientError("ValidationException", "Too many items requested")
+                for request in requests:
+                    if self.throttle_rate and self.random.random() < self.throttle_rate:
+                        self.throttled += 1
+                        unprocessed.setdefault(table_name, []).append(request)
+                        continue
+                    if "PutRequest" in request:
+                        item = request["PutRequest"]["Item"]
+                        self._write(self.items.get(self._key(item)), item)
+                        self.items[self._key(item)] = copy.deepcopy(item)
+                    else:
+                        self._write(self.items.pop(self._key(request["DeleteRequest"]["Key"]), None))
+        return self._ok(UnprocessedItems=unprocessed)
+
+    def put_item(
+        self,
+        TableName,
+        Item,
+        ConditionExpression=None,
+        ExpressionAttributeNames=None,
+        ExpressionAttributeValues=None,
+        **kwargs,
+    ):
+        self._wait("put_item")
+        with self.lock:
+            existing = self.items.get(self._key(Item), {})
+            self._write(existing, Item)
+            expression = _Expression(self._to_python(existing), ExpressionAttributeNames, ExpressionAttributeValues)
+            if not expression.condition(ConditionExpression):
+                raise _ConditionalCheckFailedException()
+            self.items[self._key(Item)] = copy.deepcopy(Item)
+            return self._ok()
+
+    def transact_write_items(self, TransactItems, **kwargs):
+        self._wait("transact_write_items")
+        with self.lock:
+            reasons = []
+            for transact_item in TransactItems:
+                ((action, request),) = transact_item.items()
+                key = request["Item"] if action == "Put" else request["Key"]
+                existing = self.items.get(self._key(key), {})
+                # transactions cost twice as much
+                self._write(existing, request.get("Item"), factor=2)
+                expression = _Expression(
+                    self._to_python(existing),
+                    request.get("ExpressionAttributeNames"),
+                    request.get("ExpressionAttributeValues"),
+                )
+                passed = expression.condition(request.get("ConditionExpression"))
+                reasons.append({"Code": "None" if passed else "ConditionalCheckFailed"})
+            if any(reason["Code"] != "None" for reason in reasons):
+                raise _TransactionCanceledException(reasons)
+            for transact_item in TransactItems:
+                ((action, request),) = transact_item.items()
+                if action == "Put":
+                    self.items[self._key(request["Item"])] = copy.deepcopy(request["Item"])
+                elif action == "Delete":
+                    self.items.pop(self._key(request["Key"]), None)
+            return self._ok()
+
+    def delete_item(self, TableName, Key, **kwargs):
+        self._wait("delete_item")
+        with self.lock:
+            self._write(self.items.pop(self._key(Key), None))
+            return self._ok()
+
+    def query(
+        self,
+        TableName,
+        KeyConditionExpression,
+        ExpressionAttributeValues,
+        ExpressionAttributeNames=None,
+        ProjectionExpression=None,
+        ScanIndexForward=True,
+        Limit=None,
+        ExclusiveStartKey=None,
+        ConsistentRead=False,
+        **kwargs,
+    ):
+        self._wait("query")
+        partition_key, sort_key_matches = _key_condition(KeyConditionExpression, ExpressionAttributeValues)
+        with self.lock:
+            page, more = _query_page(
+                (key[1] for key in self.items if key[0] == partition_key and sort_key_matches(key[1])),
+                ScanIndexForward,
+                Limit,
+                ExclusiveStartKey,
+            )
+            items = [self.items[(partition_key, sort_key)] for sort_key in page]
+            self._read(sum(item_size(item) for item in items), ConsistentRead)
+            if ProjectionExpression:
+                items = [self._project(item, ProjectionExpression, ExpressionAttributeNames) for item in items]
+            response = self._ok(Items=copy.deepcopy(items), Count=len(items))
+            if more:
+                response["LastEvaluatedKey"] = {"key1": {"S": partition_key}, "key2": {"S": page[-1]}}
+            return response
+
+    def update_item(
+        self,
+        TableName,
+        Key,
+        UpdateExpression,
+        ConditionExpression=None,
+        ExpressionAttributeNames=None,
+        ExpressionAttributeValues=None,
+        ReturnValues="NONE",
+        **kwargs,
+    ):
+        self._wait("update_item")
+        with self.lock:
+            existing = self.items.get(self._key(Key))
+            old_item = self._to_python(existing) if existing else {}
+            expression = _Expression(copy.deepcopy(old_item), ExpressionAttributeNames, ExpressionAttributeValues)
+            if not expression.condition(ConditionExpression):
+                self._write(existing)
+                raise _ConditionalCheckFailedException()
+            if not existing:
+                expression.item.update(self._to_python(Key))
+            expression.update(UpdateExpression)
+            self.items[self._key(Key)] = self._to_dynamo(expression.item)
+            self._write(existing, self.items[self._key(Key)])
+            if ReturnValues == "ALL_NEW":
+                return self._ok(Attributes=self._to_dynamo(expression.item))
+            if ReturnValues == "ALL_OLD" and existing:
+                return self._ok(Attributes=copy.deepcopy(existing))
+            return self._ok()
+
+
+LOCK_STRIPES = 64
+
+
+def _expired(item, now):
+    return "expiration" in item and int(item["expiration"].get("N", now + 1)) < now
+
+
+class MemoryTable(_Table):
+    """Items by partition key, then sort key, so a get is two dict lookups and a
+    query only reads its own partition. A write holds the one of LOCK_STRIPES
+    locks its key falls on, so games do not wait on each other, and self.lock
+    only while it adds the item to its partition or takes it out. Items are
+    replaced, never changed in place, so reads take no lock and stored items are
+    handed out without copying the values in them (the routes never change those)."""
+
+    def __init__(self):
+        self.partitions = {}
+        self.lock = threading.Lock()
+        self.item_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+    def _item_lock(self, key):
+        return self.item_locks[hash(key) % LOCK_STRIPES]
+
+    def _get(self, key):
+        partition = self.partitions.get(key[0])
+        return partition.get(key[1]) if partition else None
+
+    def _set(self, key, item):
+        """Stores the item under key, or removes what is there for None"""
+        with self.lock:
+            if item is not None:
+                self.partitions.setdefault(key[0], {})[key[1]] = item
+                return
+            partition = self.partitions.get(key[0])
+            if partition is not None:
+                partition.pop(key[1], None)
+                if not partition:
+                    del self.partitions[key[0]]
+
+    def _read(self, item, projection, names):
+        if projection:
+            return self._project(item, projection, names)
+        return dict(item)
+
+    def get_item(self, TableName, Key, ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+        item = self._get(self._key(Key))
+        if item is None:
+            return self._ok()
+        return self._ok(Item=self._read(item, ProjectionExpression, ExpressionAttributeNames))
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        responses = {}
+        for table_name, request in RequestItems.items():
+            keys = [self._key(key) for key in request["Keys"]]
+            if len(keys) > 100 or len(set(keys)) != len(keys):
+                raise ClientError("ValidationException", "Too many items requested, or duplicate keys")
+            items = (self._get(key) for key in keys)
+            responses[table_name] = [
+                self._read(item, request.get("ProjectionExpression"), request.get("ExpressionAttributeNames"))
+                for item in items
+                if item is not None
+            ]
+        return self._ok(Responses=responses, UnprocessedKeys={})
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        for table_name, requests in RequestItems.items():
+            if len(requests) > 25:
+                raise ClientError("ValidationException", "Too many items requested")
+            for request in requests:
+                if "PutRequest" in request:
+                    item = request["PutRequest"]["Item"]
+                    with self._item_lock(self._key(item)):
+                        self._set(self._key(item), dict(item))
+                else:
+                    key = self._key(request["DeleteRequest"]["Key"])
+                    with self._item_lock(key):
+                        self._set(key, None)
+        return self._ok(UnprocessedItems={})
+
+    def put_item(
+        self,
+        TableName,
+        Item,
+        ConditionExpression=None,
+        ExpressionAttributeNames=None,
+        ExpressionAttributeValues=None,
+        **kwargs,
+    ):
+        key = self._key(Item)
+        with self._item_lock(key):
+            if ConditionExpression:
+                existing = self._get(key) or {}
+                expression = _Expression(self._to_python(existing), ExpressionAttributeNames, ExpressionAttributeValues)
+                if not expression.condition(ConditionExpression):
+                    raise _ConditionalCheckFailedException()
+            self._set(key, dict(Item))
+        return self._ok()
+
+    def transact_write_items(self, TransactItems, **kwargs):
+        actions = []
+        for transact_item in TransactItems:
+            ((action, request),) = transact_item.items()
+            actions.append((action, request, self._key(request["Item"] if action == "Put" else request["Key"])))
+        # every lock the transaction needs, always in the same order
+        locks = [self.item_locks[index] for index in sorted({hash(key) % LOCK_STRIPES for _, _, key in actions})]
+        for lock in locks:
+            lock.acquire()
+        try:
+            reasons = []
+            for _, request, key in actions:
+                passed = True
+                if request.get("ConditionExpression"):
+                    expression = _Expression(
+                        self._to_python(self._get(key) or {}),
+                        request.get("ExpressionAttributeNames"),
+                        request.get("ExpressionAttributeValues"),
+                    )
+                    passed = expression.condition(request["ConditionExpression"])
+                reasons.append({"Code": "None" if passed else "ConditionalCheckFailed"})
+            if any(reason["Code"] != "None" for reason in reasons):
+                raise _TransactionCanceledException(reasons)
+            for action, request, key in actions:
+                if action == "Put":
+                    self._set(key, dict(request["Item"]))
+                elif action == "Delete":
+                    self._set(key, None)
+        finally:
+            for lock in locks:
+                lock.release()
+        return self._ok()
+
+    def delete_item(self, TableName, Key, **kwargs):
+        key = self._key(Key)
+        with self._item_lock(key):
+            self._set(key, None)
+        return self._ok()
+
+    def query(
+        self,
+        TableName,
+        KeyConditionExpression,
+        ExpressionAttributeValues,
+        ExpressionAttributeNames=None,
+        ProjectionExpression=None,
+        ScanIndexForward=True,
+        Limit=None,
+        ExclusiveStartKey=None,
+        **kwargs,
+    ):
+        partition_key, sort_key_matches = _key_condition(KeyConditionExpression, ExpressionAttributeValues)
+        with self.lock:
+            partition = self.partitions.get(partition_key, {})
+            sort_keys = list(partition)
+        page, more = _query_page(
+            (sort_key for sort_key in sort_keys if sort_key_matches(sort_key)),
+            ScanIndexForward,
+            Limit,
+            ExclusiveStartKey,
+        )
+        items = (partition.get(sort_key) for sort_key in page)
+        items = [self._read(item, ProjectionExpression, ExpressionAttributeNames) for item in items if item is not None]
+        response = self._ok(Items=items, Count=len(items))
+        if more:
+            response["LastEvaluatedKey"] = {"key1": {"S": partition_key}, "key2": {"S": page[-1]}}
+        return response
+
+    def update_item(
+        self,
+        TableName,
+        Key,
+        UpdateExpression,
+        ConditionExpression=None,
+        ExpressionAttributeNames=None,
+        ExpressionAttributeValues=None,
+        ReturnValues="NONE",
+        **kwargs,
+    ):
+        key = self._key(Key)
+        with self._item_lock(key):
+            existing = self._get(key)
+            expression = _Expression(
+                self._to_python(existing) if existing else {}, ExpressionAttributeNames, ExpressionAttributeValues
+            )
+            if not expression.condition(ConditionExpression):
+                raise _ConditionalCheckFailedException()
+            if not existing:
+                expression.item.update(self._to_python(Key))
+            expression.update(UpdateExpression)
+            item = self._to_dynamo(expression.item)
+            self._set(key, item)
+        if ReturnValues == "ALL_NEW":
+            return self._ok(Attributes=dict(item))
+        if ReturnValues == "ALL_OLD" and existing:
+            return self._ok(Attributes=dict(existing))
+        return self._ok()
+
+    def dump(self):
+        """Every item, for a snapshot"""
+        with self.lock:
+            return [item for partition in self.partitions.values() for item in partition.values()]
+
+    def load(self, items):
+        partitions = {}
+        for item in items:
+            partitions.setdefault(item["key1"]["S"], {})[item["key2"]["S"]] = item
+        with self.lock:
+            self.partitions = partitions
+
+    def expire(self, now):
+        """Takes out the items past their expiration like TTL would, returns them"""
+        with self.lock:
+            keys = [
+                (key1, key2)
+                for key1, partition in self.partitions.items()
+                for key2, item in partition.items()
+                if _expired(item, now)
+            ]
+        removed = []
+        for key in keys:
+            with self._item_lock(key):
+                # unless a write moved the expiration in the meantime
+                item = self._get(key)
+                if item is not None and _expired(item, now):
+                    self._set(key, None)
+                    removed.append(item)
+        return removed
+
+
+class _GoneException(ClientError):
+    def __init__(self, connection_id):
+        super().__init__("GoneException", f"{connection_id} is gone")
+
+
+class _ApiGatewayExceptions:
+    GoneException = _GoneException
+
+
+class FakeApiGateway:
+    exceptions = _ApiGatewayExceptions
+
+    def __init__(self, latency_seconds=0.0):
+        self.connections = set()
+        self.sent = []
+        self.latency_seconds = latency_seconds
+
+    def post_to_connection(self, ConnectionId, Data):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        if ConnectionId not in self.connections:
+            raise _GoneException(ConnectionId)
+        self.sent.append((ConnectionId, Data))
+        return {"ResponseMetadata": {"HTTPStatusCode": 200}}
+
+
+class FakeLambda:
+    """Runs the handler for invoke, asynchronous ("Event") invocations on a thread
+    of their own like Lambda would, wait() blocks until they are all done. With
+    deferred=True they only start in wait(), so they do not compete for the GIL
+    with the invocation that queued them (in Lambda they run somewhere else)."""
+
+    def __init__(self, handler, deferred=False):
+        self.handler = handler
+        self.deferred = deferred
+        self.threads = []
+        self.invocations = 0
+
+    def invoke(self, FunctionName, Payload, InvocationType="RequestResponse", **kwargs):
+        self.invocations += 1
+        event = json.loads(Payload)
+        if InvocationType == "Event":
+            thread = threading.Thread(target=self.handler, args=(event, None))
+            if not self.deferred:
+                thread.start()
+            self.threads.append(thread)
+            return {"StatusCode": 202}
+        return {"StatusCode": 200, "Payload": json.dumps(self.handler(event, None))}
+
+    def wait(self):
+        threads, self.threads = self.threads, []
+        if self.deferred:
+            for thread in threads:
+                thread.start()
+        for thread in threads:
+            thread.join()
+
+
+class _NoSuchKey(ClientError):
+    def __init__(self, key):
+        super().__init__("NoSuchKey", f"{key} does not exist")
+
+
+class _S3Exceptions:
+    NoSuchKey = _NoSuchKey
+
+
+class FakeS3:
+    """Objects are kept in memory, or as files under directory/<bucket>/<key>
+    when a directory is given (an archive that outlives the process)"""
+
+    exceptions = _S3Exceptions
+
+    def __init__(self, directory=None, latency_seconds=0.0):
+        self.directory = directory
+        self.latency_seconds = latency_seconds
+        self.objects = {}
+        self.calls = Counter()
+
+    def _wait(self, operation):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        self.calls[operation] += 1
+
+    def _path(self, bucket, key):
+        return os.path.join(self.directory, bucket, *key.split("/"))
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self._wait("put_object")
+        if isinstance(Body, str):
+            Body = Body.encode("utf-8")
+        if self.directory:
+            path = self._path(Bucket, Key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as file:
+                file.write(Body)
+        else:
+            self.objects[(Bucket, Key)] = Body
+        return {"ResponseMetadata": {"HTTPStatusCode": 200}}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self._wait("get_object")
+        if self.directory:
+            try:
+                with open(self._path(Bucket, Key), "rb") as file:
+                    body = file.read()
+            except FileNotFoundError:
+                raise _NoSuchKey(Key)
+        elif (Bucket, Key) in self.objects:
+            body = self.objects[(Bucket, Key)]
+        else:
+            raise _NoSuchKey(Key)
+        return {"Body": io.BytesIO(body), "ContentLength": len(body)}
@@ -0,0 +1,137 @@
+import time
+
+import chess
+from .utils import (
+    dynamo,
+    TABLE_NAME,
+    python_obj_to_dynamo_obj,
+    dynamo_obj_to_python_obj,
+)
+from .game_state import replay_plies
+
+# Every move is also kept as an item of its own, so earlier positions can be
+# paged through without replaying the game:
+#   key1 "plies-<game_id>", key2 ply number ("00001" is the first move)
+#     -> san, uci, the fen after the move, piece_taken if it captured
+# The moves on the game item stay the source of truth. A ply that is missing
+# (writing it failed, or the game is from before the index) is replayed from the
+# closest position the index has the first time it is asked for, and written then.
+#
+# The plies live as long as their game, however long it goes on: they are deleted
+# when the game is archived, or when TTL removes an abandoned game (from its
+# stream record, see archive.py). Their own expiration is only a backstop for a
+# table without the stream, PLY_EXPIRATION_MARGIN past the game's.
+
+PLY_DIGITS = 5
+PLY_PROJECTION = "key2, san, uci, fen, piece_taken"
+PLY_EXPIRATION_MARGIN = 365 * 24 * 60 * 60
+# the most BatchWriteItem takes at once
+DELETE_BATCH_SIZE = 25
+MAX_DELETE_ATTEMPTS = 5
+
+
+def plies_key(game_id):
+    return f"plies-{game_id}"
+
+
+def ply_sort_key(ply):
+    return str(ply).zfill(PLY_DIGITS)
+
+
+def write_ply(game_id, ply, record, expiration):
+    dynamo.put_item(
+        TableName=TABLE_NAME,
+        Item=python_obj_to_dynamo_obj(
+            {
+                "key1": plies_key(game_id),
+                "key2": ply_sort_key(ply),
+                **record,
+                "expiration": expiration + PLY_EXPIRATION_MARGIN,
+            }
+        ),
+    )
+
+
+def delete_plies(game_id):
+    """Deletes the game's ply items, returns how many there were"""
+    keys = []
+    query = {
+        "TableName": TABLE_NAME,
+        "KeyConditionExpression": "key1 = :key1",
+        "ExpressionAttributeValues": python_obj_to_dynamo_obj({":key1": plies_key(game_id)}),
+        "ProjectionExpression": "key1, key2",
+    }
+    while True:
+        response = dynamo.query(**query)
+        keys += response.get("Items", [])
+        if "LastEvaluatedKey" not in response:
+            break
+        query["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    for start in range(0, len(keys), DELETE_BATCH_SIZE):
+        request = {TABLE_NAME: [{"DeleteRequest": {"Key": key}} for key in keys[start : start + DELETE_BATCH_SIZE]]}
+        for attempt in range(MAX_DELETE_ATTEMPTS):
+            if attempt:
+                time.sleep(0.05 * (2 ** (attempt - 1)))
+            request = dynamo.batch_write_item(RequestItems=request).get("UnprocessedItems")
+            if not request:
+                break
+        else:
+            # left for their backstop expiration
+            print(f"Could not delete {len(request[TABLE_NAME])} plies of {game_id}")
+    return len(keys)
+
+
+def read_plies(game_id, first, last):
+    """{ply: record} of the plies from first to last the index has"""
+    records = {}
+    query = {
+        "TableName": TABLE_NAME,
+        "KeyConditionExpression": "key1 = :key1 AND key2 BETWEEN :first AND :last",
+        "ExpressionAttributeValues": python_obj_to_dynamo_obj(
+            {":key1": plies_key(game_id), ":first": ply_sort_key(first), ":last": ply_sort_key(last)}
+        ),
+        "ProjectionExpression": PLY_PROJECTION,
+    }
+    while True:
+        response = dynamo.query(**query)
+        for item in response.get("Items", []):
+            record = dynamo_obj_to_python_obj(item)
+            records[int(record.pop("key2"))] = record
+        if "LastEvaluatedKey" not in response:
+            return records
+        query["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def board_before(game_id, ply, moves, records):
+    if ply == 1:
+        return chess.Board()
+    if ply - 1 in records:
+        return chess.Board(records[ply - 1]["fen"])
+    response = dynamo.get_item(
+        TableName=TABLE_NAME,
+        Key=python_obj_to_dynamo_obj({"key1": plies_key(game_id), "key2": ply_sort_key(ply - 1)}),
+        ProjectionExpression="fen",
+    )
+    if "Item" in response:
+        return chess.Board(dynamo_obj_to_python_obj(response["Item"])["fen"])
+    # nothing to start from, this is a game from before the index
+    board = chess.Board()
+    for move in moves[: ply - 1]:
+        board.push_uci(move)
+    return board
+
+
+def ply_page(game_id, moves, first, last, expiration, write=True):
+    """[{"ply", "san", "uci", "fen", "piece_taken"}] from ply first to last (1 is
+    the first move), filling in the index where it has gaps (only replaying them
+    with write=False, for archived games)"""
+    records = read_plies(game_id, first, last)
+    missing = [ply for ply in range(first, last + 1) if ply not in records]
+    if missing:
+        board = board_before(game_id, missing[0], moves, records)
+        for ply, record in enumerate(replay_plies(board, moves[missing[0] - 1 : last]), missing[0]):
+            if ply not in records:
+                records[ply] = record
+                if write:
+                    write_ply(game_id, ply, record, expiration)
+    return [{"ply": ply, **records[ply]} for ply in range(first, last + 1)]
@@ -0,0 +1,126 @@
+import os
+import threading
+import time
+from collections import deque
+
+# Hints telling the play page when to come back, instead of it reconnecting its
+# socket on a one second timer and closing it after every move, which costs a
+# $connect, a register and a $disconnect invocation per move. Sent with /get,
+# /move, the move pushed to the opponent and the registration event:
+#   expected_wait  seconds until the opponent is expected to move, 0 on your turn
+#   keep_open      keep the socket open across your own turn, the game moves
+#                  quicker than API Gateway closes idle sockets
+#   retry_after    seconds to wait before reconnecting a socket that closed, or
+#                  asking /get again, longer when the opponent is slow and when
+#                  this container is busy
+# No keep_open and no retry_after once the game is archived, nothing will come.
+#
+# The expected wait comes from "moved_at" (when the last move was made) and
+# "move_gap" (a running average of the seconds between moves) on the game item.
+
+# API Gateway closes a socket nobody sent anything on for 10 minutes
+SOCKET_IDLE_SECONDS = 600
+# a game nobody has timed yet (no move, or from before the hints)
+DEFAULT_MOVE_GAP = 30
+# weight of the latest gap in the running average
+MOVE_GAP_WEIGHT = 0.3
+MIN_RETRY_SECONDS = 1
+MAX_RETRY_SECONDS = int(os.environ.get("MAX_RETRY_SECONDS", "900"))
+# above this share of the last LOAD_WINDOW_SECONDS spent handling invocations (on
+# every worker for server.py) the container is busy, and retry_after grows up to
+# MAX_LOAD_SLOWDOWN times
+BUSY_FRACTION = float(os.environ.get("BUSY_FRACTION", "0.7"))
+MAX_LOAD_SLOWDOWN = 4
+LOAD_WINDOW_SECONDS = 10
+
+# replaced by the benchmarks, which run games on a simulated clock
+clock = time.time
+
+
+class LoadMeter:
+    """Share of the last window_seconds this container's invocation slots (one on
+    Lambda, the worker threads of server.py) spent busy, in wall-clock time to the
+    second: an invocation still running counts up to now, one that started before
+    the window only from its start. A container is only kept that busy when
+    requests queue for the whole fleet."""
+
+    def __init__(self, window_seconds=LOAD_WINDOW_SECONDS, capacity=1, clock=time.monotonic):
+        self.window_seconds = window_seconds
+        self.capacity = capacity
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.running = 0
+        self.since = clock()
+        # [second, invocation seconds spent in it], for the seconds of the window
+        self.seconds = deque()
+
+    def _advance(self, now):
+        # the running invocations' time since the last start or finish, second by second
+        start = max(self.since, now - self.window_seconds - 1) if self.running else now
+        while start < now:
+            second = int(start)
+            end = min(now, second + 1)
+            if self.seconds and self.seconds[-1][0] == second:
+                self.seconds[-1][1] += self.running * (end - start)
+            else:
+                self.seconds.append([second, self.running * (end - start)])
+            start = end
+        self.since = now
+        while self.seconds and self.seconds[0][0] <= now - self.window_seconds:
+            self.seconds.popleft()
+
+    def start(self):
+        with self.lock:
+            self._advance(self.clock())
+            self.running += 1
+
+    def finish(self):
+        with self.lock:
+            self._advance(self.clock())
+            self.running -= 1
+
+    def busy_fraction(self):
+        with self.lock:
+            self._advance(self.clock())
+            busy = sum(seconds for _, seconds in self.seconds)
+        return min(1.0, busy / (self.window_seconds * self.capacity))
+
+
+load_meter = LoadMeter()
+
+
+def load_slowdown(busy_fraction):
+    if busy_fraction <= BUSY_FRACTION:
+        return 1.0
+    return 1.0 + (MAX_LOAD_SLOWDOWN - 1) * (busy_fraction - BUSY_FRACTION) / (1.0 - BUSY_FRACTION)
+
+
+def time_move(previous_data, game_data):
+    """Sets moved_at and move_gap on the game_data of a move"""
+    now = int(clock())
+    if "moved_at" in previous_data:
+        gap = max(0, now - int(previous_data["moved_at"]))
+        average = previous_data.get("move_gap")
+        if average is not None:
+            gap = MOVE_GAP_WEIGHT * gap + (1 - MOVE_GAP_WEIGHT) * float(average)
+        game_data["move_gap"] = int(round(gap))
+    game_data["moved_at"] = now
+
+
+def pacing_hints(game_data, player_id):
+    """{"expected_wait", "keep_open", "retry_after"} for the player, from the game
+    item (or the projection of it with whose_turn, moved_at, move_gap, archived)"""
+    if game_data.get("archived"):
+        return {"expected_wait": 0, "keep_open": False, "retry_after": None}
+    move_gap = float(game_data.get("move_gap", DEFAULT_MOVE_GAP))
+    if int(game_data.get("whose_turn", 1)) == player_id:
+        expected_wait = 0
+    else:
+        waited = max(0.0, clock() - float(game_data.get("moved_at", clock())))
+        # an opponent away for longer than usual is likely to stay away a while more
+        expected_wait = max(move_gap - waited, waited / 2)
+    # a whole round, this player's move and the opponent's, fits before the idle timeout
+    keep_open = 2 * move_gap < SOCKET_IDLE_SECONDS
+    retry_after = min(MAX_RETRY_SECONDS, max(MIN_RETRY_SECONDS, expected_wait / 4))
+    retry_after = min(MAX_RETRY_SECONDS, retry_after * load_slowdown(load_meter.busy_fraction()))
+    return {"expected_wait": int(round(expected_wait)), "keep_open": keep_open, "retry_after": int(round(retry_after))}
@@ -0,0 +1,59 @@
+import os
+import threading
+from collections import OrderedDict
+
+# The pieces, legal moves and check/mate/stalemate flags only depend on the
+# position, and a lot of games go through the same ones (every game starts in
+# the same position, most go through a handful of openings), so they are kept
+# here by position, in module scope like the game cache, and shared by every
+# game the container serves. See game_state.py for the key (the position
+# without the move counters) and what is stored. Locked for the worker threads
+# of server.py, two of them can compute the same position.
+
+POSITION_CACHE_SIZE = int(os.environ.get("POSITION_CACHE_SIZE", "1024"))
+
+
+class PositionCache:
+    def __init__(self, max_entries=POSITION_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, compute):
+        """The cached value for key, or compute() stored under it. The value is
+        shared, callers must not change it."""
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+        value = compute()
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            }
+
+
+position_cache = PositionCache()
@@ -0,0 +1,414 @@
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import signal
+import struct
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+# Serves the same routes as the Lambda from one long-running process, for hosting
+# on a box of its own. HTTP requests and WebSocket connections are taken here
+# (asyncio, standard library only), turned into the events API Gateway would
+# send and handed to lambda_function.lambda_handler on a pool of threads. The
+# sockets are held by this process: posting to a connection writes the frame
+# to it directly instead of going through API Gateway, and a broadcast to
+# spectators runs on the pool instead of invoking the function again. The game
+# cache stays warm for as long as the process runs.
+#
+# --store dynamodb (the default) keeps the games in the table, like the Lambda.
+# --store memory keeps them in this process (MemoryTable from local_aws.py),
+# saved to --snapshot every --snapshot-seconds and when the server stops, and
+# read back from it when it starts. Items past their expiration are dropped like
+# TTL would, and archived like the stream would with --archive-dir.
+#
+#   cd backend/lambda
+#   python -m chesswithhumans.server --port 8080 --store memory --snapshot games.json --archive-dir archive
+#
+# Not included in the Lambda bundle (see build-bundle.sh).
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+MAX_BODY_BYTES = 1024 * 1024
+MAX_MESSAGE_BYTES = 64 * 1024
+# API Gateway picks the route of a socket message by its "action", $default if
+# it is none of these
+SOCKET_ROUTES = ("register",)
+SNAPSHOT_SECONDS = 60
+
+
+class BadRequest(Exception):
+    pass
+
+
+def unmask(payload, mask):
+    if not payload:
+        return payload
+    repeated = (mask * (len(payload) // 4 + 1))[: len(payload)]
+    return (int.from_bytes(payload, "big") ^ int.from_bytes(repeated, "big")).to_bytes(len(payload), "big")
+
+
+def encode_frame(opcode, payload, mask=None):
+    """A single frame, masked with the 4 bytes of mask if given (clients have to)"""
+    header = bytes([0x80 | opcode])
+    mask_bit = 0x80 if mask else 0
+    if len(payload) < 126:
+        header += bytes([mask_bit | len(payload)])
+    elif len(payload) < 1 << 16:
+        header += bytes([mask_bit | 126]) + struct.pack("!H", len(payload))
+    else:
+        header += bytes([mask_bit | 127]) + struct.pack("!Q", len(payload))
+    if mask:
+        return header + mask + unmask(payload, mask)
+    return header + payload
+
+
+async def read_frame(reader):
+    """(fin, opcode, payload) of the next frame"""
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        (length,) = struct.unpack("!H", await reader.readexactly(2))
+    elif length == 127:
+        (length,) = struct.unpack("!Q", await reader.readexactly(8))
+    if length > MAX_MESSAGE_BYTES:
+        raise BadRequest(f"frame of {length} bytes")
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask:
+        payload = unmask(payload, mask)
+    return bool(first & 0x80), first & 0x0F, payload
+
+
+async def read_messages(reader, writer):
+    """The text of each message on the socket until it closes, answering pings"""
+    parts = []
+    while True:
+        fin, opcode, payload = await read_frame(reader)
+        if opcode == OP_CLOSE:
+            if not writer.is_closing():
+                writer.write(encode_frame(OP_CLOSE, payload[:2]))
+            return
+        if opcode == OP_PING:
+            writer.write(encode_frame(OP_PONG, payload))
+            continue
+        if opcode == OP_PONG:
+            continue
+        parts.append(payload)
+        if sum(len(part) for part in parts) > MAX_MESSAGE_BYTES:
+            raise BadRequest("message too big")
+        if fin:
+            yield b"".join(parts).decode("utf-8")
+            parts = []
+
+
+async def read_request(reader):
+    """(method, path, headers, body) of the next request on the connection, None
+    once the client closed it"""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as error:
+        if error.partial.strip():
+            raise BadRequest("request cut short")
+        return None
+    except asyncio.LimitOverrunError:
+        raise BadRequest("headers too big")
+    request_line, *header_lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, _ = request_line.split(" ")
+    except ValueError:
+        raise BadRequest(f"bad request line {request_line!r}")
+    headers = {}
+    for line in header_lines:
+        if line:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length") or 0)
+    if length > MAX_BODY_BYTES:
+        raise BadRequest(f"body of {length} bytes")
+    body = await reader.readexactly(length) if length else b""
+    return method, target.split("?")[0], headers, body
+
+
+def http_response(result, keep_alive):
+    status = HTTPStatus(result.get("statusCode", 500))
+    body = result.get("body") or ""
+    body = base64.b64decode(body) if result.get("isBase64Encoded") else body.encode("utf-8")
+    headers = {"Content-Type": "application/json", **(result.get("headers") or {})}
+    headers["Content-Length"] = str(len(body))
+    headers["Connection"] = "keep-alive" if keep_alive else "close"
+    head = f"HTTP/1.1 {status.value} {status.phrase}\r\n" + "".join(f"{k}: {v}\r\n" for k, v in headers.items())
+    return head.encode("latin-1") + b"\r\n" + body
+
+
+def socket_event(route_key, connection_id, body=None):
+    event = {"requestContext": {"routeKey": route_key, "connectionId": connection_id}}
+    if body is not None:
+        event["body"] = body
+    return event
+
+
+def socket_route_of(message):
+    try:
+        action = json.loads(message).get("action")
+    except (ValueError, AttributeError):
+        return "$default"
+    return action if action in SOCKET_ROUTES else "$default"
+
+
+class GoneException(Exception):
+    pass
+
+
+class _SocketExceptions:
+    GoneException = GoneException
+
+
+class SocketGateway:
+    """Stands in for the API Gateway management client, posting straight to the
+    sockets this process holds. Called from the pool's threads, the frames are
+    written from the event loop."""
+
+    exceptions = _SocketExceptions
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.writers = {}
+
+    def post_to_connection(self, ConnectionId, Data):
+        writer = self.writers.get(ConnectionId)
+        if writer is None or writer.is_closing():
+            raise GoneException(ConnectionId)
+        frame = encode_frame(OP_TEXT, Data.encode("utf-8") if isinstance(Data, str) else Data)
+        self.loop.call_soon_threadsafe(self._write, writer, frame)
+        return {"ResponseMetadata": {"HTTPStatusCode": 200}}
+
+    @staticmethod
+    def _write(writer, frame):
+        if not writer.is_closing():
+            writer.write(frame)
+
+
+class PoolInvoker:
+    """Stands in for the Lambda client, the function invoking itself (a broadcast)
+    runs on the pool"""
+
+    def __init__(self, pool, handler):
+        self.pool = pool
+        self.handler = handler
+
+    def invoke(self, FunctionName, Payload, InvocationType="RequestResponse", **kwargs):
+        event = json.loads(Payload)
+        if InvocationType == "Event":
+            self.pool.submit(self.handler, event, None)
+            return {"StatusCode": 202}
+        return {"StatusCode": 200, "Payload": json.dumps(self.handler(event, None))}
+
+
+class Server:
+    def __init__(self, handler, pool, gateway, stage=None):
+        self.handler = handler
+        self.pool = pool
+        self.gateway = gateway
+        self.stage_prefix = f"/{stage}" if stage else None
+        self.connection_count = 0
+        self.handlers = {}
+
+    async def run(self, event):
+        return await asyncio.get_running_loop().run_in_executor(self.pool, self.handler, event, None)
+
+    async def close(self):
+        """Closes every connection, waiting for the sockets' $disconnect"""
+        for writer in self.gateway.writers.values():
+            writer.write(encode_frame(OP_CLOSE, struct.pack("!H", 1001)))
+        for writer in self.handlers:
+            writer.close()
+        await asyncio.gather(*self.handlers.values(), return_exceptions=True)
+
+    async def handle(self, reader, writer):
+        self.handlers[writer] = asyncio.current_task()
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    return
+                method, path, headers, body = request
+                if headers.get("upgrade", "").lower() == "websocket":
+                    await self.serve_socket(reader, writer, headers)
+                    return
+                if self.stage_prefix and path.startswith(self.stage_prefix + "/"):
+                    path = path[len(self.stage_prefix) :]
+                event = {
+                    "path": path,
+                    "httpMethod": method,
+                    "headers": headers,
+                    "body": body.decode("utf-8") if body else None,
+                    "isBase64Encoded": False,
+                }
+                result = await self.run(event)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write(http_response(result, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except BadRequest as error:
+            print(f"Bad request: {error}")
+            if not writer.is_closing():
+                writer.write(http_response({"statusCode": 400, "body": json.dumps({"message": "Bad request"})}, False))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.handlers.pop(writer, None)
+            writer.close()
+
+    async def serve_socket(self, reader, writer, headers):
+        key = headers.get("sec-websocket-key")
+        if not key:
+            raise BadRequest("no Sec-WebSocket-Key")
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode("ascii")).digest()).decode("ascii")
+        writer.write(
+            (
+                "HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                f"Sec-WebSocket-Accept: {accept}\r\n\r\n"
+            ).encode("ascii")
+        )
+        # shaped like API Gateway's, unique for the life of the process
+        self.connection_count += 1
+        connection_id = base64.urlsafe_b64encode(os.urandom(9)).decode("ascii") + str(self.connection_count)
+        connected = await self.run(socket_event("$connect", connection_id))
+        if connected.get("statusCode") != 200:
+            writer.write(encode_frame(OP_CLOSE, struct.pack("!H", 1011)))
+            return
+        self.gateway.writers[connection_id] = writer
+        try:
+            async for message in read_messages(reader, writer):
+                # the routes post what they have to say, like behind API Gateway
+                # without route responses
+                await self.run(socket_event(socket_route_of(message), connection_id, message))
+        except (BadRequest, UnicodeDecodeError) as error:
+            print(f"Closing {connection_id}: {error}")
+        finally:
+            self.gateway.writers.pop(connection_id, None)
+            await self.run(socket_event("$disconnect", connection_id))
+
+
+def load_snapshot(table, path):
+    if not path or not os.path.exists(path):
+        return 0
+    with open(path) as file:
+        items = json.load(file)
+    table.load(items)
+    return len(items)
+
+
+def save_snapshot(table, path):
+    items = table.dump()
+    with open(path + ".tmp", "w") as file:
+        json.dump(items, file)
+    os.replace(path + ".tmp", path)
+
+
+def expire_items(table, handler):
+    """Drops the items past their expiration, like TTL, and hands the removed
+    items to the handler like the table's stream"""
+    removed = table.expire(int(time.time()))
+    if removed:
+        handler({"Records": [{"eventName": "REMOVE", "dynamodb": {"OldImage": item}} for item in removed]}, None)
+
+
+async def serve(args, dynamo=None):
+    """Runs until SIGINT or SIGTERM, dynamo stands in for the table with
+    --store dynamodb (the benchmarks give it latency)"""
+    import lambda_function
+    from chesswithhumans import utils
+    from chesswithhumans.game_cache import game_cache
+    from chesswithhumans.pacing import load_meter
+
+    loop = asyncio.get_running_loop()
+    pool = ThreadPoolExecutor(max_workers=args.workers)
+    gateway = SocketGateway(loop)
+    utils.apigw.use(gateway)
+    utils.lambda_client.use(PoolInvoker(pool, lambda_function.lambda_handler))
+    table = None
+    if args.store == "memory":
+        from chesswithhumans.local_aws import MemoryTable
+
+        table = dynamo = MemoryTable()
+        if args.snapshot:
+            print(f"Loaded {load_snapshot(table, args.snapshot)} items from {args.snapshot}")
+    if args.archive_dir:
+        from chesswithhumans.local_aws import FakeS3
+
+        utils.s3.use(FakeS3(directory=args.archive_dir))
+    if dynamo is not None:
+        utils.dynamo.use(dynamo)
+    game_cache.max_entries = args.game_cache
+    game_cache.ttl_seconds = args.game_cache_ttl
+    # busy is every worker busy, not one
+    load_meter.capacity = args.workers
+
+    server = Server(lambda_function.lambda_handler, pool, gateway, args.stage)
+    listener = await asyncio.start_server(server.handle, args.host, args.port, limit=MAX_BODY_BYTES)
+    host, port = listener.sockets[0].getsockname()[:2]
+    print(f"Listening on http://{host}:{port}", flush=True)
+    if args.quiet:
+        # the routes print a line or more per request
+        sys.stdout = open(os.devnull, "w")
+
+    stop = asyncio.Event()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, stop.set)
+    async with listener:
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), args.snapshot_seconds)
+            except asyncio.TimeoutError:
+                pass
+            if stop.is_set():
+                # the sockets' $disconnect goes into the last snapshot
+                await server.close()
+            if table is not None:
+                await loop.run_in_executor(pool, expire_items, table, lambda_function.lambda_handler)
+                if args.snapshot:
+                    await loop.run_in_executor(pool, save_snapshot, table, args.snapshot)
+    pool.shutdown(wait=True)
+    print("Stopped")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080, help="0 picks a free one")
+    parser.add_argument("--store", choices=("dynamodb", "memory"), default="dynamodb")
+    parser.add_argument("--snapshot", help="file the memory store is saved to and loaded from")
+    parser.add_argument(
+        "--snapshot-seconds", type=float, default=SNAPSHOT_SECONDS, help="between snapshots and expiring items"
+    )
+    parser.add_argument("--archive-dir", help="archive finished games to this folder instead of S3")
+    parser.add_argument("--stage", help="path prefix to drop, like the stage of an API Gateway URL")
+    parser.add_argument("--workers", type=int, default=32, help="threads the routes run on")
+    parser.add_argument("--game-cache", type=int, default=10000, help="games kept in memory")
+    parser.add_argument("--game-cache-ttl", type=float, default=3600)
+    parser.add_argument("--quiet", action="store_true", help="no output from the routes")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    if args.archive_dir:
+        # read when the routes are imported
+        os.environ.setdefault("ARCHIVE_BUCKET", "local-archive")
+    asyncio.run(serve(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,104 @@
+import base64
 import json
 import os
+import threading
 import urllib
-import boto3
-from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+import zlib
+from functools import cache
+
+from chesswithhumans.instrumentation import is_sampled, timed
 
 DOMAIN_NAME = os.environ.get("DOMAIN_NAME")
 TABLE_NAME = os.environ.get("DYNAMODB_TABLE_NAME")
 APIGW_WS_ENDPOINT = os.environ.get("APIGW_WS_ENDPOINT")
+# set by Lambda, the function invokes itself to broadcast moves to spectators
+FUNCTION_NAME = os.environ.get("AWS_LAMBDA_FUNCTION_NAME")
+
+
+class LazyClient:
+    """Stands in for a boto3 client and only creates it the first time it is used,
+    so an invocation that never talks to a service does not pay for loading it.
+    In sampled invocations every call is timed as the phase <service>_<operation>."""
+
+    def __init__(self, factory, service_name):
+        self.factory = factory
+        self.service_name = service_name
+        self.client = None
+        # a broadcast can make the first call from several threads at once
+        self.lock = threading.Lock()
+
+    def use(self, client):
+        self.client = client
+
+    def __getattr__(self, name):
+        if self.client is None:
+            with self.lock:
+                if self.client is None:
+                    self.client = self.factory()
+        attribute = getattr(self.client, name)
+        if callable(attribute) and is_sampled():
+            return timed(f"{self.service_name}_{name}")(attribute)
+        return attribute
+
+
+def _boto3_client(*args, **kwargs):
+    def factory():
+        import boto3
+
+        return boto3.client(*args, **kwargs)
+
+    return factory
+
 
-apigw = boto3.client("apigatewaymanagementapi", endpoint_url=APIGW_WS_ENDPOINT)
-dynamo = boto3.client("dynamodb")
+apigw = LazyClient(_boto3_client("apigatewaymanagementapi", endpoint_url=APIGW_WS_ENDPOINT), "apigw")
+dynamo = LazyClient(_boto3_client("dynamodb"), "dynamo")
+lambda_client = LazyClient(_boto3_client("lambda"), "lambda")
+s3 = LazyClient(_boto3_client("s3"), "s3")
 
 
+# Bodies at least this big are compressed for clients that accept gzip or
+# deflate, even a /get of 600 bytes halves, which is 40ms on a 2G phone for
+# 25us here (see benchmarks/compression.py). API Gateway gets them base64
+# encoded and sends the client the bytes (a REST API needs */* in its binary
+# media types for that).
+COMPRESSION_MIN_BYTES = int(os.environ.get("COMPRESSION_MIN_BYTES", "256"))
+COMPRESSION_LEVEL = int(os.environ.get("COMPRESSION_LEVEL", "6"))
+# zlib's wbits for each Content-Encoding, in order of preference
+ENCODINGS = {"gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
+
+
+def header(event, name):
+    """A request header, API Gateway does not always lowercase their names"""
+    for key, value in ((event or {}).get("headers") or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def accepted_encoding(event):
+    """gzip or deflate if the client's Accept-Encoding allows it, None otherwise"""
+    accepted = set()
+    for part in (header(event, "accept-encoding") or "").lower().replace(" ", "").split(","):
+        encoding, _, quality = part.partition(";q=")
+        try:
+            if quality and float(quality) == 0:
+                # q=0 means not this one
+                continue
+        except ValueError:
+            continue
+        accepted.add(encoding)
+    for encoding in ENCODINGS:
+        if encoding in accepted or "*" in accepted:
+            return encoding
+    return None
+
+
+def compress(text, encoding, level=COMPRESSION_LEVEL):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, ENCODINGS[encoding])
+    return compressor.compress(text.encode("utf-8")) + compressor.flush()
+
+
+@timed("serialize")
 def format_response(event, http_code, body, headers=None):
     if isinstance(body, str):
         body = {"message": body}
@@ -25,13 +112,23 @@ def format_response(event, http_code, body, headers=None):
     }
     if headers is not None:
         all_headers.update(headers)
-    return {
+    response = {
         "statusCode": http_code,
         "body": json.dumps(body),
         "headers": all_headers,
     }
+    if len(response["body"]) >= COMPRESSION_MIN_BYTES:
+        encoding = accepted_encoding(event)
+        if encoding:
+            all_headers["Content-Type"] = "application/json"
+            all_headers["Content-Encoding"] = encoding
+            all_headers["Vary"] = "Accept-Encoding"
+            response["body"] = base64.b64encode(compress(response["body"], encoding)).decode("ascii")
+            response["isBase64Encoded"] = True
+    return response
 
 
+@timed("parse_body")
 def parse_body(body):
     if isinstance(body, dict):
         return body
@@ -41,13 +138,22 @@ def parse_body(body):
         return dict(urllib.parse.parse_qsl(body))
 
 
+# importing boto3 is most of a cold start, so it waits for the first route that
+# talks to DynamoDB
+@cache
+def _dynamo_types():
+    from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+    return TypeDeserializer(), TypeSerializer()
+
+
 def dynamo_obj_to_python_obj(dynamo_obj: dict) -> dict:
-    deserializer = TypeDeserializer()
+    deserializer = _dynamo_types()[0]
     return {k: deserializer.deserialize(v) for k, v in dynamo_obj.items()}
 
 
 def python_obj_to_dynamo_obj(python_obj: dict) -> dict:
-    serializer = TypeSerializer()
+    serializer = _dynamo_types()[1]
     return {k: serializer.serialize(v) for k, v in python_obj.items()}
 
 
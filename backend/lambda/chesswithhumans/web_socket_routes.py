@@ -4,70 +4,116 @@ from .utils import (
     TABLE_NAME,
     python_obj_to_dynamo_obj,
     dynamo_obj_to_python_obj,
-    apigw,
 )
+from .connections import (
+    add_connection,
+    register_connection,
+    remove_connection,
+    post_to_connection,
+    SPECTATOR,
+)
+from .pacing import pacing_hints
 from .input_validation import (
     validate_word_id,
     validate_letter_id,
-    validate_schema,
+    validate_wire_format,
+    validate_true,
+    compile_schema,
 )
 
+# players register with their password, spectators with "spectate": true instead
 REGISTER_SCHEMA = {
     "type": dict,
     "fields": [
         {"type": validate_word_id, "name": "game_id"},
-        {"type": validate_letter_id, "name": "password"},
+        {"type": validate_letter_id, "name": "password", "optional": True},
+        {"type": validate_true, "name": "spectate", "optional": True},
+        {"type": validate_wire_format, "name": "format", "optional": True},
     ],
 }
 
+# compiled once here instead of interpreting the schemas on every request
+REGISTER_VALIDATOR = compile_schema(REGISTER_SCHEMA)
+
+
 def register_websocket_id(connection_id, body):
-    game_id = body['game_id']
-    password = body['password']
+    game_id = body["game_id"]
+    password = body["password"]
     response = dynamo.get_item(
         TableName=TABLE_NAME,
         Key=python_obj_to_dynamo_obj({"key1": "game", "key2": game_id}),
+        ProjectionExpression="player_one_password, player_two_password, whose_turn, moved_at, move_gap, archived",
     )
     if "Item" not in response:
-        output = {"statusCode": 400, "body": f"Could not register {connection_id} for game {game_id} because game_id is not found in the database"}
+        output = {
+            "statusCode": 400,
+            "body": f"Could not register {connection_id} for game {game_id}"
+            " because game_id is not found in the database",
+        }
         print(output)
         return output
     # If it is, check passwords
     game_data = dynamo_obj_to_python_obj(response["Item"])
     if game_data["player_one_password"] == password:
-        connection_id_key = "player_one_connection_id"
-    elif game_data["player_two_password"] == password:
-        connection_id_key = "player_two_connection_id"
+        player_id = 1
+    elif game_data.get("player_two_password") == password:
+        player_id = 2
     else:
-        output = {"statusCode": 400, "body": f"Could not register {connection_id} for game {game_id} as the wrong password was provided"}
+        output = {
+            "statusCode": 400,
+            "body": f"Could not register {connection_id} for game {game_id} as the wrong password was provided",
+        }
         print(output)
         return output
-    game_data[connection_id_key] = connection_id
-    write_response = dynamo.put_item(
-        TableName=TABLE_NAME,
-        Item=python_obj_to_dynamo_obj(game_data)
-    )
+    # The game item is left alone, the socket goes in the connection registry
+    write_response = register_connection(connection_id, game_id, player_id, body.get("format", "full"))
     if (
         "ResponseMetadata" not in write_response
         or "HTTPStatusCode" not in write_response["ResponseMetadata"]
         or write_response["ResponseMetadata"]["HTTPStatusCode"] != 200
     ):
-        output = {"statusCode": 400, "body": f"Could not register {connection_id} for game {game_id} due to db connection issue"}
+        output = {
+            "statusCode": 400,
+            "body": f"Could not register {connection_id} for game {game_id} due to db connection issue",
+        }
         print(output)
         return output
     # Send a response back to this same connection
     event_text = "registered"
-    if connection_id_key == "player_one_connection_id" and game_data['whose_turn'] == 1:
-        event_text = "move"
-    elif connection_id_key == "player_two_connection_id" and game_data['whose_turn'] == 2:
+    if game_data["whose_turn"] == player_id:
         event_text = "move"
-    apigw.post_to_connection(
-        ConnectionId=connection_id,
-        Data=json.dumps({"event": event_text})
-    )
+    hints = pacing_hints(game_data, player_id)
+    post_to_connection(connection_id, json.dumps({"event": event_text, "hints": hints}), game_id)
     output = {"statusCode": 200, "body": f"Registered {connection_id} for game {game_id}"}
     print(output)
     return output
 
+
+def register_spectator(connection_id, body):
+    # python-chess is only loaded for spectators, it is needed for the game state
+    from .chess_routes import fetch_game, build_game_output
+
+    game_id = body["game_id"]
+    game = fetch_game(game_id, with_moves=False)
+    if game is None or game[1] is None:
+        output = {
+            "statusCode": 400,
+            "body": f"Could not register {connection_id} to watch game {game_id}"
+            " because game_id is not found in the database",
+        }
+        print(output)
+        return output
+    game_data, board = game
+    wire_format = body.get("format", "full")
+    register_connection(connection_id, game_id, SPECTATOR, wire_format)
+    # the moves come as they are made, this is the state before the next one
+    game_output = build_game_output(game_id, SPECTATOR, board, game_data, wire_format)
+    post_to_connection(connection_id, json.dumps({"event": "spectating", "game": game_output}), game_id, SPECTATOR)
+    output = {"statusCode": 200, "body": f"Registered {connection_id} to watch game {game_id}"}
+    print(output)
+    return output
+
+
 def web_socket_route(event, context):
     route = event.get("requestContext", {}).get("routeKey")
     connection_id = event.get("requestContext", {}).get("connectionId")
@@ -75,9 +121,11 @@ def web_socket_route(event, context):
     print(f"Received route: {route}, connection: {connection_id}")
 
     if route == "$connect":
+        add_connection(connection_id)
         return {"statusCode": 200, "body": "Connected."}
 
     elif route == "$disconnect":
+        remove_connection(connection_id)
         return {"statusCode": 200, "body": "Disconnected."}
 
     elif route == "register":
@@ -85,10 +133,14 @@ def web_socket_route(event, context):
         message = body.get("message", {})
         print(f"Registration request received from {connection_id}: {message}")
         print(type(message))
-        registration_body = validate_schema(message, REGISTER_SCHEMA)
+        registration_body = REGISTER_VALIDATOR(message)
         if not registration_body:
-            return {"statusCode": 400, "body": f"Invalid registration payload"}
+            return {"statusCode": 400, "body": "Invalid registration payload"}
         print(registration_body)
+        if registration_body.get("spectate"):
+            return register_spectator(connection_id, registration_body)
+        if "password" not in registration_body:
+            return {"statusCode": 400, "body": "Invalid registration payload"}
         return register_websocket_id(connection_id, registration_body)
 
     elif route == "$default":
@@ -99,4 +151,4 @@ def web_socket_route(event, context):
         return {"statusCode": 200, "body": json.dumps({"echo": message})}
 
     else:
-        return {"statusCode": 400, "body": "Unknown route."}
\ No newline at end of file
+        return {"statusCode": 400, "body": "Unknown route."}
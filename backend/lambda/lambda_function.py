@@ -2,33 +2,41 @@
 # ▌ ▛▌█▌▛▘▛▘  ▌▌▌▌▜▘▛▌  ▛▌▌▌▛▛▌▀▌▛▌▛▘
 # ▙▖▌▌▙▖▄▌▄▌  ▚▚▘▌▐▖▌▌  ▌▌▙▌▌▌▌█▌▌▌▄▌
 
+import base64
 import traceback
 
 from chesswithhumans.utils import (
     format_response,
     path_equals,
 )
-from chesswithhumans.chess_routes import (
-    check_turn_route,
-    join_game_route,
-    create_game_route,
-    get_game_route,
-    make_move_route,
-)
-from chesswithhumans.web_socket_routes import (
-    web_socket_route,
-)
+from chesswithhumans.game_cache import game_cache
+from chesswithhumans.position_cache import position_cache
+from chesswithhumans.instrumentation import finish_invocation, route_name_of, start_invocation
+from chesswithhumans.pacing import load_meter
 
+# The route modules are imported by the first request that needs them, so a
+# WebSocket $connect does not load python-chess and a /get does not load the
+# WebSocket code.
 
+
+# Events and results are not printed, a sample of the invocations prints one
+# line of phase timings instead (see chesswithhumans/instrumentation.py).
 def lambda_handler(event, context):
+    token = start_invocation(event)
+    # how busy this container is goes into the hints, see chesswithhumans/pacing.py
+    load_meter.start()
+    result = None
     try:
-        print(event, context)
         result = route(event, context)
-        print(result)
         return result
     except Exception:
+        print(f"Error handling {route_name_of(event)}")
         traceback.print_exc()
-        return format_response(event=event, http_code=500, body="Internal server error")
+        result = format_response(event=event, http_code=500, body="Internal server error")
+        return result
+    finally:
+        load_meter.finish()
+        finish_invocation(token, result, game_cache=game_cache.stats(), position_cache=position_cache.stats())
 
 
 # Only using POST because I want to prevent CORS preflight checks, and setting a
@@ -38,16 +46,57 @@ def lambda_handler(event, context):
 #
 # see https://developer.mozilla.org/en-US/docs/Web/HTTP/CORS#simple_requests
 def route(event, context):
+    if event.get("isBase64Encoded") and event.get("body"):
+        # binary media types make API Gateway base64 encode request bodies as well
+        event = {**event, "body": base64.b64decode(event["body"]).decode("utf-8"), "isBase64Encoded": False}
     if path_equals(event=event, method="POST", path="/get"):
+        from chesswithhumans.chess_routes import get_game_route
+
         return get_game_route(event)
     if path_equals(event=event, method="POST", path="/join"):
+        from chesswithhumans.chess_routes import join_game_route
+
         return join_game_route(event)
     if path_equals(event=event, method="POST", path="/create"):
+        from chesswithhumans.chess_routes import create_game_route
+
         return create_game_route(event)
+    if path_equals(event=event, method="POST", path="/create-batch"):
+        from chesswithhumans.chess_routes import create_games_route
+
+        return create_games_route(event)
+    if path_equals(event=event, method="POST", path="/games"):
+        from chesswithhumans.chess_routes import fetch_games_route
+
+        return fetch_games_route(event)
+    if path_equals(event=event, method="POST", path="/history"):
+        from chesswithhumans.chess_routes import history_route
+
+        return history_route(event)
+    if path_equals(event=event, method="POST", path="/pgn"):
+        from chesswithhumans.chess_routes import export_pgn_route
+
+        return export_pgn_route(event)
     if path_equals(event=event, method="POST", path="/move"):
+        from chesswithhumans.chess_routes import make_move_route
+
         return make_move_route(event)
     if path_equals(event=event, method="POST", path="/is-it-my-turn"):
+        from chesswithhumans.chess_routes import check_turn_route
+
         return check_turn_route(event)
-    if 'requestContext' in event and 'routeKey' in event['requestContext']:
+    if "Records" in event:
+        # the table's stream, TTL removing games nobody finished
+        from chesswithhumans.archive import archive_stream_route
+
+        return archive_stream_route(event)
+    if "broadcast" in event:
+        # queued by a move for the game's spectators, see connections.queue_broadcast
+        from chesswithhumans.connections import broadcast_route
+
+        return broadcast_route(event)
+    if "requestContext" in event and "routeKey" in event["requestContext"]:
+        from chesswithhumans.web_socket_routes import web_socket_route
+
         return web_socket_route(event, context)
     return format_response(event=event, http_code=403, body={"message": "Forbidden"})
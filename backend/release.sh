@@ -6,11 +6,10 @@ else
 fi
 
 if $lambda; then
-    cd lambda/
-    cp -r ../.venv/lib/python3.14/site-packages/chess .
+    sh build-bundle.sh
+    cd build/lambda/
     TIMESTAMP=$(date +%s)
-    zip -vr ../lambda-release-${ENV}-${TIMESTAMP}.zip . -x "*.DS_Store" -x "*.test.py" -x "*__pycache__/*"
-    rm -r chess/
-    cd ../
+    zip -vr ../../lambda-release-${ENV}-${TIMESTAMP}.zip .
+    cd ../../
     aws lambda update-function-code --function-name=chess-with-humans-api${FUNCTION_SUFFIX} --zip-file=fileb://lambda-release-${ENV}-${TIMESTAMP}.zip --no-cli-pager
 fi
\ No newline at end of file
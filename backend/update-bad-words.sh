@@ -0,0 +1,12 @@
+#!/bin/bash
+# Writes the profanity list bundled with the lambda: the word list of
+# better_profanity 0.7.0 (MIT), pinned so running this again gives the same
+# list, commit the result. Bump the version on purpose, and check
+# `python -m benchmarks.bad_words` with the new list.
+set -e
+VERSION=0.7.0
+TMP=$(mktemp -d)
+trap 'rm -rf "$TMP"' EXIT
+python3 -m pip download --quiet --no-deps --dest "$TMP" "better_profanity==$VERSION"
+python3 -m zipfile -e "$TMP"/better_profanity-$VERSION-py3-none-any.whl "$TMP/wheel"
+cp "$TMP/wheel/better_profanity/profanity_wordlist.txt" lambda/chesswithhumans/bad_words_en.txt